@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+# How long the scheduler waits for more requests after the first one arrives
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 20))
+# Upper bound on prompts padded into one model.generate call
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+# Requests waiting beyond this depth are rejected with 503 instead of queueing
+BATCH_MAX_QUEUE = int(os.environ.get("BATCH_MAX_QUEUE", 64))
+# Per-request deadline (seconds) covering queueing and generation
+BATCH_TIMEOUT_S = float(os.environ.get("BATCH_TIMEOUT_S", 30))
+
+
+class QueueFullError(Exception):
+    """Raised when the generation queue is at capacity."""
+
+
+class _PendingRequest:
+    __slots__ = ("input_ids", "options", "future", "deadline")
+
+    def __init__(self, input_ids, options, deadline):
+        self.input_ids = input_ids
+        self.options = options
+        self.future = Future()
+        self.deadline = deadline
+
+
+class GenerationBatcher:
+    """Collects concurrent generation requests into padded batches.
+
+    generate_batch(list_of_input_ids, generate_kwargs) must return one result per
+    input, in order. Requests are only batched with others that use the same
+    generate kwargs, so different decoding settings never share a generate call.
+    """
+
+    def __init__(self, generate_batch, max_batch_size=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS,
+                 max_queue_depth=BATCH_MAX_QUEUE, timeout=BATCH_TIMEOUT_S):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self.timeout = timeout
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._worker = None
+
+        self.batches = 0
+        self.batched_requests = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def submit(self, input_ids, **generate_kwargs):
+        """Queue a prompt and return a Future for its result."""
+        options = tuple(sorted(generate_kwargs.items()))
+        request = _PendingRequest(input_ids, options, time.monotonic() + self.timeout)
+
+        with self._condition:
+            if len(self._queue) >= self.max_queue_depth:
+                self.rejected += 1
+                raise QueueFullError(f"Generation queue is full ({self.max_queue_depth} pending requests).")
+            self._queue.append(request)
+            self._ensure_worker()
+            self._condition.notify()
+        return request.future
+
+    def generate(self, input_ids, **generate_kwargs):
+        """Submit a prompt and block until its result is ready or the request deadline passes."""
+        future = self.submit(input_ids, **generate_kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop it from the queue if generation has not started yet
+            future.cancel()
+            with self._condition:
+                self.timed_out += 1
+            raise
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._queue)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "max_batch_size": self.max_batch_size,
+                "window_ms": self.window * 1000.0,
+                "batches": self.batches,
+                "batched_requests": self.batched_requests,
+                "avg_batch_size": round(self.batched_requests / self.batches, 2) if self.batches else 0.0,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="generation-batcher", daemon=True)
+            self._worker.start()
+
+    def _next_batch(self):
+        """Wait for a first request, then gather compatible ones until the window closes or the batch is full."""
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+
+            options = self._queue[0].options
+            window_end = time.monotonic() + self.window
+            while True:
+                compatible = sum(1 for pending in self._queue if pending.options == options)
+                remaining = window_end - time.monotonic()
+                if compatible >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch, leftover = [], deque()
+            for pending in self._queue:
+                if pending.options == options and len(batch) < self.max_batch_size:
+                    batch.append(pending)
+                else:
+                    leftover.append(pending)
+            self._queue = leftover
+
+        now = time.monotonic()
+        ready = []
+        for pending in batch:
+            # Skip requests whose caller already gave up
+            if pending.deadline < now:
+                pending.future.cancel()
+            if pending.future.set_running_or_notify_cancel():
+                ready.append(pending)
+        return ready, dict(options)
+
+    def _run(self):
+        while True:
+            batch, generate_kwargs = self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = self.generate_batch([pending.input_ids for pending in batch], generate_kwargs)
+                if len(results) != len(batch):
+                    # Matching outputs to requests by position would leave some futures waiting forever
+                    raise RuntimeError(f"Batch of {len(batch)} prompts returned {len(results)} outputs")
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+
+            with self._condition:
+                self.batches += 1
+                self.batched_requests += len(batch)
+            for pending, result in zip(batch, results):
+                pending.future.set_result(result)
@@ -0,0 +1,1446 @@
+"""
+Offline benchmarks for the text-to-SQL service.
+
+Run from the Text-to-Sql directory, e.g.:
+    python benchmark.py schema-cache --tables 500 --requests 200
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+
+
+def synthetic_schema(num_tables, columns_per_table=8):
+    """Build a schema string shaped like the one fetchDatabaseSchema sends, with FK-style *_id columns."""
+    tables = []
+    for i in range(num_tables):
+        columns = [f"table{i}_id", "name", "created_at", "status"]
+        if i > 0:
+            columns.append(f"table{i - 1}_id")
+        columns += [f"attr{i}_{j}" for j in range(columns_per_table - len(columns))]
+        tables.append(f"table{i}({', '.join(columns)})")
+    return ", ".join(tables)
+
+
+def time_call(fn, repeat):
+    """Return per-call wall times in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(label, samples):
+    print(f"{label:<44} mean {statistics.mean(samples):8.3f} ms   p50 {statistics.median(samples):8.3f} ms   "
+          f"p99 {percentile(samples, 0.99):8.3f} ms")
+
+
+def run_concurrently(fn, inputs, concurrency):
+    """Call fn on every input from `concurrency` threads; return (per-call latencies in ms, wall seconds)."""
+    latencies = []
+    lock = threading.Lock()
+    next_index = iter(range(len(inputs)))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            fn(inputs[index])
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+SAMPLE_QUESTIONS = [
+    "list all customers",
+    "show orders from Karachi",
+    "top 5 products by price",
+    "how many orders were placed in 2024",
+    "customers who have not placed orders",
+    "total amount per customer",
+    "show the email of customers with pending payments",
+    "list products with stock less than 10",
+]
+
+
+def bench_schema_cache(args):
+    from schema_cache import ParsedSchema, parse_schema, schema_cache
+    from sql_postprocess import fix_sql_query
+
+    schema = synthetic_schema(args.tables)
+    question = "show name and status of table3 records"
+    raw_sql = "SELECT name, status FROM table3 JOIN table2 ON table3.table2_id = table2.table2_id"
+
+    print(f"Schema: {args.tables} tables, {len(schema):,} characters")
+
+    parse_samples = time_call(lambda: ParsedSchema(schema), args.requests)
+    report("parse only (uncached)", parse_samples)
+
+    def cold_request():
+        schema_cache.clear()
+        fix_sql_query(raw_sql, question, parse_schema(schema))
+
+    def warm_request():
+        fix_sql_query(raw_sql, question, parse_schema(schema))
+
+    cold_samples = time_call(cold_request, args.requests)
+    warm_samples = time_call(warm_request, args.requests)
+    report("fix_sql_query, cache miss every request", cold_samples)
+    report("fix_sql_query, cache hit", warm_samples)
+
+    # Before the cache, one request parsed the schema in 8 places
+    previous = [warm + 8 * parse for warm, parse in zip(warm_samples, parse_samples)]
+    report("estimated previous cost (8 parses/request)", previous)
+    print(f"Cache stats: {schema_cache.stats()}")
+
+
+def bench_batching(args):
+    import app
+    from batching import GenerationBatcher
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the batching benchmark needs ./model.")
+
+    schema = synthetic_schema(args.tables)
+    prompts = [app.encode_prompt(SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], schema) for i in range(args.requests)]
+    generate_kwargs = app.GENERATION_TIERS[0].generate_kwargs
+    print(f"{args.requests} requests, concurrency {args.concurrency}, window {args.window} ms, "
+          f"prompt length {len(prompts[0])} tokens")
+
+    for batch_size in args.batch_sizes:
+        batcher = GenerationBatcher(app.generate_batch, max_batch_size=batch_size, window_ms=args.window,
+                                    max_queue_depth=args.requests, timeout=3600)
+        batcher.generate(prompts[0], **generate_kwargs)  # warm-up
+        latencies, wall = run_concurrently(lambda ids: batcher.generate(ids, **generate_kwargs),
+                                           prompts, args.concurrency)
+        print(f"batch size {batch_size:>3}: {len(latencies) / wall:7.2f} req/s   "
+              f"p50 {statistics.median(latencies):9.1f} ms   p99 {percentile(latencies, 0.99):9.1f} ms   "
+              f"avg batch {batcher.stats()['avg_batch_size']}")
+
+
+def bench_single_flight(args):
+    import app
+    from question_templates import template_cache
+    from result_cache import result_cache
+    from single_flight import single_flight
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the single-flight benchmark needs ./model.")
+
+    schema_tables = app.parse_schema(RETAIL_SCHEMA)
+    # Each burst: every question asked `copies` times at once, as a dashboard refresh or retrying clients do
+    questions = [question for question in SAMPLE_QUESTIONS[:args.questions] for _ in range(args.copies)]
+    generations = 0
+    generate = app.generation_batcher.generate
+
+    def counting_generate(*a, **kw):
+        nonlocal generations
+        generations += 1
+        return generate(*a, **kw)
+
+    app.answer_question(questions[0], RETAIL_SCHEMA, schema_tables)  # warm-up
+    print(f"{args.bursts} bursts of {len(questions)} requests ({args.questions} questions x {args.copies} copies)")
+    configured = single_flight.enabled
+    app.generation_batcher.generate = counting_generate
+    try:
+        for enabled in (False, True):
+            single_flight.enabled = enabled
+            generations = 0
+            latencies, wall, cpu = [], 0.0, 0.0
+            for _ in range(args.bursts):
+                result_cache.clear()
+                template_cache.clear()
+                cpu_start = time.process_time()
+                burst_latencies, burst_wall = run_concurrently(
+                    lambda question: app.answer_question(question, RETAIL_SCHEMA, schema_tables),
+                    questions, len(questions))
+                cpu += time.process_time() - cpu_start
+                latencies += burst_latencies
+                wall += burst_wall
+            label = "coalesced" if enabled else "independent"
+            print(f"{label:<12} {generations:>5} generate calls   CPU {cpu:7.2f} s   wall {wall:7.2f} s   "
+                  f"p50 {statistics.median(latencies):9.1f} ms   p99 {percentile(latencies, 0.99):9.1f} ms")
+        print(f"single_flight: {single_flight.stats()}")
+    finally:
+        app.generation_batcher.generate = generate
+        single_flight.enabled = configured
+
+
+def process_memory(pid):
+    """RSS, PSS (shared pages split between the processes using them) and private bytes, or None (Linux)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    kib = lambda name: int(fields.get(name, "0 kB").split()[0]) * 1024
+    return kib("Rss"), kib("Pss"), kib("Private_Clean") + kib("Private_Dirty")
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def bench_prefork(args):
+    import subprocess
+    import urllib.error
+    import urllib.request
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    # No result / template cache hits, so every repeated question reaches the model
+    env = dict(os.environ, PORT=str(args.port), RESULT_CACHE_SIZE="0", TEMPLATE_CACHE_SIZE="0")
+    questions = [SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)] for i in range(args.requests)]
+
+    def post(question):
+        request = urllib.request.Request(f"{base_url}/nl-to-sql", data=json.dumps({"question": question}).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=600).read()
+        except urllib.error.HTTPError:
+            pass  # validation errors are answers too
+
+    def wait_ready(process):
+        deadline = time.monotonic() + args.startup_timeout
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                if urllib.request.urlopen(f"{base_url}/ready", timeout=5).status == 200:
+                    return True
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.5)
+        return False
+
+    servers = [("single process (app.py)", [sys.executable, "app.py"])]
+    servers += [(f"prefork, {workers} workers", [sys.executable, "prefork.py", "--workers", str(workers)])
+                for workers in args.workers]
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {os.cpu_count()} cores")
+    for label, command in servers:
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_ready(process):
+                print(f"{label}: not ready after {args.startup_timeout} s, skipped")
+                continue
+            for question in SAMPLE_QUESTIONS[:args.concurrency]:
+                post(question)  # first request of each worker
+            latencies, wall = run_concurrently(post, questions, args.concurrency)
+            workers = child_pids(process.pid) or [process.pid]
+            memory = [process_memory(pid) for pid in workers]
+            print(f"{label:<26} {len(latencies) / wall:7.2f} req/s   p50 {statistics.median(latencies):8.1f} ms   "
+                  f"p99 {percentile(latencies, 0.99):8.1f} ms")
+            if all(memory):
+                # The prefork parent holds the pages the workers share too
+                total_pss = sum(process_memory(pid)[1] for pid in {process.pid, *workers})
+                print(f"  per worker: RSS {statistics.mean(rss for rss, _, _ in memory) / 2 ** 20:7.1f} MiB   "
+                      f"private {statistics.mean(private for _, _, private in memory) / 2 ** 20:7.1f} MiB   "
+                      f"total PSS {total_pss / 2 ** 20:7.1f} MiB")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def bench_cold_start(args):
+    import subprocess
+    import urllib.error
+    import urllib.request
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    body = json.dumps({"question": args.question}).encode()
+
+    def startup_times(process):
+        """Seconds from start until the port answers, /ready is 200 and the first /nl-to-sql is answered."""
+        start = time.perf_counter()
+        listening = None
+        while time.perf_counter() - start < args.startup_timeout and process.poll() is None:
+            try:
+                urllib.request.urlopen(f"{base_url}/ready", timeout=5).read()
+                break
+            except urllib.error.HTTPError:
+                listening = listening or time.perf_counter() - start  # 503 until loaded and warmed up
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.02)
+        else:
+            return None
+        ready = time.perf_counter() - start
+        request = urllib.request.Request(f"{base_url}/nl-to-sql", data=body,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=args.startup_timeout).read()
+        except urllib.error.HTTPError as e:
+            if e.code != 400:  # rejected SQL is an answer too
+                raise SystemExit(f"/nl-to-sql answered {e.code}: {e.read().decode()[:200]}")
+        return listening or ready, ready, time.perf_counter() - start
+
+    print(f"Milliseconds from process start, median of {args.runs} runs with a warm page cache")
+    for config in args.configs:
+        overrides = dict(pair.split("=", 1) for pair in config.split())
+        env = dict(os.environ, PORT=str(args.port), **overrides)
+        samples, startup = [], {}
+        for _ in range(args.runs):
+            process = subprocess.Popen([sys.executable, "app.py"], env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                times = startup_times(process)
+                if times is None:
+                    raise SystemExit(f"{config or 'defaults'}: not ready after {args.startup_timeout} s")
+                samples.append(times)
+                startup = json.loads(urllib.request.urlopen(f"{base_url}/stats").read()).get("startup", {})
+            finally:
+                process.terminate()
+                process.wait()
+        listening, ready, answered = (statistics.median(column) * 1000.0 for column in zip(*samples))
+        print(f"{config or 'defaults':<44} listening {listening:6.0f}   ready {ready:6.0f}   "
+              f"first answer {answered:6.0f}")
+        if startup:
+            print("  startup: " + ", ".join(f"{name} {value}" for name, value in startup.items()))
+
+
+RETAIL_SCHEMA = ("Customers(customer_id, first_name, last_name, email, phone, city, created_at), "
+                 "Orders(order_id, customer_id, order_date, total_amount, status), "
+                 "OrderItems(order_item_id, order_id, product_id, quantity, price), "
+                 "Products(product_id, name, category, price, stock), "
+                 "Payments(payment_id, order_id, amount, payment_method, payment_status)")
+
+HOSPITAL_SCHEMA = ("Patients(patient_id, first_name, last_name, date_of_birth, gender, city), "
+                   "Doctors(doctor_id, name, specialty, phone), "
+                   "Appointments(appointment_id, patient_id, doctor_id, appointment_date, status), "
+                   "Treatments(treatment_id, appointment_id, description, cost), "
+                   "Billing(bill_id, appointment_id, patient_id, amount, payment_status)")
+FAMILY_SCHEMAS = {"RetailDB": RETAIL_SCHEMA, "HospitalDB": HOSPITAL_SCHEMA}
+
+
+def bench_residency(args):
+    import app
+    from model_residency import MODEL_CHECKPOINTS, ModelResidency, parse_checkpoints
+    from question_templates import template_cache
+    from result_cache import result_cache
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the residency benchmark needs ./model.")
+    checkpoints = parse_checkpoints(args.checkpoints or MODEL_CHECKPOINTS)
+    unknown = set(checkpoints) - set(FAMILY_SCHEMAS)
+    if not checkpoints or unknown:
+        raise SystemExit(f"Pass --checkpoints with families among {', '.join(FAMILY_SCHEMAS)}.")
+
+    # Requests per family fall off by --skew: the first family is the busiest
+    families = list(checkpoints)
+    rng = random.Random(7)
+    weights = [args.skew ** rank for rank in range(len(families))]
+    requests = [(family, SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)])
+                for i, family in enumerate(rng.choices(families, weights, k=args.requests))]
+    parsed = {family: app.parse_schema(FAMILY_SCHEMAS[family]) for family in families}
+
+    def ask(request):
+        family, question = request
+        # Every request generates: the caches would otherwise answer the repeats without any model
+        result_cache.clear()
+        template_cache.clear()
+        app.answer_question(question, FAMILY_SCHEMAS[family], parsed[family])
+
+    print(f"{args.requests} requests over {', '.join(families)} (skew {args.skew}), concurrency {args.concurrency}")
+    configured = app.model_residency
+    try:
+        for budget_mb in args.budgets_mb:
+            residency = app.model_residency = ModelResidency(app.load_checkpoint, checkpoints, budget_mb * 2 ** 20)
+            latencies, wall = run_concurrently(ask, requests, args.concurrency)
+            stats = residency.stats()
+            acquired = stats["hits"] + stats["loads"]
+            print(f"budget {budget_mb:6.0f} MiB   {len(latencies) / wall:6.2f} req/s   "
+                  f"p50 {statistics.median(latencies):8.1f} ms   p99 {percentile(latencies, 0.99):8.1f} ms   "
+                  f"loads {stats['loads']:4}   evictions {stats['evictions']:4}   "
+                  f"hit rate {stats['hits'] / acquired if acquired else 0:.2f}   "
+                  f"mean load {stats['load_ms']['mean_ms']:7.1f} ms")
+    finally:
+        app.model_residency = configured
+
+
+QUESTION_LOG_PATTERNS = [
+    ("list customers from {city}", 6),
+    ("show orders from customers in {city}", 4),
+    ("top {n} products by price", 5),
+    ("show {n} orders", 3),
+    ("orders placed on {date}", 3),
+    ("payments with status '{status}'", 3),
+    ("products with stock less than {n}", 2),
+    ("list all customers", 2),
+    ("show tables", 1),
+    ("how many orders were placed", 1),
+]
+CITIES = ["Karachi", "London", "Lahore", "Dubai", "Berlin", "Paris", "Toronto", "Madrid"]
+STATUSES = ["paid", "pending", "unpaid", "refunded"]
+
+
+def synthetic_question_log(size, seed=7):
+    """Chat-style questions: a few shapes asked over and over with different literal values."""
+    rng = random.Random(seed)
+    patterns, weights = zip(*QUESTION_LOG_PATTERNS)
+    log = []
+    for _ in range(size):
+        pattern = rng.choices(patterns, weights)[0]
+        log.append(pattern.format(city=rng.choice(CITIES), n=rng.choice([3, 5, 10, 20, 50]),
+                                  date=f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                                  status=rng.choice(STATUSES)))
+    return log
+
+
+def bench_templates(args):
+    import app
+    from question_templates import template_cache
+    from result_cache import result_cache
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the template benchmark needs ./model.")
+
+    if args.log:
+        with open(args.log) as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = synthetic_question_log(args.size)
+    schema = open(args.schema).read() if args.schema else RETAIL_SCHEMA
+    schema_tables = app.parse_schema(schema)
+
+    generations = 0
+    generate = app.generation_batcher.generate
+
+    def counting_generate(*a, **kw):
+        nonlocal generations
+        generations += 1
+        return generate(*a, **kw)
+
+    app.generation_batcher.generate = counting_generate
+    result_cache.clear()
+    template_cache.clear()
+    try:
+        start = time.perf_counter()
+        for question in questions:
+            app.answer_question(question, schema, schema_tables)
+        elapsed = time.perf_counter() - start
+    finally:
+        app.generation_batcher.generate = generate
+
+    result_stats, template_stats = result_cache.stats(), template_cache.stats()
+    print(f"{len(questions)} questions, {len(set(questions))} distinct, {elapsed:.1f} s total")
+    print(f"exact-match result cache hits: {result_stats['hits']}")
+    print(f"template cache hits:           {template_stats['hits']}")
+    print(f"model.generate calls:          {generations} "
+          f"({100.0 * (1 - generations / len(questions)):.1f}% of questions answered without generation)")
+
+
+def bench_fast_path(args):
+    from fast_path import route_question
+    from schema_cache import parse_schema
+
+    if args.log:
+        with open(args.log) as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = synthetic_question_log(args.size) + SAMPLE_QUESTIONS
+    baseline = load_module(args.baseline, "baseline_postprocess") if args.baseline else None
+
+    for num_tables in [0] + args.tables:
+        schema = RETAIL_SCHEMA + (", " + synthetic_schema(num_tables) if num_tables else "")
+        schema_tables = parse_schema(schema)
+        served = {}
+        for question in questions:
+            routed = route_question(question, schema_tables)
+            intent = routed[0] if routed else "model"
+            served[intent] = served.get(intent, 0) + 1
+        answered = len(questions) - served.pop("model", 0)
+        print(f"RetailDB + {num_tables} tables: {answered}/{len(questions)} questions "
+              f"({100.0 * answered / len(questions):.1f}%) answered without model.generate   "
+              + "  ".join(f"{intent} {count}" for intent, count in sorted(served.items())))
+        samples = [sample / len(questions)
+                   for sample in time_call(lambda: [route_question(q, schema_tables) for q in questions], args.repeat)]
+        report("  router (per question)", samples)
+        if baseline is not None:
+            samples = [sample / len(questions) for sample in time_call(
+                lambda: [baseline.handle_metadata_queries(q, schema_tables) for q in questions], args.repeat)]
+            report("  baseline handle_metadata_queries (per question)", samples)
+
+
+GOLDEN_CORPUS = "postprocess_golden.json"
+
+
+def normalize_sql(sql):
+    """SQL with whitespace collapsed and keywords uppercased, for comparing post-processing output."""
+    from sqlparse import tokens as T
+    from sql_rewrite import lex
+
+    parts = []
+    for ttype, value in lex(sql):
+        if ttype in T.Whitespace:
+            parts.append(" ")
+        elif ttype in T.Keyword or ttype in T.Operator.Comparison:
+            parts.append(value.upper())
+        else:
+            parts.append(value)
+    return " ".join("".join(parts).split()).replace(" ;", ";")
+
+
+def load_golden_corpus(path=GOLDEN_CORPUS):
+    """Return (question, schema, raw sql, expected output) for every golden case."""
+    with open(path) as f:
+        corpus = json.load(f)
+    schemas = corpus["schemas"]
+    return [(case["question"], schemas[case["schema"]], case["sql"], case["expected"]) for case in corpus["cases"]]
+
+
+def long_generated_query(num_joins):
+    """A long query over synthetic_schema(num_joins + 1): a join chain, many filters, GROUP BY and ORDER BY."""
+    tables = [f"table{i}" for i in range(num_joins + 1)]
+    columns = ", ".join(f"{table}.name" for table in tables)
+    joins = " ".join(f"JOIN {tables[i]} ON {tables[i]}.{tables[i - 1]}_id = {tables[i - 1]}.{tables[i - 1]}_id"
+                     for i in range(1, len(tables)))
+    filters = " AND ".join(f"{table}.status = \"active\"" for table in tables)
+    return (f"SELECT {columns}, COUNT(*) FROM {tables[0]} {joins} WHERE {filters} "
+            f"GROUP BY {columns} ORDER BY {tables[0]}.name DESC LIMIT 10")
+
+
+def load_module(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_rewrite(args):
+    import sql_postprocess
+    from schema_cache import parse_schema
+
+    cases = load_golden_corpus(args.corpus)
+    mismatches = 0
+    for question, schema, sql, expected in cases:
+        result = sql_postprocess.fix_sql_query(sql, question, parse_schema(schema))
+        if normalize_sql(result) != normalize_sql(expected):
+            mismatches += 1
+            print(f"MISMATCH {question!r}\n  sql:      {sql}\n  expected: {expected}\n  got:      {result}")
+    print(f"Golden corpus: {len(cases) - mismatches}/{len(cases)} cases match")
+    if mismatches:
+        raise SystemExit(1)
+
+    implementations = [("token rewrite engine", sql_postprocess)]
+    if args.baseline:
+        implementations.append(("baseline", load_module(args.baseline, "baseline_sql_postprocess")))
+
+    workloads = [("golden corpus", [(q, parse_schema(schema), sql) for q, schema, sql, _ in cases])]
+    for num_joins in args.joins:
+        schema = parse_schema(synthetic_schema(num_joins + 1))
+        workloads.append((f"{num_joins}-join generated query",
+                          [("show names of active records", schema, long_generated_query(num_joins))]))
+
+    for workload, inputs in workloads:
+        means = {}
+        for label, module in implementations:
+            def run():
+                for question, schema_tables, sql in inputs:
+                    module.fix_sql_query(sql, question, schema_tables)
+
+            samples = time_call(run, args.repeat)
+            means[label] = statistics.mean(samples)
+            report(f"{workload}: {label}", samples)
+        if args.baseline:
+            print(f"{workload}: speedup x{means['baseline'] / means['token rewrite engine']:.1f}")
+
+
+def bench_tracing(args):
+    import sql_postprocess
+    import tracing
+    from schema_cache import parse_schema
+
+    inputs = [(question, parse_schema(schema), sql) for question, schema, sql, _ in load_golden_corpus(args.corpus)]
+
+    def run():
+        for question, schema_tables, sql in inputs:
+            sql_postprocess.fix_sql_query(sql, question, schema_tables)
+
+    def run_traced():
+        for question, schema_tables, sql in inputs:
+            with tracing.trace_request(debug=True):
+                sql_postprocess.fix_sql_query(sql, question, schema_tables)
+
+    off = time_call(run, args.repeat)
+    on = time_call(run_traced, args.repeat)
+    report("golden corpus: tracing off", off)
+    report("golden corpus: tracing on", on)
+    print(f"per query: {statistics.mean(off) / len(inputs) * 1000:.1f} us untraced, "
+          f"{statistics.mean(on) / len(inputs) * 1000:.1f} us traced")
+
+    # What every instrumented stage costs an untraced request
+    def untraced_stage():
+        for _ in range(10000):
+            with tracing.stage("noop"):
+                pass
+
+    per_stage_us = min(time_call(untraced_stage, 5)) / 10000 * 1000
+    print(f"untraced stage overhead: {per_stage_us:.3f} us per stage")
+
+    print("\nStages with the most total time (traced runs):")
+    stages = tracing.stage_metrics.snapshot()
+    for name, summary in sorted(stages.items(), key=lambda item: -item[1]["total_ms"])[:args.top]:
+        changed = f"   changed {summary['change_rate'] * 100:5.1f}%" if "change_rate" in summary else ""
+        print(f"  {name:<36} mean {summary['mean_ms']:8.4f} ms   p99 <= {summary['p99_ms']} ms{changed}")
+
+
+def synthetic_relationships(num_tables, extra_edges, seed=7):
+    """FK-style relationships over synthetic_schema(num_tables): the table chain plus random cross links."""
+    rng = random.Random(seed)
+    pairs = {(f"table{i - 1}", f"table{i}"): f"table{i - 1}.table{i - 1}_id = table{i}.table{i - 1}_id"
+             for i in range(1, num_tables)}
+    while len(pairs) < num_tables - 1 + extra_edges:
+        i, j = sorted(rng.sample(range(num_tables), 2))
+        pairs.setdefault((f"table{i}", f"table{j}"), f"table{i}.table{i}_id = table{j}.ref{i}_id")
+    return pairs
+
+
+def pairwise_missing_joins(query, relationships, conditions):
+    """The pre-graph add_missing_joins: scan every relationship pair, join only tables adjacent to FROM."""
+    from sql_rewrite import Join, tokens_text
+
+    used_tables = set(query.outer_tables())
+    present = {"".join(tokens_text(tokens).split()) for tokens in query.token_lists()}
+    joins_needed = []
+    for (table1, table2), condition in relationships.items():
+        if table1 in used_tables and table2 in used_tables:
+            condition = "".join(condition.split())
+            if not any(condition in text for text in present):
+                joins_needed.append((table1, table2, conditions[(table1, table2)]))
+    from_table = (query.from_table or '').lower()
+    for t1, t2, cond in joins_needed:
+        joined = {join.table for join in query.joins}
+        if t2 not in joined and t1 not in joined:
+            if from_table == t1.lower():
+                query.joins.insert(0, Join.on(t2, cond))
+        elif t1 not in joined:
+            if from_table == t2.lower():
+                query.joins.insert(0, Join.on(t1, cond))
+
+
+def bench_join_graph(args):
+    import sql_postprocess
+    from schema_cache import parse_schema
+    from schema_families import SchemaFamily, schema_families
+    from sql_rewrite import SqlQuery
+
+    rng = random.Random(11)
+    for num_tables in args.tables:
+        schema_tables = parse_schema(synthetic_schema(num_tables))
+        relationships = synthetic_relationships(num_tables, extra_edges=num_tables // 2)
+        # Registered as a schema family, the way families/*.json define RetailDB / HospitalDB
+        family = SchemaFamily("SyntheticDB", list(schema_tables.keys()),
+                              [(table1, table2, condition) for (table1, table2), condition in relationships.items()])
+        schema_families.register(family)
+        conditions = family.conditions
+
+        start = time.perf_counter()
+        graph = sql_postprocess.relationship_graph(schema_tables, "SyntheticDB")
+        graph.precompute()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        queries = []
+        for _ in range(args.queries):
+            tables = rng.sample(range(1, num_tables), args.missing)
+            filters = " OR ".join(f"table{i}.name = 'x'" for i in tables)
+            queries.append(f"SELECT table0.name FROM table0 WHERE {filters}")
+
+        print(f"{num_tables} tables, {len(relationships)} relationships "
+              f"(graph build + all-pairs paths: {build_ms:.1f} ms)")
+        for label, add_joins in [
+            ("pairwise scan", lambda query: pairwise_missing_joins(query, relationships, conditions)),
+            ("join graph", lambda query: sql_postprocess.add_missing_joins(query, schema_tables, "SyntheticDB")),
+        ]:
+            parsed = [SqlQuery.parse(sql) for sql in queries]
+            added = []
+
+            def run():
+                for query in parsed:
+                    before = len(query.joins)
+                    add_joins(query)
+                    added.append(len(query.joins) - before)
+                    del query.joins[:]
+
+            samples = time_call(run, args.repeat)
+            report(f"  {label}: {args.queries} queries", samples)
+            print(f"  {label}: {statistics.mean(added):.1f} joins added per query, "
+                  f"{sum(1 for n in added if n) / len(added) * 100:.0f}% of queries got any join")
+
+        lookups = [(f"table{rng.randrange(num_tables)}", f"table{rng.randrange(num_tables)}") for _ in range(10000)]
+        samples = time_call(lambda: [graph.path(source, target) for source, target in lookups], args.repeat)
+        print(f"  join graph: {statistics.mean(samples) / len(lookups) * 1000:.2f} us per path lookup")
+    schema_families.unregister("SyntheticDB")
+
+
+def synthetic_families(num_families, rng):
+    """Schema families of 4-8 tables each, drawing names from a shared pool so families overlap."""
+    pool = [f"{prefix}_{noun}" for prefix in ("crm", "erp", "pos", "hr", "lms", "ehr", "wms", "ads")
+            for noun in ("accounts", "users", "orders", "items", "events", "invoices", "contacts", "sites",
+                         "assets", "tickets", "shifts", "visits")]
+    families = []
+    for i in range(num_families):
+        tables = rng.sample(pool, rng.randint(4, 8)) + [f"family{i}_settings"]
+        families.append((f"Family{i}", tables))
+    return families
+
+
+def bench_schema_families(args):
+    """Per-request cost of finding a schema's family, for a growing number of registered families."""
+    from schema_cache import ParsedSchema
+    from schema_families import SchemaFamily, SchemaFamilyRegistry
+    from sql_postprocess import schema_family
+    import sql_postprocess
+
+    rng = random.Random(13)
+    for num_families in args.families:
+        definitions = synthetic_families(num_families, rng)
+        registry = SchemaFamilyRegistry(SchemaFamily(name, tables, min_overlap=2) for name, tables in definitions)
+        # Request schemas: half exactly a family's tables, half a family's tables with some dropped or added
+        schemas = []
+        for _ in range(args.requests):
+            name, tables = rng.choice(definitions)
+            if rng.random() < 0.5:
+                tables = rng.sample(tables, len(tables) - 1) + [f"extra{rng.randrange(1000)}"]
+            schemas.append(ParsedSchema(", ".join(f"{table}(id, name)" for table in tables)))
+
+        def linear_scan(table_names):
+            # The pre-registry approach: intersect the schema with every family's indicator tables in turn
+            for name, tables in definitions:
+                if len(table_names.intersection(tables)) >= 2:
+                    return name
+
+        print(f"{num_families} families")
+        report("  linear overlap scan", time_call(
+            lambda: [linear_scan(set(schema.keys())) for schema in schemas], args.repeat))
+        report("  registry match", time_call(
+            lambda: [registry.match(schema.keys()) for schema in schemas], args.repeat))
+        # What fix_sql_query pays per request: the match above once per parsed schema, then a derived() lookup
+        sql_postprocess.schema_families, previous = registry, sql_postprocess.schema_families
+        try:
+            for schema in schemas:
+                schema_family(schema)
+            report("  cached per schema", time_call(lambda: [schema_family(schema) for schema in schemas], args.repeat))
+        finally:
+            sql_postprocess.schema_families = previous
+        matched = sum(1 for schema in schemas if registry.match(schema.keys()) is not None)
+        print(f"  {matched}/{len(schemas)} schemas matched a family; {registry.stats()}")
+
+
+def bench_fk_index(args):
+    from fk_index import ForeignKeyIndex, foreign_key_index
+    from schema_cache import ParsedSchema
+
+    for num_tables in args.tables:
+        schema_tables = ParsedSchema(synthetic_schema(num_tables, args.columns))
+        num_columns = sum(len(columns) for columns in schema_tables.values())
+        samples = time_call(lambda: ForeignKeyIndex(schema_tables), args.repeat)
+        report(f"{num_tables} tables / {num_columns} columns: build", samples)
+        print(f"{'':<44} {statistics.mean(samples) / num_columns * 1000:.2f} us per column, "
+              f"{len(foreign_key_index(schema_tables))} foreign keys inferred")
+        report(f"{num_tables} tables: memoized lookup", time_call(lambda: foreign_key_index(schema_tables), args.repeat))
+
+
+def wide_schema_queries(num_tables):
+    """Queries over synthetic_schema(num_tables) that exercise the column lookups of the ambiguity and
+    validation fixers: shared column names, unqualified GROUP BY / ORDER BY / ON columns, and columns
+    selected from the wrong table."""
+    queries = []
+    for i in range(1, num_tables, max(1, num_tables // 20)):
+        left, right = f"table{i - 1}", f"table{i}"
+        queries += [
+            ("count records by name and status",
+             f"SELECT name, status, COUNT(*) FROM {left} JOIN {right} ON {left}.{left}_id = {right}.{left}_id "
+             f"GROUP BY name, status ORDER BY name DESC"),
+            ("names and creation dates", f"SELECT name, created_at FROM {left} JOIN {right} ON {left}_id = {left}_id"),
+            ("attributes of records", f"SELECT attr{i}_0, name FROM {left}"),
+            ("attributes with status", f"SELECT attr{i}_1, attr{i - 1}_2 FROM {right} JOIN {left} ON {right}.{left}_id = {left}.{left}_id"),
+        ]
+    return queries
+
+
+def bench_column_index(args):
+    import sql_postprocess
+    from schema_cache import parse_schema
+
+    schema_tables = parse_schema(synthetic_schema(args.tables))
+    queries = wide_schema_queries(args.tables)
+    implementations = [("column index", sql_postprocess)]
+    if args.baseline:
+        implementations.append(("baseline", load_module(args.baseline, "baseline_sql_postprocess")))
+
+    means = {}
+    for label, module in implementations:
+        def run():
+            for question, sql in queries:
+                module.fix_sql_query(sql, question, schema_tables)
+
+        samples = time_call(run, args.repeat)
+        means[label] = statistics.mean(samples) / len(queries)
+        report(f"{args.tables} tables, {len(queries)} queries: {label}", samples)
+    for label, mean in means.items():
+        print(f"{label}: {mean * 1000:.0f} us per query")
+    if args.baseline:
+        print(f"speedup x{means['baseline'] / means['column index']:.1f}")
+
+    # The lookup itself: which tables own a column, by scanning every table vs. the index
+    columns = [f"attr{i}_0" for i in range(0, args.tables, max(1, args.tables // 100))] + ["name", "missing"]
+    scan = time_call(lambda: [[table for table, owned in schema_tables.items() if column in owned]
+                              for column in columns], args.repeat)
+    index = time_call(lambda: [schema_tables.tables_with_column(column) for column in columns], args.repeat)
+    print(f"column owner lookup: {statistics.mean(scan) / len(columns) * 1000:.1f} us scanning all tables, "
+          f"{statistics.mean(index) / len(columns) * 1000:.2f} us with the index")
+
+
+PRUNING_QUESTIONS = [
+    ("list customers from London", ["Customers"]),
+    ("show orders from customers in Paris", ["Orders", "Customers"]),
+    ("top 5 products by price", ["Products"]),
+    ("payments with status 'paid'", ["Payments"]),
+    ("total quantity of each product ordered", ["OrderItems", "Products"]),
+    ("how many clients bought items", ["Customers", "OrderItems"]),
+]
+
+
+def pruning_questions(num_tables):
+    """(question, tables the SQL needs) over RETAIL_SCHEMA followed by synthetic_schema(num_tables)."""
+    questions = list(PRUNING_QUESTIONS)
+    for i in range(1, num_tables, max(1, num_tables // 10)):
+        questions.append((f"names of table{i} records with their table{i - 1}", [f"table{i}", f"table{i - 1}"]))
+    return questions
+
+
+def bench_pruning(args):
+    import app
+    from prompt_segments import prompt_text
+    from schema_cache import parse_schema
+    from schema_pruning import lexical_index, pruned_schema, relevant_tables
+    from sql_postprocess import prepare_schema
+
+    if app.tokenizer is not None:
+        def count_tokens(schema, question):
+            prompt = prompt_text(app.PROMPT_INSTRUCTIONS, question, schema)
+            return len(app.tokenizer.encode(prompt))
+        unit = "tokens"
+    else:
+        # No tokenizer: count words and punctuation marks, which undercounts T5 pieces on identifiers
+        def count_tokens(schema, question):
+            prompt = prompt_text(app.PROMPT_INSTRUCTIONS, question, schema)
+            return len(re.findall(r"\w+|[^\w\s]", prompt))
+        unit = "approx. tokens (words + punctuation; ./model tokenizer not loaded)"
+
+    for num_tables in args.tables:
+        schema = f"{RETAIL_SCHEMA}, {synthetic_schema(num_tables)}"
+        schema_tables = parse_schema(schema)
+        start = time.perf_counter()
+        prepare_schema(schema_tables)
+        lexical_index(schema_tables)
+        prepared_ms = (time.perf_counter() - start) * 1000
+        questions = pruning_questions(num_tables)
+
+        full_tokens, pruned_tokens, kept_tables, missed = [], [], [], []
+        for question, needed in questions:
+            pruned = pruned_schema(question, schema_tables, args.top_k) or schema
+            full_tokens.append(count_tokens(schema, question))
+            pruned_tokens.append(count_tokens(pruned, question))
+            kept = relevant_tables(question, schema_tables, args.top_k)
+            kept_tables.append(len(kept))
+            missed += [f"{question!r}: {table}" for table in needed if table not in kept]
+        prune_samples = time_call(lambda: [pruned_schema(question, schema_tables, args.top_k)
+                                           for question, _ in questions], args.repeat)
+
+        print(f"{len(schema_tables)} tables, top_k {args.top_k}: index + join graph built in {prepared_ms:.1f} ms, "
+              f"pruning {statistics.mean(prune_samples) / len(questions) * 1000:.0f} us per question")
+        print(f"  tables kept: mean {statistics.mean(kept_tables):.1f}, max {max(kept_tables)}")
+        print(f"  prompt {unit}: full {statistics.mean(full_tokens):.0f}, pruned {statistics.mean(pruned_tokens):.0f} "
+              f"(saved {100.0 * (1 - sum(pruned_tokens) / sum(full_tokens)):.1f}%; "
+              f"full prompts are truncated to {app.MAX_INPUT_TOKENS})")
+        print(f"  needed tables dropped: {len(missed)}" + "".join(f"\n    {miss}" for miss in missed))
+
+        if app.model is None:
+            print("  encode + generate latency: skipped, ./model failed to load")
+            continue
+        for label, top_k in (("full", 0), ("pruned", args.top_k)):
+            def run():
+                for question, _ in questions:
+                    input_ids = app.prompt_input_ids(question, schema, schema_tables, top_k=top_k)
+                    app.generate_batch([input_ids], app.GENERATION_TIERS[0].generate_kwargs)
+            report(f"  encode + generate, {label} schema ({len(questions)} questions)", time_call(run, 1))
+
+
+def bench_tokenize(args):
+    import app
+    from prompt_segments import prompt_text
+    from schema_cache import parse_schema
+    from schema_pruning import pruned_schema
+
+    if app.tokenizer is None:
+        raise SystemExit("Tokenizer failed to load; the tokenize benchmark needs ./model.")
+    if app.prompt_segments is None:
+        raise SystemExit("The tokenizer does not split the prompt at segment boundaries; whole prompts are encoded.")
+
+    segments = app.prompt_segments
+    questions = [question for question, _ in PRUNING_QUESTIONS] + SAMPLE_QUESTIONS
+    for num_tables in args.tables:
+        schema = f"{RETAIL_SCHEMA}, {synthetic_schema(num_tables)}"
+        schema_tables = parse_schema(schema)
+        registered_ids = segments.schema_ids(schema)
+        pruned = {question: pruned_schema(question, schema_tables, args.top_k) or schema for question in questions}
+
+        def encode_whole(question_schema):
+            return [app.tokenizer.encode(prompt_text(app.PROMPT_INSTRUCTIONS, question, question_schema(question)),
+                                         max_length=app.MAX_INPUT_TOKENS, truncation=True)
+                    for question in questions]
+
+        # Segmented ids must be exactly what encoding the whole prompt gives
+        mismatches = sum(
+            whole != segmented for whole, segmented in zip(
+                encode_whole(lambda question: schema) + encode_whole(pruned.get),
+                [segments.input_ids(question, registered_ids) for question in questions]
+                + [app.prompt_input_ids(question, schema, schema_tables, top_k=args.top_k) for question in questions]))
+
+        print(f"{len(schema_tables)} tables ({len(registered_ids)} schema tokens), {len(questions)} questions, "
+              f"{mismatches} mismatches against whole-prompt encoding")
+        runs = [
+            ("whole prompt, full schema", lambda: encode_whole(lambda question: schema)),
+            ("segments, registered schema", lambda: [segments.input_ids(question, registered_ids)
+                                                     for question in questions]),
+            ("segments, schema text", lambda: [app.prompt_input_ids(question, schema, schema_tables, top_k=0)
+                                               for question in questions]),
+            (f"whole prompt, pruned to top {args.top_k}", lambda: encode_whole(pruned.get)),
+            (f"segments, pruned to top {args.top_k}", lambda: [app.prompt_input_ids(question, schema, schema_tables,
+                                                                                    top_k=args.top_k)
+                                                               for question in questions]),
+        ]
+        for label, run in runs:
+            samples = [sample / len(questions) for sample in time_call(run, args.repeat)]
+            report(f"  {label} (per request)", samples)
+
+
+def bench_decoding(args):
+    import app
+    from decoding import decoding_stats, decoding_tiers
+    from result_cache import result_cache
+    from question_templates import template_cache
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the decoding benchmark needs ./model.")
+
+    questions = [question for question, _ in PRUNING_QUESTIONS] + SAMPLE_QUESTIONS
+    schema_tables = app.parse_schema(RETAIL_SCHEMA)
+    configured = app.GENERATION_TIERS
+    try:
+        for names in args.tiers:
+            app.GENERATION_TIERS = decoding_tiers(names)
+            decoding_stats.reset()
+            failures = 0
+
+            def run():
+                nonlocal failures
+                result_cache.clear()
+                template_cache.clear()
+                for question in questions:
+                    failures += "Error:" in app.answer_question(question, RETAIL_SCHEMA, schema_tables)
+
+            samples = [sample / len(questions) for sample in time_call(run, args.repeat)]
+            report(f"tiers {names} (per question)", samples)
+            print(f"  validation errors returned: {failures / args.repeat:.1f} of {len(questions)} questions")
+            for tier, summary in decoding_stats.stats().items():
+                latency = summary["latency"]
+                print(f"  {tier:<10} attempts {summary['attempts']:>5}   accepted {summary['accept_rate']:6.1%}   "
+                      f"mean {latency['mean_ms']:8.2f} ms   p95 <= {latency['p95_ms']} ms")
+    finally:
+        app.GENERATION_TIERS = configured
+
+
+def bench_candidates(args):
+    import app
+    from decoding import decoding_tiers
+    from result_cache import result_cache
+    from question_templates import template_cache
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the candidates benchmark needs ./model.")
+
+    questions = [question for question, _ in PRUNING_QUESTIONS] + SAMPLE_QUESTIONS
+    schema_tables = app.parse_schema(RETAIL_SCHEMA)
+    configured = app.GENERATION_TIERS
+    app.GENERATION_TIERS = decoding_tiers("beam")  # the single-candidate path: top beam only
+    try:
+        for num_candidates in args.candidates:
+            successes = 0
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                result_cache.clear()
+                template_cache.clear()
+                for question in questions:
+                    sql = app.answer_question(question, RETAIL_SCHEMA, schema_tables, num_candidates=num_candidates)
+                    successes += "Error:" not in sql
+            elapsed = time.perf_counter() - start
+            label = "single candidate (top beam)" if num_candidates == 1 else f"{num_candidates} candidates"
+            print(f"{label:<28} {successes}/{len(questions) * args.repeat} valid   "
+                  f"{successes / elapsed:7.2f} successes/s   {elapsed * 1000 / (len(questions) * args.repeat):8.1f} ms/question")
+    finally:
+        app.GENERATION_TIERS = configured
+
+
+def load_question_set(path=None):
+    """(question, schema text, reference SQL or None) for a held-out set given as a JSON list of
+    {"question", "schema", "sql"}; defaults to the golden corpus questions and their expected SQL."""
+    if path is None:
+        return [(question, schema, expected) for question, schema, _, expected in load_golden_corpus()
+                if not expected.startswith("Error:")]
+    with open(path) as f:
+        return [(item["question"], item["schema"], item.get("sql")) for item in json.load(f)]
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def bench_precision(args):
+    import torch
+    from transformers import AutoModelForSeq2SeqLM
+    import app
+    from decoding import tier_settings
+    from model_precision import apply_precision, model_size_bytes
+    from sql_postprocess import fix_sql_query
+
+    if app.tokenizer is None:
+        raise SystemExit("Tokenizer failed to load; the precision benchmark needs ./model.")
+
+    questions = load_question_set(args.questions)
+    prompts = [torch.tensor([app.encode_prompt(question, schema)]) for question, schema, _ in questions]
+    generate_kwargs = tier_settings(args.tier)
+    print(f"{len(questions)} questions, {args.tier} decoding, model {args.model}")
+
+    baseline = None
+    rows = []
+    for precision in args.modes:
+        rss_before = rss_bytes()
+        model = apply_precision(AutoModelForSeq2SeqLM.from_pretrained(args.model), precision)
+        rss_after = rss_bytes()
+        with torch.inference_mode():
+            model.generate(input_ids=prompts[0], **generate_kwargs)  # warm-up
+            outputs, latencies = [], []
+            for (question, schema, _), input_ids in zip(questions, prompts):
+                start = time.perf_counter()
+                generated = model.generate(input_ids=input_ids, **generate_kwargs)
+                latencies.append((time.perf_counter() - start) * 1000)
+                sql = app.tokenizer.decode(generated[0], skip_special_tokens=True)
+                outputs.append(normalize_sql(fix_sql_query(sql, question, schema)))
+
+        references = [(output, reference) for output, (_, _, reference) in zip(outputs, questions) if reference]
+        exact = sum(output == normalize_sql(reference) for output, reference in references)
+        if baseline is None:
+            baseline = outputs
+        agreement = sum(output == base for output, base in zip(outputs, baseline))
+        rows.append((precision, model_size_bytes(model) / 2 ** 20,
+                     (rss_after - rss_before) / 2 ** 20 if rss_before is not None else float("nan"),
+                     statistics.median(latencies), percentile(latencies, 0.99),
+                     f"{exact}/{len(references)}" if references else "-",
+                     f"{100.0 * agreement / len(outputs):.1f}%"))
+        del model
+
+    print(f"{'mode':<6} {'weights MiB':>12} {'RSS +MiB':>9} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'exact match':>12} {'same as ' + args.modes[0]:>13}")
+    for precision, size, rss, p50, p99, exact, agreement in rows:
+        print(f"{precision:<6} {size:12.1f} {rss:9.1f} {p50:9.1f} {p99:9.1f} {exact:>12} {agreement:>13}")
+
+
+def bench_onnx(args):
+    import torch
+    from transformers import AutoTokenizer
+    from decoding import tier_settings
+    from inference_backend import load_seq2seq_model
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if args.texts:
+        with open(args.texts) as f:
+            prompts = [args.prefix + line.strip() for line in f if line.strip()]
+    else:
+        from app import PROMPT_INSTRUCTIONS
+        from prompt_segments import prompt_text
+        prompts = [prompt_text(PROMPT_INSTRUCTIONS, question, schema) for question, schema, _ in load_question_set()]
+    prompts = prompts[:args.limit]
+
+    pytorch_model, _ = load_seq2seq_model(args.model, "pytorch")
+    onnx_model, backend = load_seq2seq_model(args.model, "onnx")
+    if backend != "onnx":
+        raise SystemExit("ONNX Runtime backend unavailable; install optimum[onnxruntime] and run "
+                         "python inference_backend.py export --model <checkpoint> first.")
+    models = (("pytorch", pytorch_model), ("onnx", onnx_model))
+    encoded = [tokenizer(prompt, return_tensors="pt", max_length=args.max_input_tokens, truncation=True)
+               for prompt in prompts]
+    print(f"{len(prompts)} prompts, model {args.model}")
+
+    for tier in args.tiers:
+        generate_kwargs = tier_settings(tier)
+        # Parity: both backends must produce the same token ids for every prompt
+        outputs = {}
+        latencies = {}
+        with torch.inference_mode():
+            for label, model in models:
+                model.generate(**encoded[0], **generate_kwargs)  # warm-up
+                outputs[label], latencies[label] = [], []
+                for inputs in encoded:
+                    start = time.perf_counter()
+                    generated = model.generate(**inputs, **generate_kwargs)
+                    latencies[label].append((time.perf_counter() - start) * 1000)
+                    outputs[label].append([token for token in generated[0].tolist() if token != tokenizer.pad_token_id])
+        mismatches = [i for i, (expected, actual) in enumerate(zip(outputs["pytorch"], outputs["onnx"]))
+                      if expected != actual]
+        print(f"{tier}: {len(prompts) - len(mismatches)}/{len(prompts)} outputs token-identical")
+        for i in mismatches[:3]:
+            print(f"  prompt {i} pytorch: {tokenizer.decode(outputs['pytorch'][i])!r}")
+            print(f"  prompt {i} onnx:    {tokenizer.decode(outputs['onnx'][i])!r}")
+        for label, _ in models:
+            report(f"  {label} {tier} latency", latencies[label])
+
+        # Throughput with padded batches, as the generation batcher sends them
+        batches = [prompts[i:i + args.batch_size] for i in range(0, len(prompts), args.batch_size)]
+        for label, model in models:
+            start = time.perf_counter()
+            with torch.inference_mode():
+                for batch in batches:
+                    model.generate(**tokenizer(batch, return_tensors="pt", padding=True, max_length=args.max_input_tokens,
+                                               truncation=True), **generate_kwargs)
+            elapsed = time.perf_counter() - start
+            print(f"  {label} {tier} batch size {args.batch_size}: {len(prompts) / elapsed:.2f} sequences/s")
+
+
+def bench_speculative(args):
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    from app import PROMPT_INSTRUCTIONS
+    from decoding import tier_settings
+    from prompt_segments import prompt_text
+    from speculative import speculative_kwargs
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model)
+    prompts = [tokenizer(prompt_text(PROMPT_INSTRUCTIONS, question, schema), return_tensors="pt",
+                         max_length=args.max_input_tokens, truncation=True)
+               for question, schema, _ in load_question_set()][:args.limit]
+    generate_kwargs = tier_settings("greedy")
+
+    def count_calls(module):
+        calls = [0]
+        module.register_forward_hook(lambda *_: calls.__setitem__(0, calls[0] + 1))
+        return calls
+
+    target_calls = count_calls(model)
+
+    def run(extra_kwargs):
+        target_calls[0] = 0
+        outputs = []
+        start = time.perf_counter()
+        with torch.inference_mode():
+            for inputs in prompts:
+                outputs.append(model.generate(**inputs, **generate_kwargs, **extra_kwargs)[0].tolist())
+        elapsed = time.perf_counter() - start
+        # Generated tokens, without the decoder start token
+        tokens = sum(len(output) - 1 for output in outputs)
+        return outputs, tokens, elapsed, target_calls[0]
+
+    run({})  # warm-up
+    baseline, tokens, elapsed, calls = run({})
+    print(f"{len(prompts)} prompts, greedy decoding, model {args.model}")
+    print(f"{'plain greedy':<16} {tokens / elapsed:8.1f} tokens/s   {tokens / calls:5.2f} tokens per target pass")
+    for mode in args.modes:
+        if mode == "draft" and not args.draft:
+            print("draft: skipped, pass --draft <checkpoint>")
+            continue
+        extra_kwargs = speculative_kwargs(mode, args.draft)
+        draft_calls = count_calls(extra_kwargs["assistant_model"]) if mode == "draft" else None
+        outputs, tokens, elapsed, calls = run(extra_kwargs)
+        identical = sum(output == expected for output, expected in zip(outputs, baseline))
+        line = (f"{mode:<16} {tokens / elapsed:8.1f} tokens/s   {tokens / calls:5.2f} tokens per target pass   "
+                f"{identical}/{len(prompts)} identical to plain greedy")
+        if draft_calls is not None and draft_calls[0]:
+            # Every verification pass accepts some draft tokens and adds one token of its own
+            line += f"   draft acceptance {100.0 * (tokens - calls) / draft_calls[0]:.1f}%"
+        print(line)
+
+
+def bench_constrained(args):
+    import app
+    from constrained_decoding import TokenVocabulary, identifier_trie
+    from decoding import decoding_stats, decoding_tiers
+    from result_cache import result_cache
+    from question_templates import template_cache
+
+    if app.model is None:
+        raise SystemExit("Model failed to load; the constrained decoding benchmark needs ./model.")
+    vocabulary = TokenVocabulary(app.tokenizer)
+    if not vocabulary.supported:
+        raise SystemExit("Constrained decoding needs a SentencePiece tokenizer.")
+
+    questions = load_question_set(args.questions)[:args.limit]
+    schemas = {schema: app.parse_schema(schema) for _, schema, _ in questions}
+    start = time.perf_counter()
+    tries = [identifier_trie(schema_tables, app.tokenizer, vocabulary) for schema_tables in schemas.values()]
+    print(f"{len(questions)} questions, {len(schemas)} schemas: tries built in "
+          f"{(time.perf_counter() - start) * 1000 / len(schemas):.1f} ms per schema "
+          f"(mean {sum(trie.nodes for trie in tries) / len(tries):.0f} nodes)")
+
+    configured = app.GENERATION_TIERS, app.token_vocabulary
+    try:
+        for names in args.tiers:
+            app.GENERATION_TIERS = decoding_tiers(names)
+            for label, constraint_vocabulary in (("unconstrained", None), ("constrained", vocabulary)):
+                app.token_vocabulary = constraint_vocabulary
+                decoding_stats.reset()
+                result_cache.clear()
+                template_cache.clear()
+                valid = exact = 0
+                start = time.perf_counter()
+                for question, schema, expected in questions:
+                    sql = app.answer_question(question, schema, schemas[schema])
+                    valid += "Error:" not in sql
+                    exact += expected is not None and normalize_sql(sql) == normalize_sql(expected)
+                elapsed = time.perf_counter() - start
+                generate_calls = sum(summary["attempts"] for summary in decoding_stats.stats().values())
+                print(f"tiers {names:<24} {label:<14} {valid}/{len(questions)} valid   {valid / elapsed:7.2f} valid SQL/s   "
+                      f"{generate_calls / len(questions):5.2f} generate calls/question   {exact} exact match")
+    finally:
+        app.GENERATION_TIERS, app.token_vocabulary = configured
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text-to-SQL service benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    schema_parser = subparsers.add_parser("schema-cache", help="per-request schema parsing cost")
+    schema_parser.add_argument("--tables", type=int, default=500)
+    schema_parser.add_argument("--requests", type=int, default=200)
+    schema_parser.set_defaults(func=bench_schema_cache)
+
+    batching_parser = subparsers.add_parser("batching", help="throughput/latency of micro-batched generation")
+    batching_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    batching_parser.add_argument("--requests", type=int, default=64)
+    batching_parser.add_argument("--concurrency", type=int, default=16)
+    batching_parser.add_argument("--window", type=float, default=20, help="batching window in ms")
+    batching_parser.add_argument("--tables", type=int, default=10)
+    batching_parser.set_defaults(func=bench_batching)
+
+    single_flight_parser = subparsers.add_parser(
+        "single-flight", help="generate calls and CPU under bursts of identical requests, with and without coalescing")
+    single_flight_parser.add_argument("--questions", type=int, default=4, help="distinct questions per burst")
+    single_flight_parser.add_argument("--copies", type=int, default=8, help="concurrent copies of each question")
+    single_flight_parser.add_argument("--bursts", type=int, default=3)
+    single_flight_parser.set_defaults(func=bench_single_flight)
+
+    prefork_parser = subparsers.add_parser(
+        "prefork", help="throughput and memory per worker: pre-forked server vs the single-process dev server",
+        description="Starts app.py and then prefork.py with each worker count on --port, waits for /ready and "
+                    "sends concurrent /nl-to-sql requests with the result and template caches disabled. Memory "
+                    "comes from /proc/<pid>/smaps_rollup: PSS splits the copy-on-write weight pages between the "
+                    "workers sharing them, private is what each worker holds alone.")
+    prefork_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    prefork_parser.add_argument("--requests", type=int, default=64)
+    prefork_parser.add_argument("--concurrency", type=int, default=8)
+    prefork_parser.add_argument("--port", type=int, default=5903)
+    prefork_parser.add_argument("--startup-timeout", type=float, default=300)
+    prefork_parser.set_defaults(func=bench_prefork)
+
+    cold_start_parser = subparsers.add_parser(
+        "cold-start", help="time from starting app.py to /ready and its first answered /nl-to-sql request",
+        description="Starts app.py once per run with each configuration's environment (space-separated "
+                    "KEY=VALUE pairs), polls /ready like a load balancer, then sends one /nl-to-sql request "
+                    "and prints the service's own startup breakdown from /stats.")
+    cold_start_parser.add_argument("--configs", nargs="+", default=["BACKGROUND_MODEL_LOAD=0",
+                                                                    "CONVERT_CHECKPOINT=1"])
+    cold_start_parser.add_argument("--question", default="customers who have not placed orders")
+    cold_start_parser.add_argument("--runs", type=int, default=3)
+    cold_start_parser.add_argument("--port", type=int, default=5904)
+    cold_start_parser.add_argument("--startup-timeout", type=float, default=300)
+    cold_start_parser.set_defaults(func=bench_cold_start)
+
+    residency_parser = subparsers.add_parser(
+        "residency", help="latency, loads and evictions of per-family checkpoints under memory budgets",
+        description="Sends a skewed mix of RetailDB / HospitalDB questions through answer_question with the "
+                    "result and template caches cleared, once per budget, loading each family's checkpoint "
+                    "on demand.")
+    residency_parser.add_argument("--checkpoints", help="family=path pairs (default: MODEL_CHECKPOINTS)")
+    residency_parser.add_argument("--budgets-mb", type=float, nargs="+", default=[256, 1024, 4096])
+    residency_parser.add_argument("--requests", type=int, default=60)
+    residency_parser.add_argument("--concurrency", type=int, default=4)
+    residency_parser.add_argument("--skew", type=float, default=0.5,
+                                  help="request share of each family relative to the one before it")
+    residency_parser.set_defaults(func=bench_residency)
+
+    templates_parser = subparsers.add_parser("templates", help="generation avoided by the literal template cache")
+    templates_parser.add_argument("--log", help="question log, one question per line (default: synthetic log)")
+    templates_parser.add_argument("--schema", help="file containing the schema string (default: RetailDB)")
+    templates_parser.add_argument("--size", type=int, default=500, help="size of the synthetic log")
+    templates_parser.set_defaults(func=bench_templates)
+
+    fast_path_parser = subparsers.add_parser(
+        "fast-path", help="questions answered by the fast-path router without the model, and its latency",
+        description="Routes a question log over RetailDB plus N synthetic tables. Pass --baseline with an older "
+                    "sql_postprocess.py (see 'rewrite') to time its handle_metadata_queries phrase scan.")
+    fast_path_parser.add_argument("--log", help="question log, one question per line (default: synthetic log)")
+    fast_path_parser.add_argument("--size", type=int, default=500, help="size of the synthetic log")
+    fast_path_parser.add_argument("--tables", type=int, nargs="+", default=[100, 1000])
+    fast_path_parser.add_argument("--baseline", help="path to another sql_postprocess.py to compare against")
+    fast_path_parser.add_argument("--repeat", type=int, default=10)
+    fast_path_parser.set_defaults(func=bench_fast_path)
+
+    rewrite_parser = subparsers.add_parser(
+        "rewrite", help="check SQL post-processing against the golden corpus and time it",
+        description="Checks fix_sql_query against the golden corpus, then times it. To compare with an older "
+                    "implementation, export it first, e.g. git show <rev>:Text-to-Sql/sql_postprocess.py > old.py, "
+                    "and pass --baseline old.py.")
+    rewrite_parser.add_argument("--corpus", default=GOLDEN_CORPUS)
+    rewrite_parser.add_argument("--baseline", help="path to another sql_postprocess.py to compare against")
+    rewrite_parser.add_argument("--joins", type=int, nargs="+", default=[5, 20, 50],
+                                help="join counts of the generated long queries")
+    rewrite_parser.add_argument("--repeat", type=int, default=20)
+    rewrite_parser.set_defaults(func=bench_rewrite)
+
+    join_graph_parser = subparsers.add_parser(
+        "join-graph", help="relationship join paths: join graph vs. scanning every relationship pair")
+    join_graph_parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 500])
+    join_graph_parser.add_argument("--queries", type=int, default=200)
+    join_graph_parser.add_argument("--missing", type=int, default=3, help="unjoined tables named per query")
+    join_graph_parser.add_argument("--repeat", type=int, default=5)
+    join_graph_parser.set_defaults(func=bench_join_graph)
+
+    families_parser = subparsers.add_parser(
+        "schema-families", help="per-request cost of matching a schema to its family, per number of families")
+    families_parser.add_argument("--families", type=int, nargs="+", default=[2, 100, 500])
+    families_parser.add_argument("--requests", type=int, default=1000)
+    families_parser.add_argument("--repeat", type=int, default=10)
+    families_parser.set_defaults(func=bench_schema_families)
+
+    fk_parser = subparsers.add_parser("fk-index", help="foreign-key inference cost per schema size")
+    fk_parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000])
+    fk_parser.add_argument("--columns", type=int, default=8, help="columns per synthetic table")
+    fk_parser.add_argument("--repeat", type=int, default=10)
+    fk_parser.set_defaults(func=bench_fk_index)
+
+    column_parser = subparsers.add_parser(
+        "column-index", help="post-processing on a wide schema (column -> table lookups)",
+        description="Times fix_sql_query on queries over a wide synthetic schema. Pass --baseline with an "
+                    "older sql_postprocess.py (see 'rewrite') to compare.")
+    column_parser.add_argument("--tables", type=int, default=1000)
+    column_parser.add_argument("--baseline", help="path to another sql_postprocess.py to compare against")
+    column_parser.add_argument("--repeat", type=int, default=10)
+    column_parser.set_defaults(func=bench_column_index)
+
+    pruning_parser = subparsers.add_parser(
+        "pruning", help="prompt tokens saved by schema pruning on large schemas",
+        description="Prunes RetailDB plus N synthetic tables per question and reports the prompt size, whether "
+                    "the tables the SQL needs were kept, and encode + generate latency when ./model loads.")
+    pruning_parser.add_argument("--tables", type=int, nargs="+", default=[100, 1000])
+    pruning_parser.add_argument("--top-k", type=int, default=8)
+    pruning_parser.add_argument("--repeat", type=int, default=20)
+    pruning_parser.set_defaults(func=bench_pruning)
+
+    tokenize_parser = subparsers.add_parser(
+        "tokenize", help="tokenizer time per request: whole prompts vs cached prompt segments")
+    tokenize_parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000])
+    tokenize_parser.add_argument("--top-k", type=int, default=8)
+    tokenize_parser.add_argument("--repeat", type=int, default=20)
+    tokenize_parser.set_defaults(func=bench_tokenize)
+
+    decoding_parser = subparsers.add_parser(
+        "decoding", help="latency and tier usage of adaptive decoding vs. always using beam search")
+    decoding_parser.add_argument("--tiers", nargs="+", default=["beam", "greedy,beam,candidates"],
+                                 help="DECODING_TIERS settings to compare")
+    decoding_parser.add_argument("--repeat", type=int, default=3)
+    decoding_parser.set_defaults(func=bench_decoding)
+
+    candidates_parser = subparsers.add_parser(
+        "candidates", help="valid SQL per second: top beam only vs N beams validated in parallel")
+    candidates_parser.add_argument("--candidates", type=int, nargs="+", default=[1, 2, 4, 8])
+    candidates_parser.add_argument("--repeat", type=int, default=3)
+    candidates_parser.set_defaults(func=bench_candidates)
+
+    precision_parser = subparsers.add_parser(
+        "precision", help="memory, latency and accuracy of fp32 vs int8 / bf16 model weights (MODEL_PRECISION)",
+        description="Loads the model in each mode and runs a held-out question set through generation and "
+                    "post-processing. Exact match is against the reference SQL; the last column is agreement "
+                    "with the first mode (fp32 by default). RSS growth is approximate: the allocator may keep "
+                    "memory freed by earlier modes.")
+    precision_parser.add_argument("--questions", help="JSON list of {question, schema, sql} (default: golden corpus)")
+    precision_parser.add_argument("--modes", nargs="+", default=["fp32", "int8", "bf16"])
+    precision_parser.add_argument("--model", default="./model")
+    precision_parser.add_argument("--tier", default="greedy", help="decoding tier: greedy, beam or candidates")
+    precision_parser.set_defaults(func=bench_precision)
+
+    onnx_parser = subparsers.add_parser(
+        "onnx", help="token parity, latency and throughput of the ONNX Runtime backend vs PyTorch",
+        description="Export the checkpoint first (python inference_backend.py export --model <checkpoint>). "
+                    "Defaults to text-to-SQL prompts for the golden corpus questions; for the title model pass "
+                    "--model ../text-to-title/models --texts <file> --prefix 'summarize: '.")
+    onnx_parser.add_argument("--model", default="./model")
+    onnx_parser.add_argument("--texts", help="file with one input text per line instead of text-to-SQL prompts")
+    onnx_parser.add_argument("--prefix", default="", help="prepended to every --texts line")
+    onnx_parser.add_argument("--tiers", nargs="+", default=["greedy", "beam"], help="decoding settings to compare")
+    onnx_parser.add_argument("--limit", type=int, default=50)
+    onnx_parser.add_argument("--batch-size", type=int, default=8)
+    onnx_parser.add_argument("--max-input-tokens", type=int, default=1024)
+    onnx_parser.set_defaults(func=bench_onnx)
+
+    speculative_parser = subparsers.add_parser(
+        "speculative", help="tokens/s and acceptance of draft-and-verify greedy decoding (SPECULATIVE_DECODING)")
+    speculative_parser.add_argument("--model", default="./model")
+    speculative_parser.add_argument("--draft", help="draft model checkpoint for the draft mode")
+    speculative_parser.add_argument("--modes", nargs="+", default=["prompt_lookup", "draft"])
+    speculative_parser.add_argument("--limit", type=int, default=50)
+    speculative_parser.add_argument("--max-input-tokens", type=int, default=1024)
+    speculative_parser.set_defaults(func=bench_speculative)
+
+    constrained_parser = subparsers.add_parser(
+        "constrained", help="valid SQL per second with and without schema-constrained decoding",
+        description="Runs a held-out question set through answer_question with and without the schema's "
+                    "identifier trie constraining generation (CONSTRAINED_DECODING).")
+    constrained_parser.add_argument("--questions", help="JSON list of {question, schema, sql} (default: golden corpus)")
+    constrained_parser.add_argument("--tiers", nargs="+", default=["greedy", "greedy,beam,candidates"],
+                                    help="DECODING_TIERS settings to compare")
+    constrained_parser.add_argument("--limit", type=int, default=50)
+    constrained_parser.set_defaults(func=bench_constrained)
+
+    tracing_parser = subparsers.add_parser("tracing", help="cost of per-stage tracing in fix_sql_query")
+    tracing_parser.add_argument("--corpus", default=GOLDEN_CORPUS)
+    tracing_parser.add_argument("--repeat", type=int, default=20)
+    tracing_parser.add_argument("--top", type=int, default=10, help="number of stages to list")
+    tracing_parser.set_defaults(func=bench_tracing)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import os
+import string
+
+import torch
+from transformers import LogitsProcessor
+
+from schema_cache import deep_size
+
+# Only let model.generate spell SQL words and the active schema's table / column names
+CONSTRAINED_DECODING = os.environ.get("CONSTRAINED_DECODING", "0").lower() in ("1", "true", "yes")
+
+# Keywords and functions the model may emit besides schema identifiers (matched in any of WORD_CASES)
+SQL_WORDS = (
+    "SELECT", "FROM", "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "ON", "USING",
+    "AND", "OR", "NOT", "IN", "IS", "NULL", "LIKE", "BETWEEN", "EXISTS", "AS", "DISTINCT", "ALL", "ANY",
+    "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "OFFSET", "ASC", "DESC", "UNION", "INTERSECT", "EXCEPT",
+    "CASE", "WHEN", "THEN", "ELSE", "END", "TRUE", "FALSE", "WITH", "SHOW", "TABLES", "DESCRIBE",
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "ROUND", "ABS", "COALESCE", "IFNULL", "CAST", "LOWER", "UPPER",
+    "LENGTH", "TRIM", "CONCAT", "SUBSTR", "SUBSTRING", "REPLACE",
+    "DATE", "TIME", "DATETIME", "TIMESTAMP", "YEAR", "MONTH", "DAY", "HOUR", "MINUTE", "WEEK", "QUARTER",
+    "NOW", "CURDATE", "CURRENT_DATE", "CURRENT_TIMESTAMP", "INTERVAL", "DATE_SUB", "DATE_ADD", "DATEDIFF",
+    "STRFTIME", "EXTRACT",
+)
+WORD_CASES = (str, str.lower, str.upper, str.capitalize)
+
+IDENTIFIER_CHARS = frozenset(string.ascii_letters + string.digits + "_")
+WORD_START_MARKER = "▁"  # SentencePiece's mark for a piece that starts after a space
+
+BOUNDARY = -1  # trie node of a position between words
+SHORT_ALIAS = -2  # node of a letter followed by digits, e.g. T1, used before its AS declaration
+NUMBER = -3  # node of a numeric literal
+
+
+class TokenVocabulary:
+    """Piece text and word classes of every token of a SentencePiece tokenizer, shared by all schemas."""
+
+    def __init__(self, tokenizer):
+        special_ids = set(tokenizer.all_special_ids)
+        pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        self.size = len(pieces)
+        self.texts = ["" if token in special_ids else piece.replace(WORD_START_MARKER, " ")
+                      for token, piece in enumerate(pieces)]
+        self.supported = any(piece.startswith(WORD_START_MARKER) for piece in pieces)
+        # Pieces that continue the word before them, pieces that start a word after a space, and the rest
+        continues_word = [bool(text) and text[0] in IDENTIFIER_CHARS for text in self.texts]
+        starts_word = [len(text) > 1 and text[0] == " " and text[1] in IDENTIFIER_CHARS for text in self.texts]
+        self.continues_word = torch.tensor(continues_word)
+        self.starts_word = torch.tensor(starts_word)
+        self.other = ~(self.continues_word | self.starts_word)
+        # Numeric literals: digit pieces, spaced or glued
+        self.numbers = torch.tensor([text.strip().isdigit() and text.lstrip(" ") == text.strip() for text in self.texts])
+        # Pieces of a short alias: a lone letter starting it, digits continuing it
+        self.letters = torch.tensor([len(text.strip()) == 1 and text.strip() in string.ascii_letters
+                                     and (text[0] == " " or len(text) == 1) for text in self.texts])
+        self.digits = torch.tensor([text.isdigit() for text in self.texts])
+
+    def mask(self, token_ids):
+        mask = torch.zeros(self.size, dtype=torch.bool)
+        mask[list(token_ids)] = True
+        return mask
+
+
+class DecodeState:
+    """Where a generated prefix stands: the open word, its trie node and the SQL context."""
+
+    __slots__ = ("word", "node", "previous_word", "in_string", "aliases")
+
+    def __init__(self, word="", node=BOUNDARY, previous_word="", in_string=False, aliases=()):
+        self.word = word
+        self.node = node  # trie node of the open word, BOUNDARY between words, None for an unconstrained word
+        self.previous_word = previous_word
+        self.in_string = in_string
+        self.aliases = aliases  # names declared with AS so far, free wherever they are used
+
+
+class IdentifierTrie:
+    """Token trie of the words a constrained generation may spell for one schema.
+
+    Every word is inserted twice: as tokenized after a space ("SELECT name") and glued to the
+    punctuation before it ("Customers.name", "COUNT(name)"). Words in string literals, numbers
+    and aliases after AS stay free.
+    """
+
+    def __init__(self, tokenizer, vocabulary, schema_tables):
+        self.tokenizer = tokenizer
+        self.vocabulary = vocabulary
+        self._children = [{}, {}]  # node -> {token: child node}; 0 is the spaced root, 1 the glued root
+        self._terminal = [False, False]
+        self._masks = {}  # node -> allowed next tokens, built on first use
+        self._alias_masks = {}  # aliases -> boundary mask that also lets them start
+
+        words = set()
+        for word in (*SQL_WORDS, *schema_tables, *schema_tables.column_tables):
+            words.update(case(word) for case in WORD_CASES)
+        words = sorted(words)
+        # Words the vocabulary cannot spell (unknown pieces) are left out rather than matched loosely
+        unknown = tokenizer.unk_token_id
+        for token_ids in tokenizer(words, add_special_tokens=False)["input_ids"]:
+            if unknown not in token_ids:
+                self._insert(0, token_ids)
+        for token_ids in tokenizer(["." + word for word in words], add_special_tokens=False)["input_ids"]:
+            glued = self._glued(token_ids)
+            if glued and unknown not in glued:
+                self._insert(1, glued)
+
+        spaced_roots = vocabulary.mask(self._children[0])
+        glued_roots = vocabulary.mask(self._children[1])
+        # Between words: punctuation, numbers, or the first token of a known word
+        self.boundary_mask = vocabulary.other | vocabulary.numbers | vocabulary.letters | spaced_roots | glued_roots
+        # After a complete word: the same, except that an identifier piece would extend the word
+        self.after_word_mask = vocabulary.other | vocabulary.numbers | (vocabulary.letters & vocabulary.starts_word) \
+            | spaced_roots
+        # A number or short alias goes on with digits only
+        self.digits_mask = self.after_word_mask | vocabulary.digits
+        self.nodes = len(self._children)
+
+    def size_bytes(self, seen):
+        # The tokenizer and vocabulary serve every schema; only the trie and its masks are per schema
+        return sum(deep_size(value, seen) for name, value in vars(self).items()
+                   if name not in ("tokenizer", "vocabulary"))
+
+    def _glued(self, token_ids):
+        """Tokens of a word written right after '.', or None if the dot shares a token with the word."""
+        text = ""
+        for position, token in enumerate(token_ids):
+            text += self.vocabulary.texts[token]
+            if text.strip() == ".":
+                return token_ids[position + 1:]
+            if len(text.strip()) > 1:
+                return None
+        return None
+
+    def _insert(self, node, token_ids):
+        for token in token_ids:
+            child = self._children[node].get(token)
+            if child is None:
+                child = self._children[node][token] = len(self._children)
+                self._children.append({})
+                self._terminal.append(False)
+            node = child
+        self._terminal[node] = True
+
+    def advance(self, state, token):
+        """State after appending one generated token."""
+        text = self.vocabulary.texts[token]
+        if not text:
+            return state
+        word, node = state.word, state.node
+        previous_word, in_string, aliases = state.previous_word, state.in_string, state.aliases
+        if word and text[0] in IDENTIFIER_CHARS:
+            if node in (SHORT_ALIAS, NUMBER):
+                node = node if text.isdigit() else None
+            elif node is not None and node >= 0:
+                child = self._children[node].get(token)
+                node = SHORT_ALIAS if child is None and text.isdigit() and len(word) == 1 else child
+
+        for position, char in enumerate(text):
+            if in_string:
+                in_string = char != "'"
+            elif char == "'":
+                in_string = True
+                if word:
+                    aliases = self._declare(previous_word, word, aliases)
+                    previous_word, word = word, ""
+                node = BOUNDARY
+            elif char in IDENTIFIER_CHARS:
+                if not word:
+                    node = self._word_start(token, text, position, previous_word)
+                word += char
+            elif word:
+                aliases = self._declare(previous_word, word, aliases)
+                previous_word, word, node = word, "", BOUNDARY
+        return DecodeState(word, node, previous_word, in_string, aliases)
+
+    @staticmethod
+    def _declare(previous_word, word, aliases):
+        if previous_word.upper() == "AS" and word not in aliases:
+            return aliases + (word,)
+        return aliases
+
+    def _word_start(self, token, text, position, previous_word):
+        """Trie node of a word starting inside this token, or None when the word is free."""
+        if previous_word.upper() == "AS":
+            return None
+        if text[position].isdigit():
+            return NUMBER
+        rest = text[position:]
+        if not all(char in IDENTIFIER_CHARS for char in rest):
+            return None  # the piece also ends the word, which a known word's tokens never do
+        if position == 0:
+            node = self._children[1].get(token)  # glued to the punctuation before it
+        elif position == 1 and text[0] == " ":
+            node = self._children[0].get(token)
+        else:
+            return None
+        if node is None and len(rest) == 1:
+            return SHORT_ALIAS
+        return node
+
+    def allowed(self, state):
+        """Mask of the tokens that may follow, or None when the position is unconstrained."""
+        if state.in_string or state.node is None:
+            return None
+        if state.node == BOUNDARY:
+            if state.previous_word.upper() == "AS":
+                return None
+            return self._alias_mask(state.aliases) if state.aliases else self.boundary_mask
+        if any(alias.startswith(state.word) for alias in state.aliases):
+            return None
+        if state.node in (SHORT_ALIAS, NUMBER):
+            return self.digits_mask
+        mask = self._masks.get(state.node)
+        if mask is None:
+            mask = self.vocabulary.mask(self._children[state.node])
+            if len(state.word) == 1:
+                mask |= self.vocabulary.digits
+            if self._terminal[state.node]:
+                if state.word.upper() == "AS":
+                    mask |= self.vocabulary.other | self.vocabulary.starts_word
+                else:
+                    mask |= self.after_word_mask
+            self._masks[state.node] = mask
+        return mask
+
+    def _alias_mask(self, aliases):
+        """Boundary mask extended with the first token of each alias, spaced or after '.'."""
+        mask = self._alias_masks.get(aliases)
+        if mask is None:
+            first_tokens = set()
+            for alias in aliases:
+                spaced_ids, dot_ids = self.tokenizer([alias, "." + alias], add_special_tokens=False)["input_ids"]
+                glued_ids = self._glued(dot_ids)
+                first_tokens.update(token_ids[0] for token_ids in (spaced_ids, glued_ids) if token_ids)
+            mask = self._alias_masks[aliases] = self.boundary_mask | self.vocabulary.mask(first_tokens)
+        return mask
+
+
+def identifier_trie(schema_tables, tokenizer, vocabulary):
+    """The IdentifierTrie of a parsed schema, built once per schema hash."""
+    return schema_tables.derived("identifier_trie", lambda tables: IdentifierTrie(tokenizer, vocabulary, tables))
+
+
+class SchemaConstraintProcessor(LogitsProcessor):
+    """Masks the logits of tokens that would spell a word missing from the trie."""
+
+    def __init__(self, trie):
+        self.trie = trie
+        self._states = {}  # generated prefix -> DecodeState, so each step only advances by one token
+
+    def _state(self, prefix):
+        state = self._states.get(prefix)
+        if state is None:
+            state = self._state(prefix[:-1]) if len(prefix) > 1 else DecodeState()
+            state = self.trie.advance(state, prefix[-1]) if prefix else state
+            self._states[prefix] = state
+        return state
+
+    def __call__(self, input_ids, scores):
+        for row, ids in enumerate(input_ids.tolist()):
+            mask = self.trie.allowed(self._state(tuple(ids)))
+            if mask is None:
+                continue
+            if mask.shape[0] < scores.shape[-1]:
+                # The model's vocabulary may be padded beyond the tokenizer's
+                mask = torch.cat([mask, torch.zeros(scores.shape[-1] - mask.shape[0], dtype=torch.bool)])
+            scores[row] = scores[row].masked_fill(~mask[:scores.shape[-1]], float("-inf"))
+        return scores
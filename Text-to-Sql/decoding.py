@@ -0,0 +1,110 @@
+import os
+import threading
+
+from sql_postprocess import fix_sql_query
+from tracing import Histogram
+
+# Decoding tiers tried in order until fix_sql_query accepts the SQL; "beam" alone is the old behaviour
+DECODING_TIERS = os.environ.get("DECODING_TIERS", "greedy,beam,candidates")
+# Beams of the beam search tier
+BEAM_TIER_NUM_BEAMS = int(os.environ.get("BEAM_TIER_NUM_BEAMS", 4))
+# Beams and returned sequences of the candidates tier, whose first valid candidate is used
+CANDIDATE_TIER_NUM_BEAMS = int(os.environ.get("CANDIDATE_TIER_NUM_BEAMS", 8))
+CANDIDATE_TIER_SEQUENCES = int(os.environ.get("CANDIDATE_TIER_SEQUENCES", 4))
+# Upper bound on the num_candidates request option
+MAX_CANDIDATES = int(os.environ.get("MAX_CANDIDATES", 8))
+
+MAX_OUTPUT_LENGTH = 150
+
+
+class DecodingTier:
+    """One decoding setting of the escalation ladder: a name for metrics and the generate kwargs."""
+
+    __slots__ = ("name", "generate_kwargs")
+
+    def __init__(self, name, generate_kwargs):
+        self.name = name
+        self.generate_kwargs = generate_kwargs
+
+    def __repr__(self):
+        return f"DecodingTier({self.name}, {self.generate_kwargs})"
+
+
+def tier_settings(name):
+    """Generate kwargs of a tier by name; raises ValueError for unknown tiers."""
+    if name == "greedy":
+        return {"max_length": MAX_OUTPUT_LENGTH, "num_beams": 1}
+    if name == "beam":
+        return {"max_length": MAX_OUTPUT_LENGTH, "num_beams": BEAM_TIER_NUM_BEAMS, "early_stopping": True}
+    if name == "candidates":
+        return candidate_settings(CANDIDATE_TIER_SEQUENCES, CANDIDATE_TIER_NUM_BEAMS)
+    raise ValueError(f"Unknown decoding tier '{name}'; expected greedy, beam or candidates.")
+
+
+def candidate_settings(num_candidates, num_beams=BEAM_TIER_NUM_BEAMS):
+    """Generate kwargs returning the num_candidates best beams of one beam search."""
+    return {"max_length": MAX_OUTPUT_LENGTH, "num_beams": max(num_beams, num_candidates),
+            "num_return_sequences": num_candidates, "early_stopping": True}
+
+
+def decoding_tiers(names=DECODING_TIERS):
+    """The tiers named in a comma-separated list, in order."""
+    tiers = [DecodingTier(name, tier_settings(name)) for name in (part.strip() for part in names.split(",")) if name]
+    if not tiers:
+        raise ValueError("DECODING_TIERS names no decoding tier.")
+    return tiers
+
+
+def first_valid_sql(candidates, question, schema_tables, db_name="", tried=None):
+    """Post-process generated candidates in order and return the first that passes validation.
+
+    Returns the last 'Error: ...' when none does. tried, when given, collects the candidates seen
+    so far, so a candidate repeated by a later tier is not validated twice; None is returned when
+    every candidate had already been tried.
+    """
+    fixed_sql_query = None
+    for sql_query in candidates:
+        if tried is not None:
+            if sql_query in tried:
+                continue
+            tried.add(sql_query)
+        fixed_sql_query = fix_sql_query(sql_query, question, schema_tables, db_name)
+        if "Error:" not in fixed_sql_query:
+            break
+    return fixed_sql_query
+
+
+class DecodingStats:
+    """How often each tier ran and answered, with the latency of its generate + validation."""
+
+    def __init__(self):
+        self._tiers = {}  # tier name -> [attempts, accepted, Histogram]
+        self._lock = threading.Lock()
+
+    def record(self, tier, elapsed_ms, accepted):
+        with self._lock:
+            entry = self._tiers.get(tier)
+            if entry is None:
+                entry = self._tiers[tier] = [0, 0, Histogram()]
+            entry[0] += 1
+            entry[1] += bool(accepted)
+            entry[2].observe(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            return {
+                tier: {
+                    "attempts": attempts,
+                    "accepted": accepted,
+                    "accept_rate": round(accepted / attempts, 4) if attempts else 0.0,
+                    "latency": histogram.to_dict(),
+                }
+                for tier, (attempts, accepted, histogram) in self._tiers.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._tiers.clear()
+
+
+decoding_stats = DecodingStats()
@@ -0,0 +1,163 @@
+import re
+import threading
+import time
+
+from sql_postprocess import NUMERIC_WORDS
+from tracing import Histogram
+
+# Phrases that ask for the schema itself, anywhere in the question
+TABLE_LISTING_PHRASES = ("names of all tables", "list all tables", "show tables", "what tables", "all table names",
+                         "tables in the db", "tables in the database")
+COLUMN_LISTING_PHRASES = ("columns in", "columns of", "describe table", "show columns", "table structure")
+
+VERB = r"(?:list|show|get|fetch|display|retrieve|find|return|give\s+me)"
+COUNT = r"\d+|" + "|".join(NUMERIC_WORDS)
+ENTITY = r"[a-z_][\w ]*?"
+
+# Every intent in one compiled pattern, matched once per question. Listing intents are lookaheads so they
+# are found anywhere in the question; the others must cover all of it, so a question with any extra
+# condition ("how many users signed up in May") falls through to the model.
+ROUTER_PATTERN = re.compile(
+    r"^(?:"
+    r"(?=.*?(?P<list_tables>" + "|".join(map(re.escape, TABLE_LISTING_PHRASES)) + r"))"
+    r"|(?=.*?(?P<list_columns>" + "|".join(map(re.escape, COLUMN_LISTING_PHRASES)) + r"))"
+    r"|(?:" + VERB + r"\s+)?(?:me\s+)?(?:the\s+)?top\s+(?P<top_count>" + COUNT + r")\s+(?P<top_entity>" + ENTITY
+    + r")\s+by\s+(?:their\s+|the\s+)?(?P<top_column>" + ENTITY + r")\s*$"
+    r"|how\s+many\s+(?P<count_entity>" + ENTITY + r")(?:\s+(?:are\s+there|exist|do\s+we\s+have|are\s+in\s+the\s+"
+    r"(?:db|database)|in\s+total|(?:are\s+)?stored))?\s*$"
+    r"|" + VERB + r"\s+(?:me\s+)?all\s+(?:the\s+)?(?P<all_entity>" + ENTITY + r")\s*$"
+    r")"
+)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_question(question):
+    """Lowercase, single-spaced, without trailing punctuation."""
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+
+def name_variants(text):
+    """Spellings a plain-English name may have in a schema: as written, snake_case or CamelCase, singular or plural."""
+    name = text.strip().replace(" ", "_")
+    variants = [name]
+    if name.endswith("ies"):
+        variants.append(name[:-3] + "y")
+    if name.endswith("es"):
+        variants.append(name[:-2])
+    if name.endswith("s"):
+        variants.append(name[:-1])
+    else:
+        variants.append(name + "s")
+        variants.append(name[:-1] + "ies" if name.endswith("y") else name + "es")
+    if "_" in name:
+        # Names are matched ignoring case, so OrderItems is order_items without the underscores
+        variants += [variant.replace("_", "") for variant in variants]
+    return variants
+
+
+def resolve_entity(schema_tables, text):
+    """Schema spelling of the table a phrase like 'order items' names, or None."""
+    for variant in name_variants(text):
+        table = schema_tables.resolve_table(variant)
+        if table is not None:
+            return table
+    return None
+
+
+def resolve_column(schema_tables, table, text):
+    """Schema spelling of the table's column a phrase like 'total amount' names, or None."""
+    columns = {column.lower(): column for column in schema_tables.ordered_columns(table)}
+    for variant in name_variants(text):
+        column = columns.get(variant)
+        if column is not None:
+            return column
+    return None
+
+
+def route_question(question, schema_tables):
+    """Return (intent, SQL) for a question answerable from the schema alone, or None.
+
+    Intents: list_tables, list_columns, count ("how many X"), list_all ("list all X") and
+    top ("top N X by Y"). A phrase that does not name a table or column of the schema is not
+    guessed at; the question goes to the model instead.
+    """
+    text = normalize_question(question)
+    match = ROUTER_PATTERN.match(text)
+    if match is None:
+        return None
+
+    if match.group("list_tables"):
+        table_list = "', '".join(schema_tables)
+        return "list_tables", f"SELECT '{table_list}' AS table_names;"
+
+    if match.group("list_columns"):
+        # First word of the question that is a table name
+        for word in WORD_PATTERN.findall(text):
+            table_name = schema_tables.resolve_table(word)
+            if table_name is not None:
+                column_list = "', '".join(schema_tables.ordered_columns(table_name))
+                return "list_columns", f"SELECT '{column_list}' AS columns_in_{table_name};"
+        return None
+
+    if match.group("top_entity"):
+        table_name = resolve_entity(schema_tables, match.group("top_entity"))
+        column = table_name and resolve_column(schema_tables, table_name, match.group("top_column"))
+        if not column:
+            return None
+        count = match.group("top_count")
+        limit = count if count.isdigit() else NUMERIC_WORDS[count]
+        return "top", f"SELECT * FROM {table_name} ORDER BY {column} DESC LIMIT {limit};"
+
+    if match.group("count_entity"):
+        table_name = resolve_entity(schema_tables, match.group("count_entity"))
+        return ("count", f"SELECT COUNT(*) FROM {table_name};") if table_name else None
+
+    table_name = resolve_entity(schema_tables, match.group("all_entity"))
+    return ("list_all", f"SELECT * FROM {table_name};") if table_name else None
+
+
+class FastPathStats:
+    """Questions the router answered without model.generate, per intent, and the router's own latency."""
+
+    def __init__(self):
+        self._served = {}  # intent -> count
+        self.fell_through = 0
+        self._latency = Histogram()
+        self._lock = threading.Lock()
+
+    def record(self, intent, elapsed_ms):
+        with self._lock:
+            if intent is None:
+                self.fell_through += 1
+            else:
+                self._served[intent] = self._served.get(intent, 0) + 1
+            self._latency.observe(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            served = sum(self._served.values())
+            routed = served + self.fell_through
+            return {
+                "served": served,
+                "served_by_intent": dict(self._served),
+                "fell_through": self.fell_through,
+                "serve_rate": round(served / routed, 4) if routed else 0.0,
+                "latency": self._latency.to_dict(),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._served.clear()
+            self.fell_through = 0
+            self._latency = Histogram()
+
+
+fast_path_stats = FastPathStats()
+
+
+def fast_path_sql(question, schema_tables):
+    """SQL the router answers from the schema alone, or None; every call is counted in fast_path_stats."""
+    start = time.perf_counter()
+    routed = route_question(question, schema_tables)
+    fast_path_stats.record(routed[0] if routed else None, (time.perf_counter() - start) * 1000.0)
+    return routed[1] if routed else None
@@ -0,0 +1,157 @@
+import re
+
+from schema_cache import deep_size
+
+# customer_id / Customer_ID -> customer / Customer
+REFERENCE_COLUMN_PATTERN = re.compile(r"^(\w+?)_id$", re.IGNORECASE)
+# CustomerId / CustomerID -> Customer; the capital I keeps "paid" or "valid" out
+CAMEL_REFERENCE_PATTERN = re.compile(r"^(\w*[a-z0-9])I[dD]$")
+
+
+def singular(word):
+    """Naive English singular of a lowercase name: categories -> category, addresses -> address."""
+    if word.endswith("ies") and len(word) > 3:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def name_variants(name):
+    """Lookup keys of a table or column stem: lowercase, singular, and both without underscores."""
+    lower = name.lower()
+    variants = {lower, singular(lower)}
+    return variants | {variant.replace("_", "") for variant in variants}
+
+
+def reference_stem(column):
+    """The entity a column refers to by naming convention (customer_id -> customer), or None."""
+    match = REFERENCE_COLUMN_PATTERN.match(column) or CAMEL_REFERENCE_PATTERN.match(column)
+    return match.group(1) if match else None
+
+
+class ForeignKey:
+    """An inferred reference from table.column to ref_table.ref_column."""
+
+    __slots__ = ("table", "column", "ref_table", "ref_column", "reason")
+
+    def __init__(self, table, column, ref_table, ref_column, reason):
+        self.table = table
+        self.column = column
+        self.ref_table = ref_table
+        self.ref_column = ref_column
+        self.reason = reason  # "name" (customer_id -> Customers), "primary key" or "shared column"
+
+    def __repr__(self):
+        return f"ForeignKey({self.table}.{self.column} -> {self.ref_table}.{self.ref_column}, {self.reason})"
+
+
+class ForeignKeyIndex:
+    """Foreign keys inferred from naming conventions of a parsed schema, built in one pass over its columns.
+
+    A column references another table when:
+      - its name is <entity>_id / <Entity>Id and <entity> matches a table name, ignoring
+        case, underscores and plural endings (customer_id -> Customers, category_id -> categories);
+      - it has the same name as another table's primary key (id, <table>_id, <table>Id, ...);
+      - otherwise, for *_id columns shared by several tables, it points at the first table declaring it.
+    The referenced column is the target's primary key, or the same-named column if it has no key.
+    """
+
+    def __init__(self, schema_tables):
+        tables_by_name = {}
+        primary_keys = {}
+        tables_by_key = {}  # lowercase primary key column -> table
+        spellings = {}  # (table, lowercase column) -> column as written
+        for table in schema_tables:
+            for variant in name_variants(table):
+                tables_by_name.setdefault(variant, table)
+            for column in schema_tables.ordered_columns(table):
+                spellings.setdefault((table, column.lower()), column)
+            key = self._primary_key(table, schema_tables.ordered_columns(table))
+            if key is not None:
+                primary_keys[table] = key
+                if key.lower() != "id":
+                    tables_by_key.setdefault(key.lower(), table)
+
+        self.primary_keys = primary_keys
+        self.foreign_keys = []
+        self._by_table = {}  # lowercase table -> foreign keys declared on it
+        self._by_ref_table = {}  # lowercase table -> foreign keys pointing at it
+        self._by_pair = {}  # frozenset of both lowercase tables -> first foreign key between them
+
+        first_owner = {}  # lowercase column -> first table declaring it
+        for table in schema_tables:
+            for column in schema_tables.ordered_columns(table):
+                column_key = column.lower()
+                owner = first_owner.setdefault(column_key, table)
+                if primary_keys.get(table) == column:
+                    continue
+
+                ref_table, reason = None, None
+                stem = reference_stem(column)
+                if stem is not None:
+                    ref_table = next((tables_by_name[variant] for variant in name_variants(stem)
+                                      if variant in tables_by_name), None)
+                    reason = "name"
+                if ref_table is None and column_key in tables_by_key:
+                    ref_table, reason = tables_by_key[column_key], "primary key"
+                if ref_table is None and stem is not None and owner != table:
+                    ref_table, reason = owner, "shared column"
+                if ref_table is None or ref_table == table:
+                    continue
+
+                ref_column = primary_keys.get(ref_table) if reason != "shared column" else None
+                if ref_column is None:
+                    # No key to point at: the same column in the referenced table, if it has one
+                    ref_column = spellings.get((ref_table, column_key))
+                if ref_column is not None:
+                    self._add(ForeignKey(table, column, ref_table, ref_column, reason))
+
+    @staticmethod
+    def _primary_key(table, columns):
+        """The column named id, <table>_id or <table>Id (singular or plural), if the table has one."""
+        names = {variant + "id" for variant in name_variants(table)} | {"id"}
+        return next((column for column in columns if column.lower().replace("_", "") in names), None)
+
+    def _add(self, foreign_key):
+        self.foreign_keys.append(foreign_key)
+        self._by_table.setdefault(foreign_key.table.lower(), []).append(foreign_key)
+        self._by_ref_table.setdefault(foreign_key.ref_table.lower(), []).append(foreign_key)
+        self._by_pair.setdefault(frozenset((foreign_key.table.lower(), foreign_key.ref_table.lower())), foreign_key)
+
+    def __len__(self):
+        return len(self.foreign_keys)
+
+    def __iter__(self):
+        return iter(self.foreign_keys)
+
+    def references(self, table):
+        """Foreign keys declared on a table."""
+        return self._by_table.get(table.lower(), [])
+
+    def referenced_by(self, table):
+        """Foreign keys of other tables pointing at this table."""
+        return self._by_ref_table.get(table.lower(), [])
+
+    def between(self, table1, table2):
+        """The foreign key linking two tables in either direction, or None."""
+        return self._by_pair.get(frozenset((table1.lower(), table2.lower())))
+
+    def primary_key(self, table):
+        return self.primary_keys.get(table)
+
+    def size_bytes(self, seen):
+        return deep_size(vars(self), seen)
+
+    def stats(self):
+        reasons = {}
+        for foreign_key in self.foreign_keys:
+            reasons[foreign_key.reason] = reasons.get(foreign_key.reason, 0) + 1
+        return {"foreign_keys": len(self.foreign_keys), "primary_keys": len(self.primary_keys), "by_reason": reasons}
+
+
+def foreign_key_index(schema_tables):
+    """The ForeignKeyIndex of a parsed schema, inferred once and memoized with it (i.e. per schema hash)."""
+    return schema_tables.derived("foreign_key_index", ForeignKeyIndex)
@@ -0,0 +1,124 @@
+"""
+Seq2seq inference backends: eager PyTorch, or ONNX Runtime through an exported checkpoint.
+
+Export once next to the checkpoint, then start the service with INFERENCE_BACKEND=onnx:
+    pip install -r requirements-onnx.txt
+    python inference_backend.py export --model ./model
+
+A checkpoint with only pytorch_model.bin or a slow tokenizer's files loads faster once converted,
+ahead of time, with:
+    python inference_backend.py convert --model ./model
+(CONVERT_CHECKPOINT=1 converts it in place on first load instead.)
+"""
+import argparse
+import os
+import tempfile
+
+# "pytorch" (eager model.generate) or "onnx" (ONNX Runtime); onnx falls back to pytorch when
+# onnxruntime / optimum or the exported graphs are missing
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "pytorch").lower()
+# Execution provider of the ONNX Runtime sessions
+ONNX_PROVIDER = os.environ.get("ONNX_PROVIDER", "CPUExecutionProvider")
+# Directory of the exported graphs, relative to the checkpoint
+ONNX_SUBDIR = "onnx"
+
+BACKENDS = ("pytorch", "onnx")
+
+# Write model.safetensors and tokenizer.json next to a checkpoint that lacks them on first load, so later
+# starts memory-map the weights instead of unpickling them and skip rebuilding the fast tokenizer. Off by
+# default: it writes into the checkpoint directory, which a deployment may share or ship read-only
+CONVERT_CHECKPOINT = os.environ.get("CONVERT_CHECKPOINT", "0").lower() in ("1", "true", "yes")
+SAFETENSORS_FILES = ("model.safetensors", "model.safetensors.index.json")
+TOKENIZER_FILE = "tokenizer.json"
+
+
+def onnx_path(model_path):
+    return os.path.join(model_path, ONNX_SUBDIR)
+
+
+def load_seq2seq_model(model_path, backend=INFERENCE_BACKEND):
+    """Return (model, backend used). Both backends expose the transformers generate() API,
+    so greedy and beam search settings work unchanged."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}'; expected one of {', '.join(BACKENDS)}.")
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+            # Encoder, decoder and decoder-with-past sessions; the past graph reuses the key/value cache
+            model = ORTModelForSeq2SeqLM.from_pretrained(onnx_path(model_path), provider=ONNX_PROVIDER,
+                                                         use_cache=True)
+            return model, "onnx"
+        except Exception as e:
+            print(f"⚠️ ONNX Runtime backend unavailable ({e}); falling back to PyTorch.")
+
+    from transformers import AutoModelForSeq2SeqLM
+    from transformers.utils import is_accelerate_available
+
+    # With accelerate installed the weights are loaded straight into empty modules instead of
+    # overwriting a randomly initialized copy
+    return AutoModelForSeq2SeqLM.from_pretrained(model_path, low_cpu_mem_usage=is_accelerate_available()), "pytorch"
+
+
+def convert_checkpoint(model_path, model=None, tokenizer=None):
+    """Save the loaded PyTorch model as safetensors and a fast tokenizer as tokenizer.json when the
+    checkpoint has neither. Returns the names of the files written; a read-only checkpoint only warns.
+
+    Call it before apply_precision, so the saved weights are the checkpoint's own.
+    """
+    written = []
+    try:
+        if model is not None and not any(os.path.exists(os.path.join(model_path, name)) for name in SAFETENSORS_FILES):
+            # Saved aside and moved in, so a failed save never leaves a partial file that would be loaded next time
+            with tempfile.TemporaryDirectory(dir=model_path) as staging:
+                model.save_pretrained(staging, safe_serialization=True)
+                # Shards before the index that names them
+                for name in sorted(os.listdir(staging), key=lambda name: name.endswith(".json")):
+                    if name.startswith("model") and ".safetensors" in name:
+                        os.replace(os.path.join(staging, name), os.path.join(model_path, name))
+                        written.append(name)
+        tokenizer_file = os.path.join(model_path, TOKENIZER_FILE)
+        if getattr(tokenizer, "is_fast", False) and not os.path.exists(tokenizer_file):
+            tokenizer.backend_tokenizer.save(tokenizer_file)
+            written.append(TOKENIZER_FILE)
+    except OSError as e:
+        print(f"⚠️ Could not convert the checkpoint in {model_path}: {e}")
+    if written:
+        print(f"✅ Wrote {', '.join(written)} to {model_path}; later starts load them directly.")
+    return written
+
+
+def export_onnx(model_path, output_path=None):
+    """Export a seq2seq checkpoint to ONNX encoder / decoder / decoder-with-past graphs, with its tokenizer."""
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    from transformers import AutoTokenizer
+
+    output_path = output_path or onnx_path(model_path)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_path, export=True, use_cache=True)
+    model.save_pretrained(output_path)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seq2seq inference backend tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="export a checkpoint to ONNX graphs")
+    export_parser.add_argument("--model", default="./model")
+    export_parser.add_argument("--output", help=f"default: <model>/{ONNX_SUBDIR}")
+    convert_parser = subparsers.add_parser("convert", help="write model.safetensors and tokenizer.json")
+    convert_parser.add_argument("--model", default="./model")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        from transformers import AutoTokenizer
+
+        model, _ = load_seq2seq_model(args.model, "pytorch")
+        if not convert_checkpoint(args.model, model, AutoTokenizer.from_pretrained(args.model)):
+            print(f"Nothing to convert in {args.model}")
+    else:
+        print(f"Exported ONNX graphs to {export_onnx(args.model, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
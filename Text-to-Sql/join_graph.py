@@ -0,0 +1,103 @@
+import os
+from array import array
+from collections import deque
+
+from schema_cache import deep_size
+
+# Graphs up to this many tables get every shortest-path tree built when their schema is registered;
+# larger ones build a tree the first time a query joins from that table
+JOIN_GRAPH_PRECOMPUTE_MAX_TABLES = int(os.environ.get("JOIN_GRAPH_PRECOMPUTE_MAX_TABLES", 500))
+
+
+class JoinGraph:
+    """Undirected graph of tables joined by known relationships, with shortest join paths.
+
+    Built from (table1, table2, condition) edges, where condition is whatever the caller
+    wants back for that hop (the rewriter uses pre-lexed ON tokens). Tables are matched
+    case-insensitively. For each source table a BFS tree (parent table and edge per table,
+    stored as int arrays) is computed once, so path() is a walk up that tree.
+    """
+
+    def __init__(self, edges=()):
+        self.tables = []  # node index -> table name
+        self.edges = []  # edge index -> (table1, table2, condition)
+        self._nodes = {}  # lowercase table name -> node index
+        self._adjacency = []  # node index -> list of (neighbour node, edge index)
+        self._trees = {}  # source node -> (parent node array, edge index array)
+        for table1, table2, condition in edges:
+            self.add_edge(table1, table2, condition)
+
+    def _node(self, table):
+        key = table.lower()
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = len(self.tables)
+            self.tables.append(table)
+            self._adjacency.append([])
+        return node
+
+    def add_edge(self, table1, table2, condition):
+        left, right = self._node(table1), self._node(table2)
+        edge = len(self.edges)
+        self.edges.append((table1, table2, condition))
+        self._adjacency[left].append((right, edge))
+        self._adjacency[right].append((left, edge))
+        self._trees.clear()
+
+    def __contains__(self, table):
+        return table.lower() in self._nodes
+
+    def __len__(self):
+        return len(self.tables)
+
+    def _tree(self, source):
+        tree = self._trees.get(source)
+        if tree is not None:
+            return tree
+        parents = array("i", [-1]) * len(self.tables)
+        via = array("i", [-1]) * len(self.tables)
+        parents[source] = source
+        pending = deque([source])
+        while pending:
+            node = pending.popleft()
+            for neighbour, edge in self._adjacency[node]:
+                if parents[neighbour] == -1:
+                    parents[neighbour] = node
+                    via[neighbour] = edge
+                    pending.append(neighbour)
+        tree = self._trees[source] = (parents, via)
+        return tree
+
+    def precompute(self):
+        """Build the shortest-path tree of every table (all-pairs join paths)."""
+        for source in range(len(self.tables)):
+            self._tree(source)
+
+    def path(self, source, target):
+        """Shortest join chain from source to target as (joined table, new table, condition) hops.
+
+        Returns [] when both name the same table and None when either table is unknown or
+        the two are not connected.
+        """
+        source_node = self._nodes.get(source.lower())
+        target_node = self._nodes.get(target.lower())
+        if source_node is None or target_node is None:
+            return None
+        parents, via = self._tree(source_node)
+        if parents[target_node] == -1:
+            return None
+
+        hops = []
+        node = target_node
+        while node != source_node:
+            parent = parents[node]
+            hops.append((self.tables[parent], self.tables[node], self.edges[via[node]][2]))
+            node = parent
+        hops.reverse()
+        return hops
+
+    def size_bytes(self, seen):
+        return deep_size(vars(self), seen)
+
+    def stats(self):
+        return {"tables": len(self.tables), "edges": len(self.edges), "path_trees": len(self._trees)}
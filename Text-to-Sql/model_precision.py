@@ -0,0 +1,38 @@
+import os
+
+# Weights the model is run with on CPU: fp32 (as trained), int8 (dynamically quantized Linear layers) or bf16
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "fp32").lower()
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def apply_precision(model, precision=MODEL_PRECISION):
+    """Return the model converted for inference in the given precision."""
+    import torch
+
+    if precision == "fp32":
+        return model
+    if precision == "int8":
+        # Linear weights are stored as int8 and activations quantized on the fly; embeddings and norms stay fp32
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    raise ValueError(f"Unknown MODEL_PRECISION '{precision}'; expected one of {', '.join(PRECISIONS)}.")
+
+
+def model_size_bytes(model):
+    """Bytes of the model weights (quantized layers keep theirs outside .parameters()).
+
+    Summed from the state dict's tensors rather than serializing it, which would copy every weight
+    at startup; tied weights are counted once.
+    """
+    import torch
+
+    storages = {}
+    pending = list(model.state_dict().values())
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (tuple, list)):
+            pending.extend(value)  # packed (weight, bias) of a quantized Linear
+        elif isinstance(value, torch.Tensor):
+            storages[value.untyped_storage().data_ptr()] = value.untyped_storage().nbytes()
+    return sum(storages.values())
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from tracing import Histogram
+
+# Fine-tuned checkpoints per schema family, e.g. "RetailDB=./models/retail,HospitalDB=./models/hospital".
+# Schemas of other families use ./model, which stays loaded outside the budget below.
+MODEL_CHECKPOINTS = os.environ.get("MODEL_CHECKPOINTS", "")
+# Memory budget for the fine-tuned checkpoints loaded at the same time; least recently used idle ones are unloaded
+MODEL_RESIDENCY_MAX_BYTES = int(os.environ.get("MODEL_RESIDENCY_MAX_BYTES", 2 * 1024 ** 3))
+# Seconds a checkpoint that failed to load is left alone (its family uses ./model) before the next request retries it
+MODEL_RESIDENCY_RETRY_S = float(os.environ.get("MODEL_RESIDENCY_RETRY_S", 60))
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".onnx", ".onnx_data")
+
+
+def parse_checkpoints(setting):
+    """{family: checkpoint path} from a MODEL_CHECKPOINTS setting."""
+    checkpoints = {}
+    for pair in setting.split(","):
+        if pair.strip():
+            family, _, path = pair.partition("=")
+            if not path.strip():
+                raise ValueError(f"MODEL_CHECKPOINTS entry '{pair}' is not of the form family=path.")
+            checkpoints[family.strip()] = path.strip()
+    return checkpoints
+
+
+def checkpoint_bytes(path):
+    """Size of the weight files under a checkpoint directory: the room to make before loading it."""
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, files in os.walk(path) for name in files if name.endswith(WEIGHT_SUFFIXES))
+
+
+class ResidentModel:
+    """A family's checkpoint and, while it is loaded, its model."""
+
+    __slots__ = ("family", "path", "model", "nbytes", "in_flight", "loading", "error", "failed_at", "uses",
+                 "last_used")
+
+    def __init__(self, family, path):
+        self.family = family
+        self.path = path
+        self.model = None
+        self.nbytes = 0
+        self.in_flight = 0  # requests using the model (or waiting for it to load); never unloaded while > 0
+        self.loading = False
+        self.error = None  # why the last load failed; the family falls back to the default model until a retry loads it
+        self.failed_at = None
+        self.uses = 0
+        self.last_used = None
+
+
+class ModelResidency:
+    """Loads per-family checkpoints on demand and keeps them within a memory budget.
+
+    load(path) must return (model, bytes it occupies). Models are loaded by the first request that
+    needs them, on that request's thread, while the others for the same family wait. When the
+    resident models exceed max_bytes the least recently used ones with no request in flight are
+    unloaded; a model still in use is unloaded once its last request finishes, if the budget still
+    needs it then. A checkpoint that fails to load is tried again by the first request after retry_s.
+    """
+
+    def __init__(self, load, checkpoints, max_bytes=MODEL_RESIDENCY_MAX_BYTES, retry_s=MODEL_RESIDENCY_RETRY_S):
+        self.load = load
+        self.max_bytes = max_bytes
+        self.retry_s = retry_s
+        self.resident_bytes = 0
+        self._entries = {family: ResidentModel(family, path) for family, path in checkpoints.items()}
+        self._lru = OrderedDict()  # family -> entry of each loaded model, least recently used first
+        self._condition = threading.Condition()
+        self.hits = 0
+        self.loads = 0
+        self.failures = 0
+        self.evictions = 0
+        self._load_ms = Histogram()
+
+    def __contains__(self, family):
+        return family in self._entries
+
+    @contextmanager
+    def use(self, family):
+        """Yield the family's model, loading it first if needed, and keep it loaded until the block exits.
+
+        Yields None for family None, or when the checkpoint failed to load (within the last retry_s);
+        the caller uses the default model instead.
+        """
+        if family is None:
+            yield None
+            return
+        entry = self._acquire(family)
+        try:
+            yield entry.model
+        finally:
+            with self._condition:
+                entry.in_flight -= 1
+                entry.last_used = time.monotonic()
+                self._evict()
+
+    def _acquire(self, family):
+        with self._condition:
+            entry = self._entries[family]
+            entry.in_flight += 1
+            entry.uses += 1
+            while entry.loading:
+                self._condition.wait()
+            if entry.model is not None:
+                self.hits += 1
+                self._lru.move_to_end(family)
+                return entry
+            if entry.error is not None and time.monotonic() - entry.failed_at < self.retry_s:
+                return entry
+            entry.loading = True
+            # Unload idle models before loading rather than after, so the peak stays near the budget
+            self._evict(checkpoint_bytes(entry.path))
+
+        start = time.perf_counter()
+        model, nbytes, error = None, 0, None
+        try:
+            model, nbytes = self.load(entry.path)
+        except Exception as e:
+            print(f"⚠️ Could not load the {family} checkpoint {entry.path}; using the default model: {e}")
+            error = str(e)
+        finally:
+            # Also runs when the load is interrupted (KeyboardInterrupt, SystemExit), so the requests
+            # waiting for it wake up and the next one loads it again
+            with self._condition:
+                entry.loading = False
+                if model is not None:
+                    entry.model, entry.nbytes, entry.error = model, nbytes, None
+                    self.loads += 1
+                    self._load_ms.observe((time.perf_counter() - start) * 1000.0)
+                    self.resident_bytes += nbytes
+                    self._lru[family] = entry
+                    self._evict()
+                elif error is not None:
+                    entry.error, entry.failed_at = error, time.monotonic()
+                    self.failures += 1
+                else:
+                    # The exception propagates out of use() before its block runs: release the request here
+                    entry.in_flight -= 1
+                self._condition.notify_all()
+        return entry
+
+    def _evict(self, incoming_bytes=0):
+        """Unload least recently used idle models until incoming_bytes more would fit. Holds the lock."""
+        for family, entry in list(self._lru.items()):
+            if self.resident_bytes + incoming_bytes <= self.max_bytes:
+                break
+            if entry.in_flight:
+                continue
+            del self._lru[family]
+            self.resident_bytes -= entry.nbytes
+            # The last reference: its weights are freed once no generate call holds the model either
+            entry.model, entry.nbytes = None, 0
+            self.evictions += 1
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            return {
+                "max_bytes": self.max_bytes,
+                "retry_s": self.retry_s,
+                "resident_bytes": self.resident_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "failures": self.failures,
+                "evictions": self.evictions,
+                "load_ms": self._load_ms.to_dict(),
+                "checkpoints": {
+                    family: {
+                        "path": entry.path,
+                        "resident": entry.model is not None,
+                        "loading": entry.loading,
+                        "bytes": entry.nbytes,
+                        "in_flight": entry.in_flight,
+                        "uses": entry.uses,
+                        "idle_s": round(now - entry.last_used, 1) if entry.last_used is not None else None,
+                        "error": entry.error,
+                    }
+                    for family, entry in self._entries.items()
+                },
+            }
@@ -0,0 +1,91 @@
+from schema_cache import parse_schema
+
+QUESTION_PREFIX = "Question: "
+SCHEMA_HEADER = "\nSchema:"
+SCHEMA_FOOTER = "\nSQL Query:"
+
+# Schema used to check that joined segments encode like the whole prompt
+CHECK_SCHEMA = "users(name, email, created_at), orders(id, user_id, total_amount)"
+CHECK_QUESTION = "total order amount per user's email"
+
+
+def prompt_text(instructions, question, schema):
+    """The full prompt the model was trained on."""
+    return f"{instructions}{QUESTION_PREFIX}{question}{SCHEMA_HEADER} {schema}{SCHEMA_FOOTER}"
+
+
+def table_text(table, columns):
+    """One table of the prompt schema."""
+    return f"{table}({', '.join(columns)})"
+
+
+def tables_schema(schema_tables, tables):
+    """Schema text listing only the given tables."""
+    return ", ".join(table_text(table, schema_tables.ordered_columns(table)) for table in tables)
+
+
+class PromptSegments:
+    """Builds model input ids from token ids cached per prompt segment.
+
+    Only the question changes between requests for the same schema, so the instruction block is
+    encoded once per process, full schemas once per schema hash and tables (for pruned prompts)
+    once per schema and table; a request only encodes "Question: <question>". Segments are cut at
+    spaces and newlines, where a SentencePiece tokenizer starts a new piece anyway, so joining
+    them gives the ids of the whole prompt. exact records whether that holds for the loaded
+    tokenizer; callers encode the whole prompt text when it does not.
+    """
+
+    def __init__(self, tokenizer, instructions, max_tokens):
+        self.tokenizer = tokenizer
+        self.instructions = instructions
+        self.max_tokens = max_tokens
+        # Room for the question and schema ids once the special tokens (EOS) are added
+        self.budget = max_tokens - tokenizer.num_special_tokens_to_add()
+        self.instruction_ids = self.encode(instructions)
+        self.header_ids = self.encode(SCHEMA_HEADER)
+        self.footer_ids = self.encode(SCHEMA_FOOTER)
+        self.exact = self._check()
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def encode_text(self, question, schema):
+        """Encode the whole prompt, truncating the end like every segmented prompt is."""
+        return self.tokenizer.encode(prompt_text(self.instructions, question, schema),
+                                     max_length=self.max_tokens, truncation=True)
+
+    def schema_ids(self, schema):
+        """Token ids of the schema segment of the prompt."""
+        return self.encode(f"{SCHEMA_HEADER} {schema}{SCHEMA_FOOTER}")
+
+    def table_ids(self, schema_tables, tables):
+        """Token ids of the schema segment listing only the given tables, from per-table ids cached with the schema."""
+        cached = schema_tables.derived("prompt_table_ids", lambda _: {})
+        ids = list(self.header_ids)
+        last = len(tables) - 1
+        for position, table in enumerate(tables):
+            key = (table, position == last)  # every table but the last is followed by a comma
+            table_ids = cached.get(key)
+            if table_ids is None:
+                text = table_text(table, schema_tables.ordered_columns(table))
+                table_ids = cached[key] = self.encode(text if position == last else text + ",")
+            ids += table_ids
+        ids += self.footer_ids
+        return ids
+
+    def input_ids(self, question, schema_ids):
+        """Join the cached instruction and schema ids with the freshly encoded question."""
+        ids = self.instruction_ids + self.encode(QUESTION_PREFIX + question)
+        # Truncate the tail like tokenizer.encode(truncation=True) does, leaving room for the EOS token;
+        # only the part of a long schema that fits is copied
+        ids = ids[:self.budget]
+        ids += schema_ids[:self.budget - len(ids)]
+        return self.tokenizer.build_inputs_with_special_tokens(ids)
+
+    def _check(self):
+        expected = self.encode_text(CHECK_QUESTION, CHECK_SCHEMA)
+        if self.input_ids(CHECK_QUESTION, self.schema_ids(CHECK_SCHEMA)) != expected:
+            return False
+        # Pruned prompts are joined per table
+        check_tables = parse_schema(CHECK_SCHEMA)
+        return self.input_ids(CHECK_QUESTION, self.table_ids(check_tables, list(check_tables))) == expected
@@ -0,0 +1,160 @@
+import os
+import re
+
+from result_cache import InvalidationLog, ResultCache, RESULT_CACHE_TTL_S
+from sqlparse import tokens as T
+from sql_postprocess import NUMERIC_WORDS, VALUE_CASING, fix_value_casing
+from sql_rewrite import SqlQuery, is_type, is_whitespace, is_word, lex
+
+# Maximum number of cached slotted SQL templates
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 1024))
+
+# Literal kinds in extraction order; earlier kinds claim their text first
+QUOTED_PATTERN = re.compile(r"'([^']+)'|\"([^\"]+)\"")
+DATE_PATTERN = re.compile(r"\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}/\d{1,2}/\d{4}\b")
+# Month and weekday names are dates, not names: "orders from January" is not "customers from Karachi"
+DATE_WORD_PATTERN = re.compile(
+    r"\b(?:January|February|March|April|May|June|July|August|September|October|November|December"
+    r"|Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)\b", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])|\b(" + "|".join(NUMERIC_WORDS) + r")\b", re.IGNORECASE)
+# Runs of capitalized words ("Karachi", "New York"); the first word of the question is never a literal
+NAME_PATTERN = re.compile(r"(?<!^)(?<![\w'])[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b")
+
+SLOT_MARKER = "__SLOT_{}__"
+SLOT_MARKER_PATTERN = re.compile(r"__SLOT_([A-Z]+\d+)__")
+# Columns holding dates or times; DATE slots may only fill these, and other slots never do
+DATE_COLUMN_PATTERN = re.compile(r"date|time|_at$|day|month|year", re.IGNORECASE)
+
+
+def _previous(tokens, i):
+    i -= 1
+    while i >= 0 and is_whitespace(tokens[i]):
+        i -= 1
+    return i if i >= 0 else None
+
+
+def compared_column(tokens, i):
+    """Column a literal token is compared with (`column = 'value'`, `column LIKE 'value'`), or None."""
+    operator = _previous(tokens, i)
+    if operator is None or not is_type(tokens[operator][0], T.Operator.Comparison):
+        return None
+    column = _previous(tokens, operator)
+    if column is None or not is_word(tokens[column]):
+        return None
+    return tokens[column][1]
+
+
+def slot_fits(kind, value, column):
+    """Whether a literal of this slot kind and value can stand in a comparison with `column`.
+
+    Numbers fit anywhere (LIMIT, amounts); other literals must be compared with a column, dates
+    only with date columns, and values of a column with known spellings (VALUE_CASING) must be one
+    of them.
+    """
+    if kind == "NUM":
+        return True
+    if column is None or (kind == "DATE") != bool(DATE_COLUMN_PATTERN.search(column)):
+        return False
+    for expected_column, values in VALUE_CASING.items():
+        if column.lower().endswith(expected_column):
+            return f"'{value.lower()}'" in values
+    return True
+
+
+def slot_kind(name):
+    return name.rstrip("0123456789")
+
+
+class QuestionTemplate:
+    """A question with its literals replaced by typed slots, e.g. 'orders from <NAME0>'."""
+
+    __slots__ = ("text", "slots")
+
+    def __init__(self, text, slots):
+        self.text = text
+        self.slots = slots  # list of (slot name, literal as it should appear in SQL)
+
+    def slot_sql(self, sql):
+        """Replace each literal in the generated SQL with its slot marker.
+
+        Only SQL literals count: a number token for NUM slots, a quoted string compared with a
+        fitting column (slot_fits) for the others. Returns None when a literal is not exactly one
+        such token, since the SQL could then not be re-filled safely for a different value.
+        """
+        tokens = lex(sql)
+        for name, value in self.slots:
+            kind = slot_kind(name)
+            found = []
+            for i, (ttype, text) in enumerate(tokens):
+                if kind == "NUM" and is_type(ttype, T.Number) and text == value:
+                    found.append((i, text.replace(value, SLOT_MARKER.format(name))))
+                elif (is_type(ttype, T.String) and len(text) > 1 and text[0] == text[-1] in "'\""
+                        and text[1:-1].lower() == value.lower()):
+                    found.append((i, text[0] + SLOT_MARKER.format(name) + text[-1]))
+            if len(found) != 1:
+                return None
+            i, marked = found[0]
+            if not slot_fits(kind, value, compared_column(tokens, i)):
+                return None
+            tokens[i] = (tokens[i][0], marked)
+        return "".join(text for _, text in tokens)
+
+    def fill_sql(self, slotted_sql):
+        """Put this question's literals into SQL cached for the same template.
+
+        Returns None when a literal does not fit the column its slot is compared with (e.g. a value
+        the column is not known to hold); the caller then generates instead.
+        """
+        values = dict(self.slots)
+        tokens = lex(slotted_sql)
+        for i, (_, text) in enumerate(tokens):
+            marker = SLOT_MARKER_PATTERN.search(text)
+            if marker and not slot_fits(slot_kind(marker.group(1)), values[marker.group(1)],
+                                        compared_column(tokens, i)):
+                return None
+        filled = SLOT_MARKER_PATTERN.sub(lambda m: values[m.group(1)], slotted_sql)
+        # Literals coming from the question need the same value normalization as generated ones
+        query = SqlQuery.parse(filled)
+        fix_value_casing(query)
+        return query.to_sql()
+
+
+def extract_template(question, schema_tables):
+    """Split a question into a template and its literal slots.
+
+    Quoted strings, dates (including month and weekday names), numbers (digits or the number words
+    apply_limit_if_requested understands) and capitalized names that are not tables or columns
+    become slots.
+    """
+    slots = []
+    counters = {}
+
+    def add_slot(kind, value):
+        index = counters.get(kind, 0)
+        counters[kind] = index + 1
+        name = f"{kind}{index}"
+        slots.append((name, value))
+        return f"<{name}>"
+
+    def quoted(match):
+        return add_slot("STR", match.group(1) or match.group(2))
+
+    def number(match):
+        word = match.group(1)
+        return add_slot("NUM", str(NUMERIC_WORDS[word.lower()]) if word else match.group(0))
+
+    def name(match):
+        words = match.group(0)
+        if schema_tables.resolve_table(words) or words in schema_tables.column_tables:
+            return words
+        return add_slot("NAME", words)
+
+    text = QUOTED_PATTERN.sub(quoted, question)
+    text = DATE_PATTERN.sub(lambda m: add_slot("DATE", m.group(0)), text)
+    text = DATE_WORD_PATTERN.sub(lambda m: add_slot("DATE", m.group(0)), text)
+    text = NUMBER_PATTERN.sub(number, text)
+    text = NAME_PATTERN.sub(name, text.strip())
+    return QuestionTemplate(text, slots)
+
+
+template_cache = ResultCache(max_size=TEMPLATE_CACHE_SIZE, ttl=RESULT_CACHE_TTL_S, invalidation_log=InvalidationLog())
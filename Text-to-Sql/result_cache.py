@@ -0,0 +1,205 @@
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of cached question -> SQL results
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 1024))
+# Seconds a cached result stays valid
+RESULT_CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", 3600))
+# Invalidations remembered for processes that have not caught up yet; one further behind clears its whole cache
+INVALIDATION_LOG_SIZE = int(os.environ.get("INVALIDATION_LOG_SIZE", 256))
+
+QUOTED_LITERAL_PATTERN = re.compile(r"('[^']*'|\"[^\"]*\")")
+# Sentence punctuation, but not decimal points or separators inside numbers
+PUNCTUATION_PATTERN = re.compile(r"(?<!\d)[?!.,;:]|[?!.,;:](?!\d)")
+
+
+def normalize_question(question):
+    """Fold case, whitespace and sentence punctuation; quoted literals keep their case."""
+    parts = QUOTED_LITERAL_PATTERN.split(question)
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            normalized.append(part)
+        else:
+            normalized.append(PUNCTUATION_PATTERN.sub(" ", part.lower()))
+    return " ".join("".join(normalized).split())
+
+
+class InvalidationLog:
+    """Invalidations shared by the processes forked after it is created (prefork workers).
+
+    A shared memory map holds a sequence number and a ring of the last `size` invalidated schema
+    hashes (CLEAR_ALL for a full clear). Each cache remembers the sequence it has applied and
+    replays the newer entries on its next access, so DELETE /cache reaching one worker reaches all.
+    """
+
+    CLEAR_ALL = b"*"
+    _HEADER = struct.Struct("<Q")
+    _SLOT_BYTES = 64  # a hex SHA-256
+
+    def __init__(self, size=INVALIDATION_LOG_SIZE):
+        self.size = size
+        self._map = mmap.mmap(-1, self._HEADER.size + size * self._SLOT_BYTES)
+        self._lock = multiprocessing.Lock()
+
+    @property
+    def sequence(self):
+        return self._HEADER.unpack_from(self._map, 0)[0]
+
+    def append(self, schema_hash):
+        """Record an invalidation (None: every schema); returns its sequence number."""
+        value = self.CLEAR_ALL if schema_hash is None else schema_hash.encode("ascii")
+        if len(value) > self._SLOT_BYTES:
+            raise ValueError(f"Schema hash '{schema_hash}' is longer than {self._SLOT_BYTES} characters.")
+        with self._lock:
+            sequence = self.sequence + 1
+            offset = self._HEADER.size + (sequence - 1) % self.size * self._SLOT_BYTES
+            self._map[offset:offset + self._SLOT_BYTES] = value.ljust(self._SLOT_BYTES, b"\0")
+            self._HEADER.pack_into(self._map, 0, sequence)
+            return sequence
+
+    def since(self, applied):
+        """(current sequence, schema hashes invalidated after `applied`, None for a full clear).
+
+        The hashes are None as a whole when the ring no longer holds all of them.
+        """
+        if self.sequence == applied:
+            return applied, []
+        with self._lock:
+            sequence = self.sequence
+            if sequence - applied > self.size:
+                return sequence, None
+            entries = []
+            for n in range(applied, sequence):
+                offset = self._HEADER.size + n % self.size * self._SLOT_BYTES
+                value = self._map[offset:offset + self._SLOT_BYTES].rstrip(b"\0")
+                entries.append(None if value == self.CLEAR_ALL else value.decode("ascii"))
+            return sequence, entries
+
+
+class ResultCache:
+    """LRU + TTL cache of final post-processed SQL, keyed by normalized question and schema hash.
+
+    With an InvalidationLog, invalidate_schema() and clear() also apply to the copies of the cache
+    in other processes sharing the log; entries themselves are never shared.
+    """
+
+    def __init__(self, max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL_S, invalidation_log=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (sql, expires_at)
+        self._keys_by_schema = {}  # schema hash -> set of keys, for per-schema invalidation
+        self._lock = threading.Lock()
+        self._log = invalidation_log
+        self._applied = invalidation_log.sequence if invalidation_log is not None else 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(question, schema_hash, db_name="", options=()):
+        """options: any other request settings that change the generated SQL, as a hashable tuple."""
+        return (schema_hash, db_name or "", normalize_question(question), options)
+
+    def get(self, key):
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            sql, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sql
+
+    def put(self, key, sql):
+        with self._lock:
+            self._sync()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (sql, time.monotonic() + self.ttl)
+            self._keys_by_schema.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_schema(self, schema_hash):
+        """Drop every cached result for one schema; returns how many were removed from this process's cache."""
+        with self._lock:
+            if self._log is None:
+                return self._drop_schema(schema_hash)
+            self._log.append(schema_hash)
+            return self._sync()
+
+    def clear(self):
+        with self._lock:
+            if self._log is None:
+                return self._drop_all()
+            self._log.append(None)
+            return self._sync()
+
+    def _sync(self):
+        """Apply the invalidations logged since the last call, by any process; returns the entries removed."""
+        if self._log is None:
+            return 0
+        self._applied, invalidated = self._log.since(self._applied)
+        if invalidated is None:
+            return self._drop_all()
+        return sum(self._drop_all() if schema_hash is None else self._drop_schema(schema_hash)
+                   for schema_hash in invalidated)
+
+    def _drop_schema(self, schema_hash):
+        keys = self._keys_by_schema.pop(schema_hash, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def _drop_all(self):
+        removed = len(self._entries)
+        self._entries.clear()
+        self._keys_by_schema.clear()
+        self.invalidations += removed
+        return removed
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._keys_by_schema.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_schema[key[0]]
+
+    def stats(self):
+        with self._lock:
+            self._sync()
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache(invalidation_log=InvalidationLog())
@@ -0,0 +1,222 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# Maximum number of distinct parsed schemas kept in memory
+SCHEMA_CACHE_SIZE = int(os.environ.get("SCHEMA_CACHE_SIZE", 128))
+
+TABLE_DEFINITION_PATTERN = re.compile(r'(\w+)\s*\(\s*([^)]*)\s*\)')
+
+
+def schema_hash(schema):
+    """Return the content hash used to identify a schema string."""
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+def deep_size(value, seen=None):
+    """Approximate bytes held by value, counting objects already in seen only once.
+
+    Builtin containers are walked, tensors count their storage and objects with a size_bytes()
+    method report their own footprint; any other object counts its shallow size only, so shared
+    objects it references (a tokenizer, a schema family) are not charged to it.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    kind = type(value)
+    # Indexes fill lazily on other threads, so containers are copied (atomically) before walking them
+    if kind is dict:
+        return sys.getsizeof(value) + sum(deep_size(key, seen) + deep_size(item, seen)
+                                          for key, item in list(value.items()))
+    if kind in (list, tuple, set, frozenset):
+        return sys.getsizeof(value) + sum(deep_size(item, seen) for item in list(value))
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return sys.getsizeof(value) + value.element_size() * value.nelement()
+    size_bytes = getattr(value, "size_bytes", None)
+    if size_bytes is not None:
+        return sys.getsizeof(value) + size_bytes(seen)
+    return sys.getsizeof(value)
+
+
+class ParsedSchema(Mapping):
+    """Immutable table -> columns view of a schema string, with lookup indexes.
+
+    Behaves like the dict previously returned by parse_schema (table name to a
+    set of column names), so `table in schema_tables`, `schema_tables[table]`
+    and `.items()` keep working. On top of that it carries:
+      - tables_lower: lowercase table name -> table name as written in the schema
+      - column_tables: column name -> tuple of tables containing that column
+      - column_tables_lower: the same, keyed by lowercase column name and merging case variants
+      - ordered_columns(table): columns in declaration order
+      - derived(key, build): per-schema indexes (join graph, ...) built once on first use
+    """
+
+    __slots__ = ("schema_hash", "_tables", "_ordered_columns", "tables_lower", "column_tables",
+                 "column_tables_lower", "_table_columns_lower", "_derived")
+
+    def __init__(self, schema, digest=None):
+        table_definitions = TABLE_DEFINITION_PATTERN.findall(schema)
+
+        if not table_definitions:
+            raise ValueError("Schema parsing error: No valid tables found in schema.")
+
+        tables = {}
+        ordered_columns = {}
+        for table_name, columns in table_definitions:
+            table_name = table_name.strip()
+            column_list = tuple(dict.fromkeys(map(str.strip, columns.split(","))))
+            tables[table_name] = frozenset(column_list)
+            ordered_columns[table_name] = column_list
+
+        column_tables = {}
+        column_tables_lower = {}
+        for table_name, columns in ordered_columns.items():
+            for column in columns:
+                column_tables.setdefault(column, []).append(table_name)
+                owners = column_tables_lower.setdefault(column.lower(), [])
+                if not owners or owners[-1] != table_name:
+                    owners.append(table_name)
+
+        self.schema_hash = digest or schema_hash(schema)
+        self._tables = MappingProxyType(tables)
+        self._ordered_columns = MappingProxyType(ordered_columns)
+        self.tables_lower = MappingProxyType({name.lower(): name for name in tables})
+        self.column_tables = MappingProxyType({col: tuple(owners) for col, owners in column_tables.items()})
+        self.column_tables_lower = MappingProxyType({col: tuple(owners) for col, owners in column_tables_lower.items()})
+        # (table, lowercase column) pairs, so membership checks do not scan columns shared by many tables
+        self._table_columns_lower = frozenset(
+            (table_name, column.lower()) for table_name, columns in ordered_columns.items() for column in columns)
+        self._derived = {}
+
+    def __getitem__(self, table_name):
+        return self._tables[table_name]
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __repr__(self):
+        return f"ParsedSchema({len(self._tables)} tables, hash={self.schema_hash[:12]})"
+
+    def ordered_columns(self, table_name):
+        """Columns of a table in the order they appear in the schema string."""
+        return self._ordered_columns[table_name]
+
+    def resolve_table(self, table_name):
+        """Return the schema spelling of a table name, matched case-insensitively."""
+        return self.tables_lower.get(table_name.lower())
+
+    def tables_with_column(self, column, among=None):
+        """Return the tables that contain the given column, matched case-insensitively.
+
+        With `among` (table names as written in a query, any case), only those tables are
+        returned, in that order and spelling. Either way the cost is independent of the size
+        of the schema: one dict lookup, or one set check per table in `among`.
+        """
+        column = column.lower()
+        if among is None:
+            return self.column_tables_lower.get(column, ())
+        return tuple(table for table in among
+                     if (self.tables_lower.get(table.lower()), column) in self._table_columns_lower)
+
+    def has_column(self, table_name, column):
+        """True if the table (any case) has the column (any case)."""
+        return (self.tables_lower.get(table_name.lower()), column.lower()) in self._table_columns_lower
+
+    def derived(self, key, build):
+        """Return the index stored under key, calling build(self) the first time it is needed.
+
+        Derived indexes live as long as the parsed schema, so they are shared through the
+        schema cache and the registry; concurrent first calls may build twice, one result wins.
+        """
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived.setdefault(key, build(self))
+        return value
+
+    def derived_count(self):
+        """Number of derived indexes built so far."""
+        return len(self._derived)
+
+    def derived_size(self):
+        """Approximate bytes held by the derived indexes built so far (see deep_size)."""
+        seen = set()
+        return sum(deep_size(value, seen) for value in list(self._derived.values()))
+
+
+class SchemaCache:
+    """Bounded LRU cache of ParsedSchema objects keyed by schema content hash."""
+
+    def __init__(self, max_size=SCHEMA_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, schema):
+        digest = schema_hash(schema)
+        with self._lock:
+            parsed = self._entries.get(digest)
+            if parsed is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        # Parse outside the lock; a concurrent miss on the same schema just parses twice
+        parsed = ParsedSchema(schema, digest)
+
+        with self._lock:
+            self._entries[digest] = parsed
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return parsed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_lock(self):
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+schema_cache = SchemaCache()
+
+# Forked post-processing workers must not inherit a lock held by another thread of the parent
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=schema_cache.reset_lock)
+
+
+def parse_schema(schema):
+    """
+    Extracts table-column mappings from schema.
+    Returns a cached, immutable ParsedSchema; passing an already parsed schema is a no-op.
+    """
+    if isinstance(schema, ParsedSchema):
+        return schema
+    return schema_cache.get(schema)
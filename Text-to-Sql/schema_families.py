@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import threading
+
+from sql_rewrite import lex
+
+# Directory of schema family definitions, one JSON file per family (see families/01-retail.json),
+# loaded in file name order: when two families match a schema equally well, the earlier one wins
+SCHEMA_FAMILIES_DIR = os.environ.get("SCHEMA_FAMILIES_DIR",
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "families"))
+# Share of a schema's and a family's tables, taken together, that must be common to both for a near match
+SCHEMA_FAMILY_MIN_JACCARD = float(os.environ.get("SCHEMA_FAMILY_MIN_JACCARD", 0.6))
+
+
+def table_fingerprint(table_names):
+    """Hash of a set of table names, independent of their order.
+
+    Case is kept: a family's join conditions spell its tables one way, and a schema spelling them
+    differently (users / orders / products) is a different database.
+    """
+    return hashlib.sha256("\n".join(sorted(set(table_names))).encode("utf-8")).hexdigest()
+
+
+class SchemaFamily:
+    """A kind of database the post-processor knows: the tables that identify it, how they join and
+    the fixers that only apply to it.
+
+    indicator_tables: tables a schema of the family has. A schema matches when it has exactly these
+        tables (or one of table_sets), at least min_overlap of them, or a Jaccard similarity of its
+        table set to them of at least min_jaccard.
+    relationships: (table1, table2) -> join condition, in the order they are joined.
+    fixers: names of the fixer passes run for the family (sql_postprocess.FAMILY_FIXERS).
+    """
+
+    __slots__ = ("name", "indicator_tables", "min_overlap", "min_jaccard", "table_sets", "relationships",
+                 "conditions", "fixers", "_tables")
+
+    def __init__(self, name, indicator_tables, relationships=(), fixers=(), min_overlap=None,
+                 min_jaccard=SCHEMA_FAMILY_MIN_JACCARD, table_sets=()):
+        if not indicator_tables:
+            raise ValueError(f"Schema family '{name}' has no indicator tables.")
+        self.name = name
+        self.indicator_tables = tuple(indicator_tables)
+        self.min_overlap = min_overlap
+        self.min_jaccard = min_jaccard
+        self.table_sets = tuple(tuple(tables) for tables in table_sets)
+        self.relationships = {(table1, table2): condition for table1, table2, condition in relationships}
+        # Join conditions tokenized once; passes copy them before inserting into a query
+        self.conditions = {tables: lex(condition) for tables, condition in self.relationships.items()}
+        self.fixers = tuple(fixers)
+        self._tables = frozenset(self.indicator_tables)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["name"], config["indicator_tables"], config.get("relationships", ()),
+                   config.get("fixers", ()), config.get("min_overlap"),
+                   config.get("min_jaccard", SCHEMA_FAMILY_MIN_JACCARD), config.get("table_sets", ()))
+
+    def jaccard(self, overlap, schema_size):
+        """Jaccard similarity to a schema of schema_size tables sharing `overlap` of them with the family."""
+        return overlap / (schema_size + len(self._tables) - overlap)
+
+    def accepts(self, overlap, jaccard):
+        return (self.min_overlap is not None and overlap >= self.min_overlap) or jaccard >= self.min_jaccard
+
+
+class SchemaFamilyRegistry:
+    """Known schema families, matched to a schema by table fingerprint or table overlap.
+
+    An exact match is one dict lookup. Otherwise an inverted index from table name to families
+    counts the overlap with just the families that share a table with the schema, so matching
+    costs the same with hundreds of families as with two. Callers cache the result per schema
+    (sql_postprocess.detect_database_type).
+    """
+
+    def __init__(self, families=()):
+        self._families = {}  # name -> SchemaFamily, in registration order
+        self._order = {}  # name -> registration sequence number; the earlier family wins a tie
+        self._by_fingerprint = {}
+        self._by_table = {}  # table name -> names of the families it indicates
+        self._lock = threading.Lock()
+        self.generation = 0  # bumped on every change, so cached matches can be told apart
+        self.exact_matches = 0
+        self.near_matches = 0
+        self.unmatched = 0
+        for family in families:
+            self.register(family)
+
+    def register(self, family):
+        with self._lock:
+            if family.name in self._families:
+                self._unregister(family.name)
+            self._families[family.name] = family
+            self._order[family.name] = self.generation
+            for tables in (family.indicator_tables, *family.table_sets):
+                self._by_fingerprint.setdefault(table_fingerprint(tables), family.name)
+            for table in family._tables:
+                self._by_table.setdefault(table, []).append(family.name)
+            self.generation += 1
+
+    def unregister(self, name):
+        with self._lock:
+            self._unregister(name)
+            self.generation += 1
+
+    def _unregister(self, name):
+        family = self._families.pop(name)
+        del self._order[name]
+        self._by_fingerprint = {fingerprint: owner for fingerprint, owner in self._by_fingerprint.items()
+                                if owner != name}
+        for table in family._tables:
+            self._by_table[table].remove(name)
+            if not self._by_table[table]:
+                del self._by_table[table]
+
+    def get(self, name):
+        """The family registered under a name (e.g. a request's db_name), or None."""
+        return self._families.get(name) if name else None
+
+    def __contains__(self, name):
+        return name in self._families
+
+    def __iter__(self):
+        return iter(list(self._families.values()))
+
+    def __len__(self):
+        return len(self._families)
+
+    def match(self, table_names):
+        """The family a schema with these tables belongs to, or None.
+
+        An exact table-set fingerprint wins; otherwise the accepted family with the highest Jaccard
+        similarity (then overlap, then registration order).
+        """
+        tables = set(table_names)
+        with self._lock:
+            name = self._by_fingerprint.get(table_fingerprint(tables))
+            if name is not None:
+                self.exact_matches += 1
+                return self._families[name]
+
+            overlaps = {}
+            for table in tables:
+                for name in self._by_table.get(table, ()):
+                    overlaps[name] = overlaps.get(name, 0) + 1
+            best, best_key = None, None
+            for name, overlap in overlaps.items():
+                family = self._families[name]
+                jaccard = family.jaccard(overlap, len(tables))
+                if family.accepts(overlap, jaccard):
+                    key = (jaccard, overlap, -self._order[name])
+                    if best_key is None or key > best_key:
+                        best, best_key = family, key
+            if best is None:
+                self.unmatched += 1
+            else:
+                self.near_matches += 1
+            return best
+
+    def reset_lock(self):
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "families": len(self._families),
+                "exact_matches": self.exact_matches,
+                "near_matches": self.near_matches,
+                "unmatched": self.unmatched,
+            }
+
+
+def load_families(directory=SCHEMA_FAMILIES_DIR):
+    """SchemaFamily of every *.json file in a directory, in file name order."""
+    families = []
+    if not os.path.isdir(directory):
+        return families
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".json"):
+            path = os.path.join(directory, file_name)
+            with open(path) as f:
+                try:
+                    families.append(SchemaFamily.from_config(json.load(f)))
+                except (KeyError, TypeError, ValueError) as e:
+                    raise ValueError(f"Invalid schema family definition {path}: {e}") from e
+    return families
+
+
+schema_families = SchemaFamilyRegistry(load_families())
+
+# Forked post-processing workers match schemas too: they must not inherit a lock held by another thread of the parent
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=schema_families.reset_lock)
@@ -0,0 +1,168 @@
+import math
+import os
+import re
+
+from fk_index import foreign_key_index, singular
+from prompt_segments import tables_schema
+from schema_cache import deep_size
+
+# Tables kept in the prompt by default (before adding foreign-key neighbours); 0 sends the whole schema.
+# Off by default: pruning saves prompt tokens on large schemas, but a needed table it leaves out makes the
+# query wrong, and accuracy against the full schema has not been measured on a schema of more than 8 tables
+SCHEMA_PRUNE_TOP_K = int(os.environ.get("SCHEMA_PRUNE_TOP_K", 0))
+# Upper bound on foreign-key neighbours added on top of the top-k tables
+SCHEMA_PRUNE_MAX_NEIGHBOURS = int(os.environ.get("SCHEMA_PRUNE_MAX_NEIGHBOURS", 8))
+
+# Identifiers of a question or schema, and their words: camelCase and snake_case split, digits dropped
+# (table37 is matched as a whole, so a "5" in the question doesn't pull in table5)
+IDENTIFIER_PATTERN = re.compile(r"\w+")
+WORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+")
+
+# How much a match on a table's own name counts compared to a match on one of its columns
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.0
+
+# Words a question may use for schema terms; every word of a group matches the others
+SYNONYM_GROUPS = [
+    {"customer", "client", "buyer", "user", "shopper"},
+    {"product", "item", "good", "article", "sku"},
+    {"order", "purchase", "sale"},
+    {"payment", "transaction", "invoice", "bill", "billing", "charge"},
+    {"price", "cost", "amount", "total", "fee"},
+    {"employee", "staff", "worker", "personnel"},
+    {"doctor", "physician"},
+    {"patient"},
+    {"appointment", "visit", "booking"},
+    {"date", "day", "time", "when", "created", "timestamp"},
+    {"city", "town", "location", "address"},
+    {"name", "title", "called"},
+    {"category", "type", "kind", "genre"},
+    {"quantity", "count", "number", "qty"},
+    {"status", "state"},
+    {"email", "mail"},
+    {"phone", "telephone", "mobile"},
+    {"supplier", "vendor", "provider"},
+    {"department", "dept", "division"},
+    {"stock", "inventory"},
+]
+SYNONYMS = {word: group for group in SYNONYM_GROUPS for word in group}
+
+# Question words that never point at a table
+STOP_WORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "with", "and", "or", "all", "any", "each", "every",
+    "show", "list", "get", "find", "give", "display", "what", "which", "who", "how", "many", "much", "me",
+    "is", "are", "was", "were", "be", "that", "this", "from", "where", "their", "them", "there", "have", "has",
+    "id", "than", "more", "less", "most", "least", "top", "per",
+}
+
+
+def stem(word):
+    """Lowercase singular form, so 'Orders', 'order' and 'orders' meet in the index."""
+    return singular(word.lower())
+
+
+def name_terms(name):
+    """The stemmed name and its words (order_date -> order_date, order, date; CustomerID -> customerid, customer)."""
+    terms = {stem(word) for word in WORD_PATTERN.findall(name) if word.lower() not in STOP_WORDS}
+    terms.add(stem(name))
+    return terms
+
+
+def question_terms(question):
+    """Stemmed question words, each with the synonyms it stands for."""
+    terms = {stem(identifier) for identifier in IDENTIFIER_PATTERN.findall(question)}
+    for word in WORD_PATTERN.findall(question):
+        word = stem(word)
+        terms.add(word)
+        terms.update(SYNONYMS.get(word, ()))
+    return terms - STOP_WORDS
+
+
+class LexicalIndex:
+    """Inverted index from name terms to the tables they occur in, weighted by rarity (idf).
+
+    Terms found in more than half of the tables (name, status, created_at in most schemas) say
+    nothing about which table a question is about and are left out.
+    """
+
+    def __init__(self, schema_tables):
+        self.tables = list(schema_tables)
+        postings = {}  # term -> {table: weight before idf}
+        for table in self.tables:
+            for term in name_terms(table):
+                weights = postings.setdefault(term, {})
+                weights[table] = weights.get(table, 0.0) + TABLE_NAME_WEIGHT
+            for column in schema_tables.ordered_columns(table):
+                for term in name_terms(column):
+                    weights = postings.setdefault(term, {})
+                    weights[table] = weights.get(table, 0.0) + COLUMN_NAME_WEIGHT
+
+        num_tables = len(self.tables)
+        self.postings = {
+            term: {table: weight * math.log(1.0 + num_tables / len(weights)) for table, weight in weights.items()}
+            for term, weights in postings.items()
+            if len(weights) * 2 <= num_tables
+        }
+
+    def size_bytes(self, seen):
+        return deep_size(vars(self), seen)
+
+    def score(self, question):
+        """Relevance of each matching table to the question."""
+        scores = {}
+        for term in question_terms(question):
+            for table, weight in self.postings.get(term, {}).items():
+                scores[table] = scores.get(table, 0.0) + weight
+        return scores
+
+
+def lexical_index(schema_tables):
+    """The LexicalIndex of a parsed schema, built once per schema hash."""
+    return schema_tables.derived("lexical_index", LexicalIndex)
+
+
+def relevant_tables(question, schema_tables, top_k=SCHEMA_PRUNE_TOP_K, max_neighbours=SCHEMA_PRUNE_MAX_NEIGHBOURS):
+    """The top_k tables matching the question plus their foreign-key neighbours, in schema order.
+
+    Returns every table when top_k is 0 or the schema is not larger than top_k.
+    """
+    tables = list(schema_tables)
+    if top_k <= 0 or len(tables) <= top_k:
+        return tables
+
+    index = lexical_index(schema_tables)
+    scores = index.score(question)
+    position = {table: i for i, table in enumerate(index.tables)}
+    ranked = sorted(scores, key=lambda table: (-scores[table], position[table]))
+    kept = set(ranked[:top_k])
+    if not kept:
+        # Nothing matched: fall back to the start of the schema rather than an empty prompt
+        kept = set(tables[:top_k])
+
+    # Tables joining the kept ones, so the model can write the joins; best-scoring first
+    foreign_keys = foreign_key_index(schema_tables)
+    neighbours = set()
+    for table in kept:
+        for foreign_key in foreign_keys.references(table):
+            neighbours.add(foreign_key.ref_table)
+        for foreign_key in foreign_keys.referenced_by(table):
+            neighbours.add(foreign_key.table)
+    neighbours -= kept
+    kept.update(sorted(neighbours, key=lambda table: (-scores.get(table, 0.0), position[table]))[:max_neighbours])
+
+    return [table for table in tables if table in kept]
+
+
+def pruned_tables(question, schema_tables, top_k=SCHEMA_PRUNE_TOP_K):
+    """The tables to show the model for a question, or None when that is every table."""
+    tables = relevant_tables(question, schema_tables, top_k)
+    return None if len(tables) == len(schema_tables) else tables
+
+
+def pruned_schema(question, schema_tables, top_k=SCHEMA_PRUNE_TOP_K):
+    """Schema text with only the tables relevant to the question, in the format the prompt uses.
+
+    Returns None when every table is kept, so callers can use the schema text they already have.
+    """
+    tables = pruned_tables(question, schema_tables, top_k)
+    return None if tables is None else tables_schema(schema_tables, tables)
@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from schema_cache import parse_schema, schema_hash
+
+# Memory budget for registered schemas: schema text, parsed tables, prompt token ids and the indexes
+# derived from them (join graph, foreign keys, decoding trie, ...), re-measured when a new index is built
+SCHEMA_REGISTRY_MAX_BYTES = int(os.environ.get("SCHEMA_REGISTRY_MAX_BYTES", 64 * 1024 * 1024))
+
+
+class RegisteredSchema:
+    """A schema uploaded once through POST /schemas and referenced by its schema_id afterwards."""
+
+    __slots__ = ("schema_id", "schema", "parsed", "prompt_ids", "base_bytes", "nbytes", "derived_count")
+
+    def __init__(self, schema, parsed, prompt_ids):
+        self.schema_id = parsed.schema_hash
+        self.schema = schema
+        self.parsed = parsed
+        self.prompt_ids = tuple(prompt_ids) if prompt_ids is not None else None
+        self.base_bytes = estimate_size(schema, parsed, self.prompt_ids)
+        self.nbytes = self.base_bytes
+        self.derived_count = 0
+        self.measure()
+
+    def measure(self):
+        """Recount the derived indexes if new ones were built; return the change in nbytes.
+
+        Indexes filled lazily after they are built (join path trees, decoding masks) are counted
+        as of the last time a new index was added.
+        """
+        derived_count = self.parsed.derived_count()
+        if derived_count == self.derived_count:
+            return 0
+        nbytes = self.base_bytes + self.parsed.derived_size()
+        change = nbytes - self.nbytes
+        self.nbytes = nbytes
+        self.derived_count = derived_count
+        return change
+
+
+def estimate_size(schema, parsed, prompt_ids):
+    """Rough memory footprint of a registry entry in bytes."""
+    size = sys.getsizeof(schema)
+    for table_name, columns in parsed.items():
+        size += sys.getsizeof(table_name) + sys.getsizeof(columns) + sys.getsizeof(parsed.ordered_columns(table_name))
+        size += sum(sys.getsizeof(column) for column in columns)
+    # The lowercase lookup and the column indexes roughly mirror the table map twice over
+    size *= 3
+    if prompt_ids is not None:
+        size += sys.getsizeof(prompt_ids) + 8 * len(prompt_ids)
+    return size
+
+
+class SchemaRegistry:
+    """LRU store of registered schemas bounded by an approximate memory budget."""
+
+    def __init__(self, max_bytes=SCHEMA_REGISTRY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def register(self, schema, encode_segment=None):
+        """Store a schema and return its entry; re-registering the same content is a cheap lookup.
+
+        encode_segment, when given, turns the schema text into the token ids of its prompt segment.
+        """
+        digest = schema_hash(schema)
+        existing = self.get(digest)
+        if existing is not None:
+            return existing
+
+        parsed = parse_schema(schema)
+        prompt_ids = encode_segment(schema) if encode_segment else None
+        entry = RegisteredSchema(schema, parsed, prompt_ids)
+
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return self._entries[digest]
+            self._entries[digest] = entry
+            self.total_bytes += entry.nbytes
+            self._evict()
+        return entry
+
+    def get(self, schema_id):
+        """Return the registered entry for a schema_id, or None if unknown or evicted.
+
+        Indexes are derived while requests use an entry, so its size is re-measured here: the
+        growth from one request is charged, and evicted for, when the schema is next referenced.
+        """
+        with self._lock:
+            entry = self._entries.get(schema_id)
+            if entry is not None:
+                self._entries.move_to_end(schema_id)
+                change = entry.measure()
+                if change:
+                    self.total_bytes += change
+                    self._evict()
+            return entry
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def remove(self, schema_id):
+        with self._lock:
+            entry = self._entries.pop(schema_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
+            return entry is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "schemas": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+schema_registry = SchemaRegistry()
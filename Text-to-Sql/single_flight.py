@@ -0,0 +1,65 @@
+import os
+import threading
+from concurrent.futures import Future
+
+# Identical /nl-to-sql requests in flight at the same time share one generation
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1").lower() in ("1", "true", "yes")
+
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving while it runs wait for its result instead.
+
+    Only in-flight calls are shared: once the leader returns, the key is free again and later
+    callers rely on the result cache.
+    """
+
+    def __init__(self, enabled=SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls = {}  # key -> Future of the leader's result
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return fn(), or the result of the call already running under the same key.
+
+        The leader's exception is raised in every caller that waited on it.
+        """
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            requests = self.leaders + self.coalesced
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesce_rate": round(self.coalesced / requests, 4) if requests else 0.0,
+            }
+
+
+single_flight = SingleFlight()
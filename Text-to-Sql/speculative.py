@@ -0,0 +1,32 @@
+import os
+
+# Draft-and-verify greedy decoding: "off", "draft" (a small seq2seq model sharing the tokenizer proposes
+# tokens) or "prompt_lookup" (n-grams copied from the prompt, i.e. table and column names, are proposed).
+# Either way the target model checks every proposed token, so the output equals plain greedy decoding.
+SPECULATIVE_DECODING = os.environ.get("SPECULATIVE_DECODING", "off").lower()
+# Checkpoint of the draft model, e.g. a T5-small distilled on the same data
+DRAFT_MODEL_PATH = os.environ.get("DRAFT_MODEL_PATH", "./draft_model")
+# Tokens proposed per prompt-lookup step
+PROMPT_LOOKUP_NUM_TOKENS = int(os.environ.get("PROMPT_LOOKUP_NUM_TOKENS", 10))
+
+SPECULATIVE_MODES = ("off", "draft", "prompt_lookup")
+
+
+def speculative_kwargs(mode=SPECULATIVE_DECODING, draft_model_path=DRAFT_MODEL_PATH):
+    """Extra model.generate kwargs for draft-and-verify decoding, or None when it is off.
+
+    They only apply to greedy decoding of one sequence at a time (transformers' assisted generation).
+    """
+    if mode == "off":
+        return None
+    if mode == "prompt_lookup":
+        return {"prompt_lookup_num_tokens": PROMPT_LOOKUP_NUM_TOKENS}
+    if mode == "draft":
+        from transformers import AutoModelForSeq2SeqLM
+        return {"assistant_model": AutoModelForSeq2SeqLM.from_pretrained(draft_model_path)}
+    raise ValueError(f"Unknown SPECULATIVE_DECODING '{mode}'; expected one of {', '.join(SPECULATIVE_MODES)}.")
+
+
+def is_speculative(generate_kwargs):
+    """Whether draft-and-verify decoding can serve these generate kwargs (greedy, one sequence)."""
+    return generate_kwargs.get("num_beams", 1) == 1 and generate_kwargs.get("num_return_sequences", 1) == 1
@@ -0,0 +1,1066 @@
+import os
+import re
+from sqlparse import tokens as T
+from schema_cache import parse_schema
+from sql_rewrite import (
+    DOT, EQUALS, WHITESPACE, WHITESPACE_TYPES, Join, SqlQuery, column_ref, equality, is_keyword, is_whitespace,
+    is_word, is_type, join_conditions, join_items, name, significant, split_conditions, split_items,
+    tokens_source, tokens_text,
+)
+from fk_index import foreign_key_index
+from join_graph import JOIN_GRAPH_PRECOMPUTE_MAX_TABLES, JoinGraph
+from schema_families import schema_families
+from tracing import run_fixer, stage
+
+# The fixers below are passes over one SqlQuery: fix_sql_query tokenizes the model
+# output once, every pass edits the clause token lists in place, and the query is
+# serialized a single time at the end.
+
+
+# Repair joins on columns that do not exist, and reach selected columns of other tables, along foreign keys
+# inferred from column names. Off by default: a guessed join can return the wrong rows where the validation
+# error would have told the caller the query is wrong
+INFER_FOREIGN_KEY_JOINS = os.environ.get("INFER_FOREIGN_KEY_JOINS", "0").lower() in ("1", "true", "yes")
+
+# Invalid direct joins between hospital tables, rerouted through Appointments:
+# (left table, left column, right table, right column) -> (column joining the left table
+# to Appointments, column joining Appointments to the originally joined table)
+APPOINTMENT_JOIN_PATHS = {
+    ("Patients", "patient_id", "Billing", "patient_id"): ("patient_id", "appointment_id"),
+    ("Doctors", "doctor_id", "Billing", "doctor_id"): ("doctor_id", "appointment_id"),
+    ("Treatments", "treatment_id", "Patients", "treatment_id"): ("appointment_id", "patient_id"),
+    ("Treatments", "treatment_id", "Doctors", "treatment_id"): ("appointment_id", "doctor_id"),
+    ("Doctors", "doctor_id", "Treatments", "doctor_id"): ("doctor_id", "appointment_id"),
+}
+
+# Columns a model tends to select straight from Orders, and the joins that actually reach them
+ORDERS_CROSS_TABLE_COLUMNS = [
+    ({"city"}, "Customers", [("Customers", ("Orders", "customer_id", "Customers", "customer_id"))]),
+    ({"first_name", "last_name", "email", "phone"}, "Customers",
+     [("Customers", ("Orders", "customer_id", "Customers", "customer_id"))]),
+    ({"name", "category", "price"}, "Products",
+     [("OrderItems", ("Orders", "order_id", "OrderItems", "order_id")),
+      ("Products", ("OrderItems", "product_id", "Products", "product_id"))]),
+]
+
+# Expected spelling of common filter values, per column
+VALUE_CASING = {
+    "gender": {"'female'": "'Female'", "'male'": "'Male'"},
+    "payment_status": {"'paid'": "'Paid'", "'pending'": "'Pending'", "'unpaid'": "'Unpaid'"},
+}
+
+COMPARISON_OPERATORS = {"=", "<>", "!=", ">", "<", ">=", "<="}
+TABLE_ALIAS_PATTERN = re.compile(r"T\d+", re.IGNORECASE)
+TABLE_ALIAS_PREFIX_PATTERN = re.compile(r"T\d+")
+TIME_LITERAL_PATTERN = re.compile(r'"\d{1,2}:\d{1,2}"')
+DATE_LITERAL_PATTERN = re.compile(r"'\d{4}-\d{2}-\d{2}'")
+DISTINCT_PATTERN = re.compile(r'\bDISTINCT\s+', re.IGNORECASE)
+# Text a token list must contain for the token-by-token passes below to change anything in it
+ALIAS_PREFIX_TEXT_PATTERN = re.compile(r"T\d+\.")
+LIKE_TEXT_PATTERN = re.compile(r"like", re.IGNORECASE)
+VALUE_CASING_TEXT_PATTERN = re.compile("|".join(VALUE_CASING), re.IGNORECASE)
+
+
+def _previous(tokens, i):
+    """Index of the closest non-whitespace token before position i, or None."""
+    i -= 1
+    while i >= 0 and is_whitespace(tokens[i]):
+        i -= 1
+    return i if i >= 0 else None
+
+
+def _is_comparison(token, operators=COMPARISON_OPERATORS):
+    return is_type(token[0], T.Operator.Comparison) and (token[1] in operators or token[1].upper() == "LIKE")
+
+
+def _qualified_equality(tokens):
+    """Match a condition starting `table.column = table.column`; returns the four names or None."""
+    sig = [tokens[i] for i in significant(tokens, 7)]
+    if (len(sig) == 7 and sig[1] == DOT and sig[3][1] == "=" and sig[5] == DOT
+            and is_word(sig[0]) and is_word(sig[2]) and is_word(sig[4]) and is_word(sig[6])):
+        return sig[0][1], sig[2][1], sig[4][1], sig[6][1]
+    return None
+
+
+def _unqualified_equality(tokens):
+    """Match a condition starting `column = column`; returns (left, right, index after right) or None."""
+    indexes = significant(tokens, 4)
+    sig = [tokens[i] for i in indexes]
+    if (len(sig) >= 3 and is_word(sig[0]) and sig[1][1] == "=" and is_word(sig[2])
+            and (len(sig) == 3 or sig[3] != DOT)):
+        return sig[0][1], sig[2][1], indexes[2] + 1
+    return None
+
+
+def _single_table_target(join):
+    """The joined table when the join target is a bare table name (no alias), else None."""
+    target = [token for token in join.target if token[0] not in WHITESPACE_TYPES]
+    return target[0][1] if len(target) == 1 and is_word(target[0]) else None
+
+
+def fix_group_by_qualifiers(query, schema_tables):
+    """Fix GROUP BY clauses to use fully qualified column names when there are JOINs."""
+
+    # Only fix if there are JOINs in the query
+    if not query.has_join() or not query.group_by:
+        return
+
+    # Get tables used in the query
+    tables_used = query.referenced_tables()
+
+    fixed_columns = []
+    for item in split_items(query.group_by):
+        column = tokens_text(item)
+        # Skip if already qualified
+        if '.' in column:
+            fixed_columns.append(item)
+            continue
+
+        # Find which tables contain this column
+        containing_tables = schema_tables.tables_with_column(column, among=tables_used)
+
+        # Qualify it with the first table that contains it, even when it is unambiguous, for consistency
+        if containing_tables:
+            fixed_columns.append(column_ref(containing_tables[0], column))
+        else:
+            # Column not found, keep as is
+            fixed_columns.append(item)
+
+    query.group_by = join_items(fixed_columns)
+
+def fix_sql_query(query, question, schema_tables, db_name=""):
+    # Accepts a ParsedSchema (or a raw schema string, which is parsed through the cache)
+    schema_tables = parse_schema(schema_tables)
+    # Tokenize once; every fix below edits this clause structure in place
+    with stage("postprocess.parse"):
+        query = SqlQuery.parse(query.strip())
+
+    # Remove model-generated table aliases
+    run_fixer("fix.remove_table_aliases", remove_table_aliases, query)
+
+    # Fix date/time patterns
+    run_fixer("fix.date_time_patterns", fix_date_time_patterns, query)
+
+    run_fixer("fix.missing_from_table", fix_missing_from_table, query, schema_tables)
+    run_fixer("fix.missing_join_table", fix_missing_join_table, query, schema_tables)
+
+    # Apply existing post-processing
+    run_fixer("fix.invalid_having_clause", fix_invalid_having_clause, query, schema_tables)
+    run_fixer("fix.remove_unwanted_conditions", remove_unwanted_conditions, query, question)
+    run_fixer("fix.list_all_queries", fix_list_all_queries, query, question, schema_tables)
+    run_fixer("fix.apply_limit", apply_limit_if_requested, query, question)
+
+    # Add new post-processing functions
+    run_fixer("fix.auto_join_all_tables", auto_join_all_tables, query, question, schema_tables)
+
+    # Apply the known database family's own fixers (relationship-based joins, ...)
+    family = schema_families.get(db_name) if db_name else schema_family(schema_tables)
+    for fixer in family.fixers if family else ():
+        run_fixer(f"fix.{fixer}", FAMILY_FIXERS[fixer], query, schema_tables, family.name)
+
+    # Fix table name case sensitivity
+    run_fixer("fix.table_name_case", fix_table_name_case, query, schema_tables)
+
+    # Fix common value casing issues (gender, etc.)
+    run_fixer("fix.value_casing", fix_value_casing, query)
+
+    # Fix quote normalization (double quotes to single quotes)
+    run_fixer("fix.normalize_quotes", normalize_quotes, query)
+
+    # Fix GROUP BY clauses to use fully qualified column names
+    run_fixer("fix.group_by_qualifiers", fix_group_by_qualifiers, query, schema_tables)
+
+    # Fix ambiguous columns LAST to ensure no other function interferes
+    run_fixer("fix.ambiguous_columns", fix_ambiguous_columns, query, schema_tables)
+
+    # Try to auto-correct column issues before validation
+    run_fixer("fix.auto_correct_column_issues", auto_correct_column_issues, query, schema_tables, question)
+
+    with stage("postprocess.validate"):
+        # Validate column existence in SELECT and JOIN clauses
+        error = validate_column_existence(query, schema_tables)
+        # Validate JOIN conditions
+        if not error:
+            error = validate_join_conditions(query, schema_tables)
+        # Validate structure
+        if not error:
+            error = validate_sql_structure(query, schema_tables)
+    if error:
+        return f"Error: {error} → Query: {query.to_sql()}"
+
+    query = run_fixer("fix.negative_conditions", handle_negative_conditions, query, question, schema_tables)
+
+    with stage("postprocess.serialize"):
+        return query.to_sql()
+
+def remove_table_aliases(query):
+    """Drop "AS T1" aliases after FROM / JOIN tables and the "T1." prefixes that refer to them."""
+    targets = [query.from_] if query.from_ else []
+    targets += [join.target for join in query.joins]
+    for tokens in targets:
+        indexes = significant(tokens)
+        if (len(indexes) >= 3 and is_word(tokens[indexes[0]]) and is_keyword(tokens[indexes[1]], "AS")
+                and TABLE_ALIAS_PATTERN.fullmatch(tokens[indexes[2]][1])):
+            del tokens[indexes[0] + 1:indexes[2] + 1]
+
+    for tokens in query.token_lists():
+        if not ALIAS_PREFIX_TEXT_PATTERN.search(tokens_source(tokens)):
+            continue
+        i = 0
+        while i < len(tokens) - 1:
+            if (is_type(tokens[i][0], T.Name) and TABLE_ALIAS_PREFIX_PATTERN.fullmatch(tokens[i][1])
+                    and tokens[i + 1] == DOT):
+                del tokens[i:i + 2]
+            else:
+                i += 1
+
+def fix_date_time_patterns(query):
+    """Turn LIKE on time literals into a full-day range and LIKE on dates into equality."""
+    for tokens in query.token_lists():
+        if not LIKE_TEXT_PATTERN.search(tokens_source(tokens)):
+            continue
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            # Only `column LIKE literal` with whitespace on both sides of LIKE
+            if (is_type(token[0], T.Operator.Comparison) and token[1].upper() == "LIKE"
+                    and 0 < i < len(tokens) - 2 and is_whitespace(tokens[i - 1]) and is_whitespace(tokens[i + 1])):
+                column = _previous(tokens, i)
+                literal = significant(tokens[i + 1:], 1)
+                if column is not None and re.search(r'\w$', tokens[column][1]) and literal:
+                    j = i + 1 + literal[0]
+                    if is_type(tokens[j][0], T.String.Symbol) and TIME_LITERAL_PATTERN.fullmatch(tokens[j][1]):
+                        tokens[i:j + 1] = [
+                            (T.Keyword, "BETWEEN"), WHITESPACE, (T.String.Single, "'00:00'"),
+                            WHITESPACE, (T.Keyword, "AND"), WHITESPACE, (T.String.Single, "'23:59'"),
+                        ]
+                    elif is_type(tokens[j][0], T.String.Single) and DATE_LITERAL_PATTERN.fullmatch(tokens[j][1]):
+                        tokens[i] = EQUALS
+            i += 1
+
+def remove_unwanted_conditions(query, question):
+    # Only remove WHERE conditions if the question is very generic and doesn't contain filtering keywords
+    # Look for filtering keywords that indicate WHERE conditions should be kept
+    filtering_keywords = [
+        "created", "date", "time", "active", "status", "amount", "price", "stock",
+        "paid", "pending", "unpaid", "completed", "cancelled", "approved", "rejected",
+        "marked as", "equal to", "greater than", "less than", "contains", "like",
+        "where", "with", "having", "that are", "which are", "is", "are",
+        "female", "male", "gender", "age", "older", "younger", "specialty", "city",
+        "diagnosis", "medication", "treatment", "doctor", "patient", "appointment"
+    ]
+
+    # Check for filtering patterns that indicate WHERE conditions should be kept
+    filtering_patterns = [
+        r"\bfrom\s+\w+",  # "from Karachi", "from London"
+        r"\bin\s+\w+",    # "in Karachi", "in London"
+        r"\bof\s+\w+",    # "of type X", "of category Y"
+        r"\bwith\s+\w+",  # "with status X"
+        r"\bthat\s+\w+",  # "that are X"
+        r"\bwhich\s+\w+", # "which have X"
+        r"=\s*['\"]?\w+['\"]?",  # "= 'value'" or "= value"
+        r"\b\w+\s+(is|are)\s+\w+",  # "status is active"
+    ]
+
+    # If question contains any filtering keywords, keep WHERE conditions
+    if re.search(r"(" + "|".join(filtering_keywords) + ")", question, re.IGNORECASE):
+        return
+
+    # If question contains filtering patterns, keep WHERE conditions
+    for pattern in filtering_patterns:
+        if re.search(pattern, question, re.IGNORECASE):
+            return
+
+    # Only remove WHERE conditions for very generic queries
+    if not re.search(r"(created|date|time|active|status|amount|price|stock)", question, re.IGNORECASE):
+        query.where = None
+        query.having = None
+
+
+def fix_list_all_queries(query, question, schema_tables):
+    """Fix queries where user asks to 'list all' but model only selects specific columns."""
+
+    # Check if question asks to "list all", "show all", "find all" something
+    if not re.search(r"(list all|show all|get all|fetch all|retrieve all|find all|all .+? that|all .+? which|all .+? from)", question, re.IGNORECASE):
+        return
+
+    # Check if query has a WHERE clause (indicating filtering)
+    if query.where is None:
+        return
+
+    # Check if SELECT clause is not already SELECT *
+    if not query.select or query.from_ is None:
+        return
+    selected_columns = tokens_text(query.select)
+    if selected_columns == '*':
+        return
+
+    # If only selecting one column, check if we should change to SELECT *
+    if ',' not in selected_columns:
+        column = selected_columns
+        # Remove table prefix if present
+        if '.' in column:
+            column = column.split('.')[-1]
+
+        # For "find all", "list all" queries, usually want all information, not just ID
+        should_select_all = False
+
+        # Check if it's a status/condition column that's being filtered in WHERE
+        status_columns = ['status', 'payment_status', 'order_status', 'active', 'is_active', 'state']
+        if any(status_col in column.lower() for status_col in status_columns):
+            should_select_all = True
+
+        # Check if selecting only ID column for "find all" type queries
+        elif column.lower().endswith('_id') or column.lower() == 'id':
+            # For "find all X" queries, user usually wants all X information, not just ID
+            should_select_all = True
+
+        if should_select_all:
+            # Also fix common column name mistakes in the filter (WHERE and everything after it)
+            where_text = " ".join(tokens_text(tokens) for tokens in (
+                query.where, query.group_by, query.having, query.order_by, query.limit, query.tail) if tokens)
+            # Fix payment_method -> payment_status
+            if 'payment_method' in where_text and 'payment_status' not in where_text:
+                for tokens in query.token_lists():
+                    tokens[:] = [(ttype, value.replace('payment_method', 'payment_status')) for ttype, value in tokens]
+
+            # Change SELECT column to SELECT *
+            query.select = [(T.Wildcard, '*')]
+
+
+def fix_invalid_having_clause(query, schema_tables):
+    """Move HAVING conditions on columns that are not grouped (e.g. `total_amount > 100`) into WHERE."""
+    if not query.group_by or not query.having:
+        return
+
+    group_by_cols = {tokens_text(item) for item in split_items(query.group_by)}
+
+    kept, moved = [], []
+    for condition in split_conditions(query.having):
+        sig = [condition[i] for i in significant(condition)]
+        # `col op value` or `table.col op value`, where col is not a GROUP BY column
+        if len(sig) >= 3 and sig[1] == DOT:
+            sig = sig[2:]
+        has_or = any(is_keyword(token, "OR") for token in sig)
+        if (len(sig) >= 3 and is_word(sig[0]) and _is_comparison(sig[1]) and not has_or
+                and sig[0][1] not in group_by_cols):
+            moved.append(condition)
+        else:
+            kept.append(condition)
+
+    if not moved:
+        return
+    if query.where is not None:
+        query.where = join_conditions([query.where] + moved)
+    else:
+        query.where = join_conditions(moved)
+    query.having = join_conditions(kept) if kept else None
+
+
+def fix_missing_from_table(query, schema_tables):
+    """Fill an empty FROM that is followed by WHERE or ends the query with the first schema table."""
+    if query.from_ is None or significant(query.from_, 1) or query.joins:
+        return
+
+    nothing_after_from = not any((query.group_by, query.having, query.order_by, query.limit, query.tail,
+                                  query.terminated))
+    if query.where is not None or nothing_after_from:
+        first_valid_table = next(iter(schema_tables), "orders")
+        query.from_ = [name(first_valid_table)]
+
+
+def fix_missing_join_table(query, schema_tables):
+    """Fill an empty FROM that is directly followed by a JOIN with the first schema table."""
+    if query.from_ is None or significant(query.from_, 1) or not query.joins:
+        return
+
+    first_valid_table = next(iter(schema_tables), "users")
+    query.from_ = [name(first_valid_table)]
+
+def fix_ambiguous_join_conditions(query, tables_used, schema_tables):
+    """Fix ambiguous JOIN conditions by adding table prefixes."""
+    # The main table (FROM table)
+    main_table = query.from_table
+
+    # Find JOIN conditions with ambiguous column references
+    for join in query.joins:
+        join_table = _single_table_target(join)
+        match = _unqualified_equality(join.condition) if join_table and join.condition else None
+        if not match:
+            continue
+        left_col, right_col, rest = match
+
+        # Check if columns are ambiguous (exist in multiple tables)
+        left_tables = schema_tables.tables_with_column(left_col, among=tables_used)
+        right_tables = schema_tables.tables_with_column(right_col, among=tables_used)
+
+        # If columns are ambiguous OR if both column names are the same, add table prefixes
+        if len(left_tables) > 1 or len(right_tables) > 1 or left_col == right_col:
+            # For same column names (like patient_id = patient_id), use main table and join table
+            if left_col == right_col:
+                left_prefix = main_table if main_table else (left_tables[0] if left_tables else 'table1')
+                right_prefix = join_table
+            else:
+                # Determine correct table prefixes for different column names
+                if main_table and main_table in left_tables:
+                    left_prefix = main_table
+                else:
+                    left_prefix = left_tables[0] if left_tables else main_table
+
+                if join_table in right_tables:
+                    right_prefix = join_table
+                else:
+                    right_prefix = right_tables[0] if right_tables else join_table
+
+            # Replace the ambiguous JOIN condition, keeping anything AND-ed after it
+            join.condition = equality(left_prefix, left_col, right_prefix, right_col) + join.condition[rest:]
+
+def fix_ambiguous_columns(query, schema_tables):
+    tables_used = query.referenced_tables()
+
+    # Fix ambiguous JOIN conditions first
+    fix_ambiguous_join_conditions(query, tables_used, schema_tables)
+
+    # Fix ambiguous SELECT columns
+    fix_ambiguous_select_columns(query, tables_used, schema_tables)
+
+def fix_ambiguous_select_columns(query, tables_used, schema_tables):
+    """Fix ambiguous columns in SELECT, GROUP BY and ORDER BY clauses by adding table prefixes."""
+    # Use the first table (FROM table) as default
+    main_table = query.from_table
+
+    def fix_column_in_clause(item):
+        """Helper function to fix a single column reference."""
+        column = tokens_text(item)
+
+        # Skip if already has table prefix or is a function/expression
+        if '.' in column or '(' in column or column.upper() in ['*', 'COUNT(*)', 'DISTINCT'] or column.isdigit():
+            return item
+
+        # Find which tables contain this column
+        containing_tables = schema_tables.tables_with_column(column, among=tables_used)
+
+        # If column exists in multiple tables, add table prefix
+        if len(containing_tables) > 1:
+            if main_table in containing_tables:
+                return column_ref(main_table, column)
+            else:
+                return column_ref(containing_tables[0], column)
+        else:
+            return item
+
+    # Fix SELECT clause
+    if query.select and query.from_ is not None:
+        query.select = join_items([fix_column_in_clause(item) for item in split_items(query.select)])
+
+    # Fix GROUP BY clause
+    if query.group_by:
+        query.group_by = join_items([fix_column_in_clause(item) for item in split_items(query.group_by)])
+
+    # Fix ORDER BY clause
+    if query.order_by:
+        order_items = []
+        for item in split_items(query.order_by):
+            # Handle ORDER BY with ASC/DESC
+            indexes = significant(item)
+            if len(indexes) > 1 and is_keyword(item[indexes[-1]], 'ASC', 'DESC'):
+                direction = indexes[-1]
+                order_items.append(fix_column_in_clause(item[:direction]) + [WHITESPACE] + item[direction:])
+            else:
+                order_items.append(fix_column_in_clause(item))
+        query.order_by = join_items(order_items)
+
+
+NUMERIC_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14,
+    'fifteen': 15, 'sixteen': 16, 'seventeen': 17, 'eighteen': 18,
+    'nineteen': 19, 'twenty': 20, 'thirty': 30, 'forty': 40,
+    'fifty': 50, 'hundred': 100
+}
+
+
+def apply_limit_if_requested(query, question):
+    numeric_words = NUMERIC_WORDS
+
+    # Expanded list of generic keywords
+    keywords = r'user|users|product|products|order|orders|transaction|transactions|message|messages|method|methods|item|items|record|records|entry|entries|result|results'
+
+    limit_value = None
+
+    match = re.search(r'\blimit\s+(\d+)\b', question, re.IGNORECASE)
+    if match:
+        limit_value = int(match.group(1))
+    else:
+        match_digits = re.search(r'\b(\d+)\s+(' + keywords + r')\b', question, re.IGNORECASE)
+        if match_digits:
+            limit_value = int(match_digits.group(1))
+        else:
+            match_words = re.search(r'\b(' + '|'.join(numeric_words.keys()) + r')\s+(' + keywords + r')\b', question, re.IGNORECASE)
+            if match_words:
+                limit_word = match_words.group(1).lower()
+                limit_value = numeric_words.get(limit_word)
+
+    # Drop a generated numeric LIMIT; only the question decides how many rows to return
+    if query.limit is not None:
+        indexes = significant(query.limit)
+        if indexes and is_type(query.limit[indexes[0]][0], T.Number.Integer):
+            query.limit = None
+
+    if limit_value:
+        query.limit = [(T.Number.Integer, str(limit_value))]
+
+    query.terminated = True
+
+
+def handle_negative_conditions(query, question, schema_tables):
+    negative_conditions = [
+        (r"users.*not.*placed.*orders",
+         "SELECT users.name FROM users LEFT JOIN orders ON users.id = orders.user_id WHERE orders.id IS NULL"),
+
+        (r"products.*not.*ordered",
+         "SELECT products.name FROM products LEFT JOIN orders ON products.id = orders.product_id WHERE orders.id IS NULL"),
+
+        (r"transactions.*not.*completed",
+         "SELECT transactions.* FROM transactions WHERE transactions.payment_status != 'completed'")
+    ]
+
+    for pattern, replacement_query in negative_conditions:
+        if re.search(pattern, question, re.IGNORECASE):
+            return SqlQuery.parse(replacement_query + ';')
+
+    return query
+
+
+def fix_table_name_case(query, schema_tables):
+    """Fix table name case to match schema exactly."""
+    schema_tables_lower = schema_tables.tables_lower
+
+    # Find all table references in the query
+    renames = {}
+    for table_name in query.referenced_tables():
+        correct_name = schema_tables_lower.get(table_name.lower())
+        if correct_name and table_name != correct_name:
+            renames[table_name.lower()] = correct_name
+
+    if not renames:
+        return
+
+    # Replace every reference to the table (e.g. column prefixes) with the correct case
+    for tokens in query.token_lists():
+        for i, token in enumerate(tokens):
+            if is_word(token) and token[1].lower() in renames:
+                tokens[i] = (T.Name, renames[token[1].lower()])
+
+
+def fix_value_casing(query):
+    """Fix common value casing issues in WHERE clauses (gender, payment status)."""
+    for tokens in query.token_lists():
+        if not VALUE_CASING_TEXT_PATTERN.search(tokens_source(tokens)):
+            continue
+        for i, (ttype, value) in enumerate(tokens):
+            if not is_type(ttype, T.String.Single):
+                continue
+            operator = _previous(tokens, i)
+            if operator is None or tokens[operator][1] != "=":
+                continue
+            column = _previous(tokens, operator)
+            if column is None or not is_word(tokens[column]):
+                continue
+            column_name = tokens[column][1]
+            for expected_column, values in VALUE_CASING.items():
+                if column_name.lower().endswith(expected_column) and value.lower() in values:
+                    tokens[i] = (ttype, values[value.lower()])
+                    tokens[column] = (tokens[column][0], column_name[:-len(expected_column)] + expected_column)
+                    break
+
+
+def normalize_quotes(query):
+    """Normalize double quotes to single quotes in comparisons (=, !=, <>, LIKE)."""
+    for tokens in query.token_lists():
+        if '"' not in tokens_source(tokens):
+            continue
+        for i, (ttype, value) in enumerate(tokens):
+            if not is_type(ttype, T.String.Symbol) or not value.startswith('"'):
+                continue
+            operator = _previous(tokens, i)
+            if operator is None or not is_type(tokens[operator][0], T.Operator.Comparison):
+                continue
+            operator = tokens[operator][1]
+            if operator.endswith("=") or operator == "<>" or operator.upper().endswith("LIKE"):
+                tokens[i] = (T.String.Single, "'" + value[1:-1] + "'")
+
+
+def auto_correct_column_issues(query, schema_tables, question):
+    """Auto-correct common column access issues by adding necessary JOINs."""
+
+    # First, try to fix invalid JOIN conditions
+    fix_invalid_join_conditions(query, schema_tables)
+
+    # Fix cross-table column access issues
+    fix_cross_table_column_access(query, schema_tables)
+
+    # Extract SELECT columns and main table
+    main_table = query.from_table
+    if not query.select or not main_table:
+        return
+
+    select_clause = tokens_text(query.select)
+
+    # Skip if complex expressions
+    if '*' in select_clause or '(' in select_clause:
+        return
+
+    # Check if query already has JOINs - if so, don't add more
+    if query.has_join():
+        return
+
+    columns = [tokens_text(item) for item in split_items(query.select)]
+    missing_columns = []
+
+    # Find columns that don't exist in the main table
+    for column in columns:
+        if '.' not in column and main_table in schema_tables and not schema_tables.has_column(main_table, column):
+            # The first table in the schema that has this column
+            owners = schema_tables.tables_with_column(column)
+            if owners:
+                missing_columns.append((column, owners[0]))
+
+    if not missing_columns:
+        return
+
+    # Try to auto-correct by adding JOINs for common patterns
+    auto_add_joins_for_missing_columns(query, main_table, missing_columns, schema_tables, question)
+
+def fix_invalid_join_conditions(query, schema_tables):
+    """Fix invalid JOIN conditions by using correct relationship paths."""
+
+    fixed_joins = []
+    for join in query.joins:
+        join_table = _single_table_target(join)
+        match = _qualified_equality(join.condition) if join_table and join.condition else None
+        if match:
+            left_table, left_col, right_table, right_col = match
+            # Check if the JOIN condition is invalid
+            left_valid = schema_tables.has_column(left_table, left_col)
+            right_valid = schema_tables.has_column(right_table, right_col)
+            path = APPOINTMENT_JOIN_PATHS.get(match)
+
+            if (not left_valid or not right_valid) and path:
+                # These tables are only related through Appointments
+                via_col, onward_col = path
+                rest = join.condition[significant(join.condition, 7)[6] + 1:]
+                fixed_joins.append(Join.on('Appointments', equality(left_table, via_col, 'Appointments', via_col)))
+                fixed_joins.append(Join.on(join_table, equality('Appointments', onward_col, join_table, onward_col) + rest))
+                continue
+
+            foreign_key = None
+            if (not left_valid or not right_valid) and INFER_FOREIGN_KEY_JOINS:
+                foreign_key = foreign_key_index(schema_tables).between(left_table, right_table)
+            if foreign_key is not None:
+                # Directly related tables joined on the wrong columns: use the inferred foreign key
+                rest = join.condition[significant(join.condition, 7)[6] + 1:]
+                join.condition = equality(foreign_key.ref_table, foreign_key.ref_column,
+                                          foreign_key.table, foreign_key.column) + rest
+        fixed_joins.append(join)
+
+    query.joins = fixed_joins
+
+
+def fix_cross_table_column_access(query, schema_tables):
+    """Fix queries that try to access columns from wrong tables."""
+
+    # Selecting a customer or product column straight from Orders -> JOIN the table that has it
+    if query.from_table and query.from_table.lower() == 'orders' and query.select:
+        for columns, table, joins in ORDERS_CROSS_TABLE_COLUMNS:
+            items = split_items(query.select)
+            column = tokens_text(items[-1])
+            if len(items) <= 2 and column.lower() in columns:
+                items[-1] = column_ref(table, column)
+                query.select = join_items(items)
+                query.from_[significant(query.from_, 1)[0]] = name('Orders')
+                query.joins[0:0] = [Join.on(join_table, equality(*condition)) for join_table, condition in joins]
+
+    # Fix invalid direct JOIN between Customers and Products (most important fix)
+    fixed_joins = []
+    for join in query.joins:
+        is_products = join.condition and (_single_table_target(join) or '').lower() == 'products'
+        match = _qualified_equality(join.condition) if is_products else None
+        if match and tuple(part.lower() for part in match) == ('customers', 'product_id', 'products', 'product_id'):
+            rest = join.condition[significant(join.condition, 7)[6] + 1:]
+            fixed_joins += [
+                Join.on('Orders', equality('Customers', 'customer_id', 'Orders', 'customer_id')),
+                Join.on('OrderItems', equality('Orders', 'order_id', 'OrderItems', 'order_id')),
+                Join.on('Products', equality('OrderItems', 'product_id', 'Products', 'product_id') + rest),
+            ]
+        else:
+            fixed_joins.append(join)
+
+    # Fix duplicate Orders JOIN (when the JOIN right before it is already with Orders)
+    query.joins = []
+    removed_previous = False
+    for join in fixed_joins:
+        if query.joins and not removed_previous and _is_orders_join(query.joins[-1]) and _is_orders_join(join):
+            # Keep only the first JOIN with Orders
+            removed_previous = True
+            continue
+        removed_previous = False
+        query.joins.append(join)
+
+
+def _is_orders_join(join):
+    return join.condition is not None and (_single_table_target(join) or '').lower() == 'orders'
+
+
+def auto_add_joins_for_missing_columns(query, main_table, missing_columns, schema_tables, question):
+    """Add JOINs to access columns from other tables."""
+
+    # Common relationship patterns
+    join_patterns = {
+        # Patient-related queries
+        ('Billing', 'patient_id'): [
+            ('Appointments', 'appointment_id', 'appointment_id'),
+            ('Patients', 'patient_id', 'patient_id')
+        ],
+        ('Treatments', 'patient_id'): [
+            ('Appointments', 'appointment_id', 'appointment_id'),
+            ('Patients', 'patient_id', 'patient_id')
+        ],
+        # Doctor-related queries
+        ('Billing', 'doctor_id'): [
+            ('Appointments', 'appointment_id', 'appointment_id'),
+            ('Doctors', 'doctor_id', 'doctor_id')
+        ],
+        ('Treatments', 'doctor_id'): [
+            ('Appointments', 'appointment_id', 'appointment_id'),
+            ('Doctors', 'doctor_id', 'doctor_id')
+        ],
+        # Direct relationships
+        ('Appointments', 'first_name'): [
+            ('Patients', 'patient_id', 'patient_id')  # Assuming we want patient names
+        ],
+        ('Appointments', 'last_name'): [
+            ('Patients', 'patient_id', 'patient_id')
+        ]
+    }
+
+    # Check if we have a pattern for this case
+    for column, target_table in missing_columns:
+        pattern_key = (main_table, column)
+
+        if pattern_key in join_patterns:
+            # Build the JOIN clauses; they go right after FROM, before any WHERE clause
+            current_table = main_table
+            for join_table, join_col1, join_col2 in join_patterns[pattern_key]:
+                query.joins.append(Join.on(join_table, equality(current_table, join_col1, join_table, join_col2)))
+                current_table = join_table
+
+            # Update the SELECT clause to use the correct table prefix
+            items = split_items(query.select)
+            query.select = join_items([
+                column_ref(target_table, column) if tokens_text(item) == column else item for item in items
+            ])
+            return
+
+    # Otherwise reach each table that has a missing column along the inferred foreign keys
+    if not INFER_FOREIGN_KEY_JOINS:
+        return
+    graph = foreign_key_graph(schema_tables)
+    joined = {main_table.lower()}
+    qualified = {}
+    for column, target_table in missing_columns:
+        path = graph.path(main_table, target_table)
+        if not path:
+            continue
+        for _, far, (condition, _) in path:
+            if far.lower() not in joined:
+                joined.add(far.lower())
+                query.joins.append(Join.on(far, condition))
+        qualified[column] = target_table
+
+    if qualified:
+        items = split_items(query.select)
+        query.select = join_items([
+            column_ref(qualified[tokens_text(item)], tokens_text(item)) if tokens_text(item) in qualified else item
+            for item in items
+        ])
+
+def validate_join_conditions(query, schema_tables):
+    """Validate that columns in JOIN conditions exist in their respective tables."""
+
+    # Find all JOIN conditions
+    for join in query.joins:
+        match = _qualified_equality(join.condition) if _single_table_target(join) and join.condition else None
+        if not match:
+            continue
+        left_table, left_col, right_table, right_col = match
+        # Validate left side of JOIN condition
+        if left_table in schema_tables and not schema_tables.has_column(left_table, left_col):
+            return f"Column '{left_col}' does not exist in table '{left_table}' (JOIN condition)"
+
+        # Validate right side of JOIN condition
+        if right_table in schema_tables and not schema_tables.has_column(right_table, right_col):
+            return f"Column '{right_col}' does not exist in table '{right_table}' (JOIN condition)"
+
+    # Also check for unqualified JOIN conditions (without table prefixes)
+    # Get the main table (FROM table)
+    main_table = query.from_table
+    if not main_table:
+        return None
+
+    for join in query.joins:
+        join_table = _single_table_target(join)
+        match = _unqualified_equality(join.condition) if join_table and join.condition else None
+        if not match:
+            continue
+        left_col, right_col, _ = match
+        # Check if columns exist in their respective tables
+        if main_table in schema_tables and not schema_tables.has_column(main_table, left_col):
+            return f"Column '{left_col}' does not exist in table '{main_table}' (JOIN condition)"
+
+        if join_table in schema_tables and not schema_tables.has_column(join_table, right_col):
+            return f"Column '{right_col}' does not exist in table '{join_table}' (JOIN condition)"
+
+    return None
+
+def validate_sql_structure(query, schema_tables):
+    for table in query.referenced_tables():
+        if table.lower() not in schema_tables.tables_lower:
+            # Check if it's actually a column name being used as table name
+            if schema_tables.tables_with_column(table):
+                return f"'{table}' is a column name, not a table name. Cannot use it in JOIN clause."
+
+            return f"Table '{table}' does not exist."
+
+    return None
+
+def schema_family(schema_tables):
+    """The known database family (schema_families) a schema belongs to, or None; matched once per parsed schema."""
+    # One slot per schema holding (registry generation, family): a family registered later replaces the stale match
+    slot = schema_tables.derived("schema_family", lambda _: {})
+    generation = schema_families.generation
+    match = slot.get("match")
+    if match is None or match[0] != generation:
+        match = slot["match"] = (generation, schema_families.match(schema_tables))
+    return match[1]
+
+
+def detect_database_type(schema_tables):
+    """Detect database type based on table names in schema (once per parsed schema)."""
+    family = schema_family(schema_tables)
+    return family.name if family else None
+
+def _condition_hop(condition_tokens):
+    """Graph edge payload: ON tokens plus their whitespace-free text for the "already written" check."""
+    return condition_tokens, "".join(tokens_text(condition_tokens).split())
+
+
+def foreign_key_graph(schema_tables):
+    """Join graph over the foreign keys inferred for this schema, built once per parsed schema."""
+    def build(schema_tables):
+        return JoinGraph(
+            (fk.ref_table, fk.table, _condition_hop(equality(fk.ref_table, fk.ref_column, fk.table, fk.column)))
+            for fk in foreign_key_index(schema_tables)
+        )
+
+    return schema_tables.derived("foreign_key_graph", build)
+
+
+def relationship_graph(schema_tables, db_name):
+    """Join graph of a known database's relationships, restricted to tables in this schema.
+
+    Built once per parsed schema and database. Databases without hand-written
+    relationships get the graph of their inferred foreign keys.
+    """
+    family = schema_families.get(db_name)
+    if family is None or not family.relationships:
+        return foreign_key_graph(schema_tables)
+
+    def build(schema_tables):
+        edges = []
+        for (table1, table2), condition in family.conditions.items():
+            if schema_tables.resolve_table(table1) and schema_tables.resolve_table(table2):
+                edges.append((table1, table2, _condition_hop(condition)))
+        return JoinGraph(edges)
+
+    # Keyed by the family itself, so a family registered again under the same name gets a new graph
+    return schema_tables.derived(("relationship_graph", family), build)
+
+
+def prepare_schema(schema_tables):
+    """Build the per-schema join indexes up front, e.g. when a schema is registered."""
+    foreign_key_index(schema_tables)
+    db_name = detect_database_type(schema_tables)
+    graph = relationship_graph(schema_tables, db_name)
+    if graph is not None and len(graph) <= JOIN_GRAPH_PRECOMPUTE_MAX_TABLES:
+        graph.precompute()
+
+
+def add_missing_joins(query, schema_tables, db_name):
+    """Join tables the query uses (e.g. SELECT Products.category) but never joins, along the shortest path.
+
+    A table several hops away from the FROM table gets the whole chain, e.g.
+    Customers -> Orders -> OrderItems -> Products, with one path lookup per missing table.
+    Tables named only inside a subquery are not missing: the subquery has its own FROM.
+    """
+    graph = relationship_graph(schema_tables, db_name)
+    from_table = query.from_table
+    if from_table is None or from_table not in graph:
+        return
+
+    # Conditions already written somewhere in the query, compared without whitespace
+    present = {"".join(tokens_text(tokens).split()) for tokens in query.token_lists()}
+
+    joined = {from_table.lower()} | {join.table.lower() for join in query.joins if join.table}
+    # Joins reachable from the FROM table alone go right after it, in path order;
+    # hops that start from a table joined later in the query go after that join
+    insert_at = 0
+    chained = {from_table.lower()}
+    for table in query.outer_tables():
+        if table.lower() in joined:
+            continue
+        path = graph.path(from_table, table)
+        hops = [hop for hop in path or () if hop[1].lower() not in joined]
+        if not hops or any(compact in text for _, _, (_, compact) in hops for text in present):
+            continue
+        for near, far, (condition, _) in hops:
+            joined.add(far.lower())
+            if near.lower() in chained:
+                query.joins.insert(insert_at, Join.on(far, condition))
+                insert_at += 1
+                chained.add(far.lower())
+            else:
+                query.joins.append(Join.on(far, condition))
+
+def postprocess_sql(query, schema_tables, db_name):
+    """Enhanced post-processing with relationship-based joins."""
+    family = schema_families.get(db_name)
+    if family is None or not family.relationships:
+        return
+
+    query.terminated = False
+
+    # Ensure SELECT clause
+    if query.select is None:
+        query.select = [(T.Wildcard, '*'), WHITESPACE] + query.prefix
+        query.prefix = []
+
+    # Add joins if incomplete and user wants all tables
+    values = [value for tokens in query.token_lists() for _, value in tokens]
+    values += [join.keyword for join in query.joins]
+    if not any("JOIN" in value for value in values) and any("all" in value.lower() for value in values):
+        # Get the main table (first table in relationships)
+        main_table = next(iter(family.relationships))[0]
+        query.clear()
+        query.select = [(T.Wildcard, '*')]
+        query.from_ = [name(main_table)]
+
+        for (table1, table2), condition in family.conditions.items():
+            if table2 != main_table:
+                query.joins.append(Join.on(table2, condition))
+
+    add_missing_joins(query, schema_tables, db_name)
+
+
+# Fixers a schema family can list under "fixers" in its definition, run in that order by fix_sql_query
+FAMILY_FIXERS = {
+    "relationship_joins": postprocess_sql,
+}
+
+for _family in schema_families:
+    _unknown = [fixer for fixer in _family.fixers if fixer not in FAMILY_FIXERS]
+    if _unknown:
+        raise ValueError(f"Schema family '{_family.name}' lists unknown fixers: {', '.join(_unknown)}")
+
+def auto_join_all_tables(query, question, schema_tables):
+    """Automatically join all tables when requested by user."""
+    if not re.search(r'\bjoin all tables\b|\binclude all tables\b|\bcombine all\b', question, re.IGNORECASE):
+        return
+
+    # Join every table reachable from the first one along the inferred foreign keys
+    table_list = list(schema_tables.keys())
+    base_table = table_list[0]
+    graph = foreign_key_graph(schema_tables)
+    joins = []
+    used_tables = {base_table: None}
+    for table in table_list[1:]:
+        for _, far, (condition, _) in graph.path(base_table, table) or ():
+            if far not in used_tables:
+                used_tables[far] = None
+                joins.append(Join.on(far, condition))
+
+    # Reconstruct SELECT if needed
+    select = [query.select[i] for i in significant(query.select)] if query.select else []
+    if (select and is_type(select[0][0], T.Wildcard)) or query.select is None or query.from_ is None:
+        select_cols = []
+        for t in used_tables:
+            for c in schema_tables.ordered_columns(t):
+                select_cols.append(column_ref(t, c))
+        query.clear()
+        query.select = join_items(select_cols)
+        query.from_ = [name(base_table)]
+
+    # Build JOINs if not already present
+    if not query.has_join():
+        query.joins = joins
+
+    query.terminated = True
+
+def validate_column_existence(query, schema_tables):
+    """Validate that columns exist in the tables they're being selected from."""
+
+    # Extract SELECT columns
+    main_table = query.from_table
+    if not query.select or not main_table:
+        return None
+
+    select_clause = tokens_text(query.select)
+
+    # Skip if SELECT * or complex expressions
+    if '*' in select_clause or '(' in select_clause:
+        return None
+
+    # Get columns from SELECT clause, without DISTINCT
+    columns = [DISTINCT_PATTERN.sub('', tokens_text(item)).strip() for item in split_items(query.select)]
+
+    # Check if query has JOINs
+    has_joins = query.has_join()
+
+    for column in columns:
+        # Skip if already has table prefix
+        if '.' in column:
+            continue
+
+        # If no JOINs, check if column exists in main table
+        if not has_joins:
+            if main_table in schema_tables and not schema_tables.has_column(main_table, column):
+                # Try to suggest a better query by finding which table has this column
+                suggestion = suggest_table_for_column(column, main_table, schema_tables)
+                if suggestion:
+                    return f"Column '{column}' does not exist in table '{main_table}'. {suggestion}"
+                else:
+                    return f"Column '{column}' does not exist in table '{main_table}'"
+        else:
+            # If has JOINs, check if column exists in any of the used tables
+            used_tables = query.referenced_tables()
+
+            if not schema_tables.tables_with_column(column, among=used_tables):
+                return f"Column '{column}' does not exist in any of the used tables: {', '.join(used_tables)}"
+
+    return None
+
+
+def suggest_table_for_column(column, current_table, schema_tables):
+    """Suggest which table contains the column and how to access it."""
+    tables_with_column = schema_tables.tables_with_column(column)
+
+    if not tables_with_column:
+        return None
+
+    if len(tables_with_column) == 1:
+        target_table = tables_with_column[0]
+        return f"Column '{column}' exists in table '{target_table}'. Consider using a JOIN to access it."
+    else:
+        table_list = "', '".join(tables_with_column)
+        return f"Column '{column}' exists in tables: '{table_list}'. Consider using JOINs to access it."
@@ -0,0 +1,632 @@
+import functools
+import re
+from operator import itemgetter
+
+from sqlparse import keywords, tokens as T
+from sqlparse.lexer import Lexer, tokenize
+
+# Top-level clauses in the order they are serialized; JOINs are emitted right after FROM
+CLAUSE_ATTRIBUTES = {
+    "SELECT": "select",
+    "FROM": "from_",
+    "WHERE": "where",
+    "GROUP BY": "group_by",
+    "HAVING": "having",
+    "ORDER BY": "order_by",
+    "LIMIT": "limit",
+}
+SET_OPERATORS = {"UNION", "UNION ALL", "INTERSECT", "EXCEPT", "MINUS"}
+JOIN_KEYWORD_PATTERN = re.compile(r"^(?:\w+ )*JOIN$")
+WORD_PATTERN = re.compile(r"^\w+$")
+# Token lists up to this long (join targets, ON conditions) are filtered whole rather than scanned with an early exit
+SHORT_TOKEN_LIST = 32
+
+WHITESPACE = (T.Whitespace, " ")
+COMMA = (T.Punctuation, ",")
+DOT = (T.Punctuation, ".")
+OPEN_PAREN = (T.Punctuation, "(")
+EQUALS = (T.Operator.Comparison, "=")
+AND = (T.Keyword, "AND")
+
+
+# Lexer flags sqlparse compiles its rules with
+LEXER_FLAGS = re.IGNORECASE | re.UNICODE
+ASCII_CHARACTERS = frozenset(map(chr, range(128)))
+# Class of sqlparse token types (Token, Token.Keyword, ...)
+TOKEN_TYPE = type(T.Token)
+QUANTIFIER_PATTERN = re.compile(r"(?:([?*+])|\{(\d*)(,?)(\d*)\})[?+]?")
+ZERO_WIDTH_ESCAPES = frozenset("bBAZ")
+
+
+class _RulePrefix:
+    """Reads, from a regex's source, the ASCII characters a match can start with and whether it can
+    match the empty string.
+
+    Only the structure is parsed (groups, alternation, quantifiers); each one-character atom (a
+    literal, escape or class) is tried on every ASCII character with re.fullmatch, so case folding
+    follows the lexer's flags. Syntax it does not know raises ValueError, and the caller lets the
+    rule start with any character.
+    """
+
+    def __init__(self, rx):
+        self.rx = rx
+        self.pos = 0
+
+    def read(self):
+        first, nullable = self._alternation()
+        if self.pos != len(self.rx):
+            raise ValueError(f"unbalanced ')' in {self.rx!r}")
+        return first, nullable
+
+    def _alternation(self):
+        first, nullable = self._sequence()
+        while self._peek() == "|":
+            self.pos += 1
+            branch_first, branch_nullable = self._sequence()
+            first, nullable = first | branch_first, nullable or branch_nullable
+        return first, nullable
+
+    def _sequence(self):
+        first, nullable = set(), True
+        while self._peek() not in ("", "|", ")"):
+            item_first, item_nullable = self._item()
+            if nullable:
+                first |= item_first
+            nullable = nullable and item_nullable
+        return first, nullable
+
+    def _item(self):
+        first, nullable = self._atom()
+        quantifier = QUANTIFIER_PATTERN.match(self.rx, self.pos)
+        if quantifier is None:
+            return first, nullable
+        repeat, minimum, comma, maximum = quantifier.groups()
+        if repeat:
+            nullable = nullable or repeat != "+"
+        elif minimum or comma or maximum:
+            nullable = nullable or not int(minimum or 0)
+        else:
+            return first, nullable  # "{}" is a literal brace, the next atom
+        self.pos = quantifier.end()
+        return first, nullable
+
+    def _atom(self):
+        rx, pos = self.rx, self.pos
+        c = rx[pos]
+        if c == "(":
+            return self._group()
+        if c in "^$":
+            self.pos += 1
+            return set(), True
+        if c in "?*+":
+            raise ValueError(f"nothing to repeat at {pos} in {rx!r}")
+        if c == "\\":
+            escaped = rx[pos + 1:pos + 2]
+            if escaped in ZERO_WIDTH_ESCAPES:
+                self.pos += 2
+                return set(), True
+            if escaped.isdigit():
+                # A backreference: whatever its group matched, possibly nothing
+                self.pos += 2
+                return set(ASCII_CHARACTERS), True
+            if escaped in ("", "x", "u", "U", "N"):
+                raise ValueError(f"unsupported escape at {pos} in {rx!r}")
+            end = pos + 2
+        elif c == "[":
+            end = pos + 1
+            if rx[end:end + 1] == "^":
+                end += 1
+            if rx[end:end + 1] == "]":
+                end += 1
+            while end < len(rx) and rx[end] != "]":
+                end += 2 if rx[end] == "\\" else 1
+            if end >= len(rx):
+                raise ValueError(f"unterminated character class at {pos} in {rx!r}")
+            end += 1
+        else:
+            end = pos + 1
+        self.pos = end
+        atom = re.compile(rx[pos:end], LEXER_FLAGS)
+        return {c for c in ASCII_CHARACTERS if atom.fullmatch(c)}, False
+
+    def _group(self):
+        rx = self.rx
+        zero_width = False
+        if rx.startswith("(?:", self.pos):
+            self.pos += 3
+        elif rx.startswith("(?P<", self.pos):
+            self.pos = rx.index(">", self.pos) + 1
+        elif rx.startswith(("(?=", "(?!"), self.pos):
+            self.pos, zero_width = self.pos + 3, True
+        elif rx.startswith(("(?<=", "(?<!"), self.pos):
+            self.pos, zero_width = self.pos + 4, True
+        elif rx.startswith("(?", self.pos):
+            raise ValueError(f"unsupported group at {self.pos} in {rx!r}")
+        else:
+            self.pos += 1
+        first, nullable = self._alternation()
+        if self._peek() != ")":
+            raise ValueError(f"unterminated group in {rx!r}")
+        self.pos += 1
+        # Lookarounds consume nothing: the characters they test are the next item's
+        return (set(), True) if zero_width else (first, nullable)
+
+    def _peek(self):
+        return self.rx[self.pos:self.pos + 1]
+
+
+def _rule_prefix(rx):
+    """ASCII characters a match of the rule can start with (all of them when the source is not understood)."""
+    try:
+        first, nullable = _RulePrefix(rx).read()
+    except (ValueError, re.error):
+        return set(ASCII_CHARACTERS)
+    return set(ASCII_CHARACTERS) if nullable else first
+
+
+def _single_character(rx):
+    """True when every match of the rule is one character: a lone literal, escape or class, or a lazy
+    repeat of one with nothing after it (sqlparse's `\\s+?`)."""
+    if rx[:1] in ("", "(", "^", "$"):
+        return False
+    reader = _RulePrefix(rx)
+    try:
+        _, nullable = reader._atom()
+    except (ValueError, re.error):
+        return False
+    return not nullable and rx[reader.pos:] in ("", "+?")
+
+
+def _build_lexer():
+    """Compile sqlparse's token rules into alternations so each token costs a single regex match.
+
+    sqlparse tries its ~50 rules one by one at every position and the first rule that
+    matches wins. An alternation of the same rules in the same order picks the same
+    rule, so the token stream is identical. Rules are further narrowed by the first
+    character of the token, so a word never tries the string or comment rules.
+    """
+    rules = [(rx, action, _rule_prefix(rx), _single_character(rx)) for rx, action in keywords.SQL_REGEX]
+
+    def compile_rules(indexes):
+        parts = []
+        group_count = 0
+        for i in indexes:
+            rx = rules[i][0]
+            base = group_count + 1
+            inner_groups = re.compile(rx, LEXER_FLAGS).groups
+            # Renumber backreferences (dollar-quoted strings use \1) past the groups before them
+            rx = re.sub(r"\\(\d+)", lambda m: "\\" + str(base + int(m.group(1))), rx)
+            parts.append(f"(?P<t{i}>{rx})")
+            group_count = base + inner_groups
+        return re.compile("|".join(parts), LEXER_FLAGS).match
+
+    full_match = compile_rules(range(len(rules)))
+    compiled = {}
+    dispatch = {}
+    single_tokens = {}
+    for c in ASCII_CHARACTERS:
+        indexes = tuple(i for i, rule in enumerate(rules) if c in rule[2])
+        if indexes not in compiled:
+            compiled[indexes] = compile_rules(indexes) if indexes else None
+        dispatch[c] = compiled[indexes]
+        # A character only one rule can start, and only as a one-character token (a space, comma,
+        # parenthesis, ...), is its own token: about a third of a generated query, with no regex match
+        if len(indexes) == 1:
+            rx, action, _, single = rules[indexes[0]]
+            if single and action is not keywords.PROCESS_AS_KEYWORD and re.fullmatch(rx, c, LEXER_FLAGS):
+                single_tokens[c] = (action, c)
+    return dispatch, full_match, [rule[1] for rule in rules], single_tokens
+
+
+try:
+    _match_by_first_character, _match_any_token, _token_actions, _single_character_tokens = _build_lexer()
+except Exception:
+    _match_by_first_character = None
+    _token_actions = [action for _, action in keywords.SQL_REGEX]
+# Regex group name -> token type (or PROCESS_AS_KEYWORD), so a match maps to its rule without parsing the name
+_action_by_group = {f"t{i}": action for i, action in enumerate(_token_actions)}
+# Generated queries repeat the same few hundred words; sqlparse uppercases and looks each one up every time
+_is_keyword = functools.lru_cache(maxsize=4096)(Lexer.get_default_instance().is_keyword)
+# Every whitespace / comment token type the lexer can produce; a set lookup is the hottest check in the passes
+WHITESPACE_TYPES = frozenset(
+    action for action in _token_actions + [T.Whitespace]
+    if isinstance(action, TOKEN_TYPE) and (action in T.Whitespace or action in T.Comment)
+)
+
+
+# Token types the lexer (including sqlparse's keyword tables) can produce, by family: set lookups
+# instead of walking the token type hierarchy in the per-token loops
+_lexed_types = set(_token_actions) | {T.Whitespace, T.Error} | {
+    ttype for table in vars(keywords).values() if isinstance(table, dict)
+    for ttype in table.values() if isinstance(ttype, TOKEN_TYPE)}
+COMMENT_TYPES = frozenset(ttype for ttype in _lexed_types if isinstance(ttype, TOKEN_TYPE) and ttype in T.Comment)
+KEYWORD_TYPES = frozenset(ttype for ttype in _lexed_types if isinstance(ttype, TOKEN_TYPE) and ttype in T.Keyword)
+# Name and keyword types: the tokens that can spell a table or column name
+WORD_TYPES = frozenset(ttype for ttype in _lexed_types if isinstance(ttype, TOKEN_TYPE)
+                       and (ttype in T.Name or ttype in T.Keyword))
+
+
+def lex(sql):
+    """Tokenize SQL into the same (ttype, value) pairs as sqlparse.lexer.tokenize."""
+    if _match_by_first_character is None:
+        return list(tokenize(sql))
+    result = []
+    append = result.append
+    single_token = _single_character_tokens.get
+    match_for = _match_by_first_character.get
+    process_as_keyword = keywords.PROCESS_AS_KEYWORD
+    pos = 0
+    end = len(sql)
+    while pos < end:
+        c = sql[pos]
+        token = single_token(c)
+        if token is not None:
+            append(token)
+            pos += 1
+            continue
+        match = match_for(c, _match_any_token)
+        m = match(sql, pos) if match is not None else None
+        if m is None:
+            append((T.Error, sql[pos]))
+            pos += 1
+            continue
+        action = _action_by_group[m.lastgroup]
+        append(_is_keyword(m[0]) if action is process_as_keyword else (action, m[0]))
+        pos = m.end()
+    return result
+
+
+# A query touching every rule family; if the compiled lexer ever tokenizes it differently from sqlparse, use sqlparse
+LEXER_SELF_CHECK_SQL = ("WITH x AS (SELECT 1) SELECT t.a, COUNT(*), -1.5e3 FROM t LEFT OUTER JOIN u ON t.id = u.t_id "
+                        "WHERE t.b = 'x''y' AND u.c NOT LIKE \"%y%\" OR $1 <> :p -- note\n"
+                        "GROUP BY t.a ORDER BY 2 DESC LIMIT 10;")
+if _match_by_first_character is not None and lex(LEXER_SELF_CHECK_SQL) != list(tokenize(LEXER_SELF_CHECK_SQL)):
+    _match_by_first_character = None
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_keyword(value):
+    return " ".join(value.split()).upper()
+
+
+@functools.lru_cache(maxsize=None)
+def is_type(ttype, parent):
+    """Memoized `ttype in parent`; sqlparse walks the token type hierarchy in Python on every check."""
+    return ttype in parent
+
+
+def is_whitespace(token):
+    return token[0] in WHITESPACE_TYPES
+
+
+def is_word(token):
+    """True for identifier-like tokens, including column names sqlparse lexes as keywords (year, type, ...)."""
+    return token[0] in WORD_TYPES and WORD_PATTERN.match(token[1]) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_join(value):
+    return JOIN_KEYWORD_PATTERN.match(normalize_keyword(value)) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_from_or_join(value):
+    return normalize_keyword(value) == "FROM" or _is_join(value)
+
+
+def is_keyword(token, *values):
+    return is_type(token[0], T.Keyword) and normalize_keyword(token[1]) in values
+
+
+def significant(tokens, limit=None):
+    """Indexes of the non-whitespace tokens in a token list, stopping after `limit` of them."""
+    if limit is None or len(tokens) <= SHORT_TOKEN_LIST:
+        indexes = [i for i, token in enumerate(tokens) if token[0] not in WHITESPACE_TYPES]
+        return indexes if limit is None else indexes[:limit]
+    indexes = []
+    for i, token in enumerate(tokens):
+        if token[0] not in WHITESPACE_TYPES:
+            indexes.append(i)
+            if len(indexes) == limit:
+                break
+    return indexes
+
+
+def tokens_text(tokens):
+    """Render a token list, collapsing every whitespace run to a single space."""
+    parts = []
+    append = parts.append
+    pending_space = False
+    for ttype, value in tokens:
+        if ttype in WHITESPACE_TYPES:
+            pending_space = bool(parts)
+            continue
+        if pending_space:
+            append(" ")
+            pending_space = False
+        append(value)
+    return "".join(parts)
+
+
+def tokens_source(tokens):
+    """Concatenated token values, whitespace as lexed: a cheap text to search before scanning tokens one by one.
+
+    A pass looking for a rare token (LIKE, a double-quoted string, a T1 alias) skips every token
+    list whose text cannot contain it, which on long queries is nearly all of them.
+    """
+    return "".join(map(itemgetter(1), tokens))
+
+
+def split_top_level(tokens, is_separator):
+    """Split a token list on separator tokens that are not inside parentheses."""
+    current = []
+    parts = [current]
+    depth = 0
+    for token in tokens:
+        if token[0] is T.Punctuation:
+            if token[1] == "(":
+                depth += 1
+            elif token[1] == ")":
+                depth -= 1
+        if depth == 0 and is_separator(token):
+            current = []
+            parts.append(current)
+        else:
+            current.append(token)
+    return parts
+
+
+def split_items(tokens):
+    """Comma-separated items of a SELECT / GROUP BY / ORDER BY clause."""
+    return split_top_level(tokens, COMMA.__eq__)
+
+
+def join_items(items):
+    result = []
+    for item in items:
+        if result:
+            result += [COMMA, WHITESPACE]
+        result += item
+    return result
+
+
+def split_conditions(tokens):
+    """Top-level AND-ed conditions of a WHERE / HAVING / ON clause."""
+    return split_top_level(tokens, lambda token: is_keyword(token, "AND"))
+
+
+def join_conditions(conditions):
+    result = []
+    for condition in conditions:
+        if result:
+            result += [WHITESPACE, AND, WHITESPACE]
+        result += condition
+    return result
+
+
+def name(value):
+    return (T.Name, value)
+
+
+def column_ref(table, column):
+    """Tokens of a qualified column reference, e.g. Orders.customer_id."""
+    return [name(table), DOT, name(column)]
+
+
+def equality(left_table, left_column, right_table, right_column):
+    """Tokens of an equality join condition between two qualified columns."""
+    return column_ref(left_table, left_column) + [WHITESPACE, EQUALS, WHITESPACE] + column_ref(right_table, right_column)
+
+
+class Join:
+    """One JOIN of the top-level query: keyword as written, joined table (plus any alias) and ON condition."""
+
+    __slots__ = ("keyword", "target", "condition")
+
+    def __init__(self, keyword, target, condition=None):
+        self.keyword = keyword
+        self.target = target
+        self.condition = condition  # None when the join has no ON clause
+
+    @classmethod
+    def on(cls, table, condition):
+        return cls("JOIN", [name(table)], list(condition))
+
+    @property
+    def table(self):
+        """The joined table name, or None if the join target is not a plain name."""
+        for token in self.target:
+            if token[0] not in WHITESPACE_TYPES:
+                return token[1] if is_word(token) else None
+        return None
+
+    def to_sql(self):
+        parts = [normalize_keyword(self.keyword)]
+        target = tokens_text(self.target)
+        if target:
+            parts.append(target)
+        if self.condition is not None:
+            parts.append("ON")
+            condition = tokens_text(self.condition)
+            if condition:
+                parts.append(condition)
+        return " ".join(parts)
+
+
+class SqlQuery:
+    """Clause structure of a generated query, built from a single tokenization.
+
+    Only the top level is split into clauses; subqueries stay as token runs inside
+    the clause that contains them, and anything from the first UNION / INTERSECT /
+    EXCEPT on is kept verbatim in `tail`. Every clause is a list of (ttype, value)
+    tokens (None when the clause is absent), so fixers edit tokens in place and the
+    query is serialized once with to_sql().
+    """
+
+    __slots__ = ("prefix", "select", "from_", "joins", "where", "group_by", "having",
+                 "order_by", "limit", "tail", "terminated", "trailer")
+
+    def __init__(self):
+        self.prefix = []  # anything before SELECT (e.g. a WITH clause)
+        self.select = None
+        self.from_ = None
+        self.joins = []
+        self.where = None
+        self.group_by = None
+        self.having = None
+        self.order_by = None
+        self.limit = None
+        self.tail = []  # set operations and everything after them
+        self.terminated = False  # ends with ';'
+        self.trailer = []  # text after the terminating ';'
+
+    @classmethod
+    def parse(cls, sql):
+        query = cls()
+        current = query.prefix
+        in_tail = False
+        depth = 0
+
+        for token in lex(sql):
+            ttype, value = token
+            if ttype in COMMENT_TYPES:
+                # Serialized on one line, so a '--' comment would swallow the rest of the query
+                continue
+            if ttype is T.Punctuation:
+                if value == "(":
+                    depth += 1
+                elif value == ")":
+                    depth = max(depth - 1, 0)
+                elif value == ";" and depth == 0 and not query.terminated:
+                    query.terminated = True
+                    current = query.trailer
+                    continue
+
+            if depth == 0 and ttype in KEYWORD_TYPES and not in_tail and not query.terminated:
+                keyword = normalize_keyword(value)
+                attribute = CLAUSE_ATTRIBUTES.get(keyword)
+                if attribute is not None and getattr(query, attribute) is None:
+                    current = []
+                    setattr(query, attribute, current)
+                    continue
+                if JOIN_KEYWORD_PATTERN.match(keyword):
+                    join = Join(value, [])
+                    query.joins.append(join)
+                    current = join.target
+                    continue
+                if keyword == "ON" and query.joins and current is query.joins[-1].target:
+                    current = query.joins[-1].condition = []
+                    continue
+                if keyword in SET_OPERATORS:
+                    in_tail = True
+                    current = query.tail
+
+            current.append(token)
+        return query
+
+    def to_sql(self):
+        parts = []
+        prefix = tokens_text(self.prefix)
+        if prefix:
+            parts.append(prefix)
+        for keyword, attribute in CLAUSE_ATTRIBUTES.items():
+            tokens = getattr(self, attribute)
+            if tokens is not None:
+                text = tokens_text(tokens)
+                parts.append(f"{keyword} {text}" if text else keyword)
+            if attribute == "from_":
+                parts.extend(join.to_sql() for join in self.joins)
+        tail = tokens_text(self.tail)
+        if tail:
+            parts.append(tail)
+
+        sql = " ".join(parts)
+        if self.terminated:
+            sql += ";"
+            trailer = tokens_text(self.trailer)
+            if trailer:
+                sql += " " + trailer
+        return sql
+
+    def clear(self):
+        """Drop every clause, keeping the object so callers holding it see the rebuilt query."""
+        self.__init__()
+
+    def token_lists(self):
+        """Every token list of the query, for passes that rewrite tokens wherever they appear."""
+        lists = [self.prefix, self.select, self.from_]
+        for join in self.joins:
+            lists.append(join.target)
+            lists.append(join.condition)
+        lists += [self.where, self.group_by, self.having, self.order_by, self.limit, self.tail, self.trailer]
+        return [tokens for tokens in lists if tokens]
+
+    @property
+    def from_table(self):
+        """The first table after FROM, or None if FROM is missing or not followed by a plain name."""
+        if self.from_ is None:
+            return None
+        indexes = significant(self.from_, 1)
+        if indexes and is_word(self.from_[indexes[0]]):
+            return self.from_[indexes[0]][1]
+        return None
+
+    def referenced_tables(self):
+        """Tables named after FROM or JOIN anywhere in the query (subqueries included), in order."""
+        tables = [self.from_table] + [join.table for join in self.joins]
+        for tokens in self.token_lists():
+            if tokens is not self.tail and OPEN_PAREN not in tokens:
+                # Outside the tail, a nested FROM / JOIN can only sit inside a subquery
+                continue
+            after_from_or_join = False
+            for token in tokens:
+                ttype = token[0]
+                if ttype in WHITESPACE_TYPES:
+                    continue
+                if after_from_or_join and is_word(token):
+                    tables.append(token[1])
+                after_from_or_join = ttype in KEYWORD_TYPES and _is_from_or_join(token[1])
+        return [table for table in dict.fromkeys(tables) if table]
+
+    def outer_tables(self):
+        """Tables the top-level query itself names, in order: FROM / JOIN targets and column qualifiers.
+
+        Anything inside a subquery (`IN (SELECT category FROM Products)`) or after a set operator
+        belongs to another query and is left out.
+        """
+        tables = [self.from_table] + [join.table for join in self.joins]
+        clauses = [self.select] + [join.condition for join in self.joins]
+        clauses += [self.where, self.group_by, self.having, self.order_by]
+        for tokens in clauses:
+            if not tokens:
+                continue
+            subqueries = []  # per open parenthesis: whether it opens a subquery
+            in_subquery = 0
+            opened = False
+            for i, (ttype, value) in enumerate(tokens):
+                if ttype in WHITESPACE_TYPES:
+                    continue
+                if opened:
+                    opened = False
+                    if ttype in KEYWORD_TYPES and normalize_keyword(value) == "SELECT":
+                        subqueries[-1] = True
+                        in_subquery += 1
+                if ttype is T.Punctuation:
+                    if value == "(":
+                        subqueries.append(False)
+                        opened = True
+                    elif value == ")" and subqueries:
+                        in_subquery -= subqueries.pop()
+                    elif value == "." and not in_subquery and i > 0 and is_word(tokens[i - 1]):
+                        tables.append(tokens[i - 1][1])
+        return [table for table in dict.fromkeys(tables) if table]
+
+    def has_join(self):
+        """True if the query, or any subquery in it, contains a JOIN."""
+        if self.joins:
+            return True
+        return any(is_type(token[0], T.Keyword) and _is_join(token[1])
+                   for tokens in self.token_lists() for token in tokens)
+
+    def __repr__(self):
+        return f"SqlQuery({self.to_sql()!r})"
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service's modules live next to app.py, which is run from that directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
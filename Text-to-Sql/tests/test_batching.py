@@ -0,0 +1,95 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from batching import GenerationBatcher, QueueFullError
+
+
+def echo(batches):
+    def generate_batch(prompts, generate_kwargs):
+        batches.append((list(prompts), generate_kwargs))
+        return [prompt * 2 for prompt in prompts]
+    return generate_batch
+
+
+def test_concurrent_requests_share_a_batch():
+    batches = []
+    batcher = GenerationBatcher(echo(batches), max_batch_size=4, window_ms=200)
+    futures = [batcher.submit(n, max_new_tokens=8) for n in range(4)]
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6]
+    assert batches == [([0, 1, 2, 3], {"max_new_tokens": 8})]
+    assert batcher.stats()["avg_batch_size"] == 4
+
+
+def test_different_generate_kwargs_are_not_batched_together():
+    batches = []
+    batcher = GenerationBatcher(echo(batches), max_batch_size=4, window_ms=50)
+    first = batcher.submit(1, num_beams=1)
+    second = batcher.submit(2, num_beams=4)
+    assert (first.result(timeout=5), second.result(timeout=5)) == (2, 4)
+    assert sorted(kwargs["num_beams"] for _, kwargs in batches) == [1, 4]
+
+
+def test_full_queue_rejects():
+    release = threading.Event()
+
+    def blocked(prompts, generate_kwargs):
+        release.wait(5)
+        return prompts
+
+    batcher = GenerationBatcher(blocked, max_batch_size=1, window_ms=0, max_queue_depth=1)
+    running = batcher.submit(1)
+    while batcher.queue_depth():  # the worker took it: the queue is empty again
+        pass
+    batcher.submit(2)
+    with pytest.raises(QueueFullError):
+        batcher.submit(3)
+    release.set()
+    assert running.result(timeout=5) == 1
+    assert batcher.stats()["rejected"] == 1
+
+
+def test_generation_failure_reaches_every_request_in_the_batch():
+    def failing(prompts, generate_kwargs):
+        raise RuntimeError("out of memory")
+
+    batcher = GenerationBatcher(failing, max_batch_size=2, window_ms=200)
+    futures = [batcher.submit(n) for n in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="out of memory"):
+            future.result(timeout=5)
+    # The worker survives the failure
+    batcher.generate_batch = echo([])
+    assert batcher.generate(3) == 6
+
+
+def test_missing_outputs_fail_the_batch_instead_of_hanging():
+    def short(prompts, generate_kwargs):
+        return prompts[:-1]
+
+    batcher = GenerationBatcher(short, max_batch_size=3, window_ms=200)
+    futures = [batcher.submit(n) for n in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="3 prompts returned 2 outputs"):
+            future.result(timeout=5)
+
+
+def test_timeout_cancels_a_request_still_queued():
+    release = threading.Event()
+    seen = []
+
+    def blocked(prompts, generate_kwargs):
+        seen.extend(prompts)
+        release.wait(5)
+        return prompts
+
+    batcher = GenerationBatcher(blocked, max_batch_size=1, window_ms=0, timeout=0.2)
+    first = batcher.submit(1)
+    with pytest.raises(TimeoutError):
+        batcher.generate(2)
+    assert batcher.stats()["timed_out"] == 1
+    release.set()
+    assert first.result(timeout=5) == 1
+    assert batcher.generate(3) == 3
+    assert seen == [1, 3]  # the timed-out prompt was never generated
@@ -0,0 +1,53 @@
+import pytest
+
+from schema_cache import parse_schema
+from sql_postprocess import fix_ambiguous_columns, fix_sql_query
+from sql_rewrite import SqlQuery
+
+SCHEMA = parse_schema("Patients(patient_id, Name, city) Appointments(appointment_id, patient_id, doctor_id, date) "
+                      "Doctors(doctor_id, name, city) Rooms(room_id, CITY)")
+
+
+def test_column_owners_merge_case_variants():
+    assert SCHEMA.column_tables["name"] == ("Doctors",)
+    assert SCHEMA.column_tables_lower["name"] == ("Patients", "Doctors")
+    assert SCHEMA.tables_with_column("NAME") == ("Patients", "Doctors")
+    assert SCHEMA.tables_with_column("city") == ("Patients", "Doctors", "Rooms")
+    assert SCHEMA.tables_with_column("floor") == ()
+
+
+def test_owners_among_the_tables_of_a_query():
+    # In the query's order, as the query spells them
+    assert SCHEMA.tables_with_column("city", among=["Rooms", "doctors", "Appointments"]) == ("Rooms", "doctors")
+    assert SCHEMA.tables_with_column("city", among=["Appointments"]) == ()
+
+
+def test_has_column_ignores_case():
+    assert SCHEMA.has_column("patients", "NAME")
+    assert SCHEMA.has_column("Rooms", "city")
+    assert not SCHEMA.has_column("Patients", "doctor_id")
+    assert not SCHEMA.has_column("Wards", "city")
+
+
+@pytest.mark.parametrize("sql, expected", [
+    # Columns in several joined tables get the FROM table's prefix, ORDER BY direction kept
+    ("SELECT name, city FROM Patients JOIN Doctors ON patient_id = doctor_id ORDER BY city DESC",
+     "SELECT Patients.name, Patients.city FROM Patients JOIN Doctors ON patient_id = doctor_id "
+     "ORDER BY Patients.city DESC"),
+    # The same column on both sides of a join condition
+    ("SELECT name FROM Appointments JOIN Patients ON patient_id = patient_id",
+     "SELECT name FROM Appointments JOIN Patients ON Appointments.patient_id = Patients.patient_id"),
+    # Only ambiguous among the tables the query uses
+    ("SELECT city FROM Patients GROUP BY city", "SELECT city FROM Patients GROUP BY city"),
+])
+def test_ambiguous_columns_are_qualified(sql, expected):
+    query = SqlQuery.parse(sql)
+    fix_ambiguous_columns(query, SCHEMA)
+    assert query.to_sql() == expected
+
+
+def test_validation_uses_the_index():
+    assert fix_sql_query("SELECT DATE FROM Appointments", "", SCHEMA) == "SELECT DATE FROM Appointments"
+    assert fix_sql_query(
+        "SELECT date FROM Appointments JOIN Patients ON Appointments.patient_id = Patients.doctor_id", "", SCHEMA
+    ).startswith("Error: Column 'doctor_id' does not exist in table 'Patients' (JOIN condition)")
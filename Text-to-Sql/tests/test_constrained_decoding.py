@@ -0,0 +1,101 @@
+import string
+
+import torch
+
+from constrained_decoding import DecodeState, IdentifierTrie, SchemaConstraintProcessor, TokenVocabulary
+from schema_cache import parse_schema
+
+
+class PieceTokenizer:
+    """SentencePiece-like tokenizer over a fixed piece list: '▁' marks a space, longest piece first."""
+
+    all_special_ids = [0, 1]
+    unk_token_id = 1
+
+    def __init__(self, fragments):
+        pieces = ["<pad>", "<unk>", "▁"] + list(".,()*='<>;" + string.ascii_letters + string.digits)
+        for fragment in fragments:
+            pieces += [fragment, "▁" + fragment]
+        self.pieces = list(dict.fromkeys(pieces))
+        self.ids = {piece: token for token, piece in enumerate(self.pieces)}
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def convert_ids_to_tokens(self, token_ids):
+        return [self.pieces[token] for token in token_ids]
+
+    def encode(self, text):
+        text = "▁" + text.replace(" ", "▁")
+        token_ids = []
+        while text:
+            piece = next((text[:end] for end in range(len(text), 0, -1) if text[:end] in self.ids), text[0])
+            token_ids.append(self.ids.get(piece, self.unk_token_id))
+            text = text[len(piece):]
+        return token_ids
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [self.encode(text) for text in texts]}
+
+
+TOKENIZER = PieceTokenizer(["SELECT", "FROM", "WHERE", "AS", "Cust", "omers", "ers", "name", "city", "salary",
+                            "Orders", "total"])
+TRIE = IdentifierTrie(TOKENIZER, TokenVocabulary(TOKENIZER), parse_schema("Customers(name, city) Orders(total)"))
+
+
+def token_ids(pieces):
+    return [TOKENIZER.ids[piece] for piece in pieces.split("|")]
+
+
+def state_after(pieces):
+    state = DecodeState()
+    for token in token_ids(pieces):
+        state = TRIE.advance(state, token)
+    return state
+
+
+def allowed(pieces):
+    mask = TRIE.allowed(state_after(pieces))
+    return None if mask is None else set(TOKENIZER.convert_ids_to_tokens(mask.nonzero().flatten().tolist()))
+
+
+def test_words_start_only_with_schema_and_sql_tokens():
+    after_select = allowed("▁SELECT|▁")
+    assert {"▁name", "▁Cust", "▁FROM", "(", "1"} <= after_select
+    assert "▁salary" not in after_select
+    # Glued to punctuation: known words and short aliases (T1) may start, other words may not
+    assert {"name", "Cust", "T"} <= after_select
+    assert "salary" not in after_select
+
+
+def test_open_word_continues_along_the_trie():
+    assert allowed("▁SELECT|▁Cust") == {"omers"}
+    after_table = allowed("▁SELECT|▁Cust|omers")
+    assert {"▁FROM", ".", ","} <= after_table
+    assert "ers" not in after_table
+    after_dot = allowed("▁SELECT|▁Cust|omers|.")
+    assert "name" in after_dot and "salary" not in after_dot
+
+
+def test_string_literals_and_new_aliases_are_free():
+    assert allowed("▁SELECT|▁|'") is None
+    assert allowed("▁SELECT|▁|'|x") is None
+    assert {"▁salary", "▁ers"} <= allowed("▁SELECT|▁name|▁AS")
+
+
+def test_declared_alias_may_be_used_later():
+    assert "▁ers" not in allowed("▁SELECT|▁name|,")
+    assert "▁ers" in allowed("▁SELECT|▁name|▁AS|▁ers|,")
+
+
+def test_masks_are_built_once_per_node():
+    assert TRIE.allowed(state_after("▁SELECT|▁Cust")) is TRIE.allowed(state_after("▁SELECT|▁Cust"))
+
+
+def test_processor_masks_disallowed_logits():
+    processor = SchemaConstraintProcessor(TRIE)
+    input_ids = torch.tensor([token_ids("▁SELECT|▁Cust"), token_ids("▁SELECT|'")])
+    # Logits of a model vocabulary padded past the tokenizer's
+    scores = processor(input_ids, torch.zeros(2, len(TOKENIZER) + 3))
+    assert (scores[0] > float("-inf")).nonzero().flatten().tolist() == [TOKENIZER.ids["omers"]]
+    assert bool((scores[1] == 0).all())
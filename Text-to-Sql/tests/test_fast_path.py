@@ -0,0 +1,53 @@
+import pytest
+
+import fast_path
+from fast_path import FastPathStats, fast_path_sql, route_question
+from schema_cache import parse_schema
+
+SCHEMA = parse_schema("Customers(customer_id, name, city) Orders(order_id, customer_id, TotalAmount, order_date) "
+                      "OrderItems(item_id, order_id, quantity) categories(category_id, title)")
+
+
+@pytest.mark.parametrize("question, intent, sql", [
+    ("What tables are in the database?", "list_tables",
+     "SELECT 'Customers', 'Orders', 'OrderItems', 'categories' AS table_names;"),
+    ("Show me the columns of the orders table", "list_columns",
+     "SELECT 'order_id', 'customer_id', 'TotalAmount', 'order_date' AS columns_in_Orders;"),
+    ("How many customers are there?", "count", "SELECT COUNT(*) FROM Customers;"),
+    # Singular, plural and CamelCase spellings of the table
+    ("How many category", "count", "SELECT COUNT(*) FROM categories;"),
+    ("how many order items", "count", "SELECT COUNT(*) FROM OrderItems;"),
+    ("List all customers.", "list_all", "SELECT * FROM Customers;"),
+    ("Give me all the order items", "list_all", "SELECT * FROM OrderItems;"),
+    ("Top 5 orders by total amount", "top", "SELECT * FROM Orders ORDER BY TotalAmount DESC LIMIT 5;"),
+    ("top three customers by their name", "top", "SELECT * FROM Customers ORDER BY name DESC LIMIT 3;"),
+])
+def test_routed_questions(question, intent, sql):
+    assert route_question(question, SCHEMA) == (intent, sql)
+
+
+@pytest.mark.parametrize("question", [
+    # Any condition beyond the intent goes to the model
+    "How many customers signed up in May?",
+    "Which customers live in Lahore?",
+    # Names the schema does not have are not guessed at
+    "Show columns in warehouses",
+    "Show all suppliers",
+    "Top 5 orders by profit",
+])
+def test_other_questions_fall_through(question):
+    assert route_question(question, SCHEMA) is None
+
+
+def test_every_routed_question_is_counted(monkeypatch):
+    monkeypatch.setattr(fast_path, "fast_path_stats", FastPathStats())
+    assert fast_path_sql("List all customers", SCHEMA) == "SELECT * FROM Customers;"
+    assert fast_path_sql("How many orders are there", SCHEMA) == "SELECT COUNT(*) FROM Orders;"
+    assert fast_path_sql("Which customers live in Lahore?", SCHEMA) is None
+
+    stats = fast_path.fast_path_stats.stats()
+    assert stats["served_by_intent"] == {"list_all": 1, "count": 1}
+    assert (stats["served"], stats["fell_through"], stats["serve_rate"]) == (2, 1, 0.6667)
+    assert stats["latency"]["count"] == 3
+    fast_path.fast_path_stats.reset()
+    assert fast_path.fast_path_stats.stats()["served"] == 0
@@ -0,0 +1,69 @@
+import pytest
+
+import sql_postprocess
+from fk_index import ForeignKeyIndex, foreign_key_index, singular
+from schema_cache import parse_schema
+from sql_postprocess import fix_invalid_join_conditions, fix_sql_query
+from sql_rewrite import SqlQuery
+
+SCHEMA = parse_schema("Customers(id, name) Orders(id, customer_id, total) categories(category_id, title) "
+                      "Products(ProductId, CategoryId, name) OrderItems(id, order_id, ProductID) "
+                      "Payments(id, order_id, paid) Shipments(id, tracking_id) Labels(id, tracking_id)")
+SHOP = parse_schema("Customers(id, name, city) Orders(id, customer_id, total) OrderItems(id, order_id, product_id) "
+                    "Products(id, title)")
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("categories", "category"), ("addresses", "address"), ("boxes", "box"), ("orders", "order"), ("class", "class"),
+])
+def test_singular(word, expected):
+    assert singular(word) == expected
+
+
+def test_foreign_keys_follow_naming_conventions():
+    index = ForeignKeyIndex(SCHEMA)
+    assert {(fk.table, fk.column, fk.ref_table, fk.ref_column, fk.reason) for fk in index} == {
+        ("Orders", "customer_id", "Customers", "id", "name"),
+        # camelCase and plural table names
+        ("Products", "CategoryId", "categories", "category_id", "name"),
+        ("OrderItems", "ProductID", "Products", "ProductId", "name"),
+        ("OrderItems", "order_id", "Orders", "id", "name"),
+        ("Payments", "order_id", "Orders", "id", "name"),
+        # No tracking table: the first table declaring the column owns it
+        ("Labels", "tracking_id", "Shipments", "tracking_id", "shared column"),
+    }
+    # "paid" ends in id but is not a reference
+    assert index.references("Payments")[0].column == "order_id"
+    assert index.primary_key("categories") == "category_id"
+
+
+def test_lookups_ignore_case_and_direction():
+    index = ForeignKeyIndex(SCHEMA)
+    assert index.between("customers", "ORDERS") is index.between("Orders", "Customers")
+    assert index.between("Customers", "Products") is None
+    assert [fk.table for fk in index.referenced_by("orders")] == ["OrderItems", "Payments"]
+
+
+def test_index_is_built_once_per_parsed_schema():
+    assert foreign_key_index(SCHEMA) is foreign_key_index(SCHEMA)
+
+
+def test_join_repairs_are_off_by_default(monkeypatch):
+    monkeypatch.setattr(sql_postprocess, "INFER_FOREIGN_KEY_JOINS", False)
+    query = SqlQuery.parse("SELECT total FROM Orders JOIN Customers ON Orders.customer = Customers.customer_id")
+    fix_invalid_join_conditions(query, SHOP)
+    assert query.to_sql() == "SELECT total FROM Orders JOIN Customers ON Orders.customer = Customers.customer_id"
+    assert fix_sql_query("SELECT title FROM Customers", "", SHOP).startswith("Error: Column 'title' does not exist")
+
+
+def test_inferred_foreign_keys_repair_joins(monkeypatch):
+    monkeypatch.setattr(sql_postprocess, "INFER_FOREIGN_KEY_JOINS", True)
+    query = SqlQuery.parse("SELECT total FROM Orders JOIN Customers ON Orders.customer = Customers.customer_id "
+                           "WHERE total > 5")
+    fix_invalid_join_conditions(query, SHOP)
+    assert query.to_sql() == \
+        "SELECT total FROM Orders JOIN Customers ON Customers.id = Orders.customer_id WHERE total > 5"
+    # A column from another table is reached along the inferred keys
+    assert fix_sql_query("SELECT title FROM Customers", "", SHOP) == (
+        "SELECT Products.title FROM Customers JOIN Orders ON Customers.id = Orders.customer_id "
+        "JOIN OrderItems ON Orders.id = OrderItems.order_id JOIN Products ON Products.id = OrderItems.product_id")
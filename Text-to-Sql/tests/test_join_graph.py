@@ -0,0 +1,94 @@
+import pytest
+
+from join_graph import JoinGraph
+from schema_cache import parse_schema
+from sql_postprocess import add_missing_joins
+from sql_rewrite import SqlQuery
+
+EDGES = [
+    ("Customers", "Orders", "customer"),
+    ("Orders", "OrderItems", "order"),
+    ("OrderItems", "Products", "product"),
+    ("Products", "Categories", "category"),
+    ("Customers", "Addresses", "address"),
+]
+
+SHOP = parse_schema("Customers(customer_id, name) Orders(order_id, customer_id) "
+                    "OrderItems(item_id, order_id, product_id) Products(product_id, category) "
+                    "Warehouses(warehouse_id, city)")
+CUSTOMER_TO_PRODUCT = (" JOIN Orders ON Customers.customer_id = Orders.customer_id"
+                       " JOIN OrderItems ON Orders.order_id = OrderItems.order_id"
+                       " JOIN Products ON Products.product_id = OrderItems.product_id")
+
+
+def test_path_walks_the_shortest_join_chain():
+    graph = JoinGraph(EDGES)
+    assert graph.path("Customers", "Products") == [
+        ("Customers", "Orders", "customer"),
+        ("Orders", "OrderItems", "order"),
+        ("OrderItems", "Products", "product"),
+    ]
+    # Edges are undirected: the reverse walk returns the same conditions
+    assert graph.path("Categories", "Orders") == [
+        ("Categories", "Products", "category"),
+        ("Products", "OrderItems", "product"),
+        ("OrderItems", "Orders", "order"),
+    ]
+
+
+def test_shortcut_edge_wins_over_a_longer_chain():
+    graph = JoinGraph(EDGES + [("Orders", "Products", "shortcut")])
+    assert graph.path("Customers", "Products") == [
+        ("Customers", "Orders", "customer"),
+        ("Orders", "Products", "shortcut"),
+    ]
+
+
+def test_tables_match_case_insensitively():
+    graph = JoinGraph(EDGES)
+    assert "orderitems" in graph
+    assert graph.path("addresses", "ORDERS") == [
+        ("Addresses", "Customers", "address"),
+        ("Customers", "Orders", "customer"),
+    ]
+
+
+def test_same_unknown_and_disconnected_tables():
+    graph = JoinGraph(EDGES + [("Doctors", "Patients", "doctor")])
+    assert graph.path("Orders", "orders") == []
+    assert graph.path("Orders", "Suppliers") is None
+    assert graph.path("Orders", "Patients") is None
+
+
+def test_trees_are_built_once_and_reset_by_new_edges():
+    graph = JoinGraph(EDGES)
+    graph.path("Customers", "Products")
+    graph.path("Customers", "Categories")
+    assert graph.stats() == {"tables": 6, "edges": 5, "path_trees": 1}
+    graph.precompute()
+    assert graph.stats()["path_trees"] == 6
+
+    graph.add_edge("Addresses", "Categories", "odd")
+    assert graph.stats()["path_trees"] == 0
+    assert graph.path("Customers", "Categories") == [
+        ("Customers", "Addresses", "address"),
+        ("Addresses", "Categories", "odd"),
+    ]
+
+
+@pytest.mark.parametrize("sql, expected", [
+    # The whole chain to a table several hops away
+    ("SELECT Products.category FROM Customers", "SELECT Products.category FROM Customers" + CUSTOMER_TO_PRODUCT),
+    # Hops already written are not repeated
+    ("SELECT Products.category FROM Customers JOIN Orders ON Customers.customer_id = Orders.customer_id",
+     "SELECT Products.category FROM Customers" + CUSTOMER_TO_PRODUCT),
+    # No known path: left alone
+    ("SELECT Warehouses.city FROM Customers", "SELECT Warehouses.city FROM Customers"),
+    # A table named only inside a subquery is not missing from the outer query
+    ("SELECT name FROM Customers WHERE customer_id IN (SELECT customer_id FROM Orders)",
+     "SELECT name FROM Customers WHERE customer_id IN (SELECT customer_id FROM Orders)"),
+])
+def test_add_missing_joins_follows_the_schema_graph(sql, expected):
+    query = SqlQuery.parse(sql)
+    add_missing_joins(query, SHOP, None)
+    assert query.to_sql() == expected
@@ -0,0 +1,174 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import model_residency
+from model_residency import ModelResidency, checkpoint_bytes, parse_checkpoints
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    """Three 100-byte checkpoints."""
+    paths = {}
+    for family in ("RetailDB", "HospitalDB", "SchoolDB"):
+        directory = tmp_path / family
+        directory.mkdir()
+        (directory / "model.safetensors").write_bytes(b"\0" * 100)
+        (directory / "config.json").write_text("{}")
+        paths[family] = str(directory)
+    return paths
+
+
+class Loader:
+    def __init__(self):
+        self.loaded = []
+        self.fail = set()
+
+    def __call__(self, path):
+        if path in self.fail:
+            raise OSError(f"cannot read {path}")
+        self.loaded.append(path)
+        return object(), checkpoint_bytes(path)
+
+
+def test_parse_checkpoints():
+    assert parse_checkpoints(" RetailDB=./models/retail, HospitalDB = ./h ,") == {
+        "RetailDB": "./models/retail", "HospitalDB": "./h"}
+    with pytest.raises(ValueError):
+        parse_checkpoints("RetailDB")
+
+
+def test_checkpoint_bytes_counts_weight_files_only(checkpoints):
+    assert checkpoint_bytes(checkpoints["RetailDB"]) == 100
+
+
+def test_loaded_once_then_reused(checkpoints):
+    loader = Loader()
+    residency = ModelResidency(loader, checkpoints, max_bytes=1000)
+    with residency.use("RetailDB") as first:
+        assert first is not None
+    with residency.use("RetailDB") as second:
+        assert second is first
+    with residency.use(None) as default:
+        assert default is None
+    stats = residency.stats()
+    assert (stats["loads"], stats["hits"], stats["resident_bytes"]) == (1, 1, 100)
+
+
+def test_concurrent_requests_wait_for_one_load(checkpoints):
+    started, release = threading.Event(), threading.Event()
+    loader = Loader()
+
+    def slow_load(path):
+        started.set()
+        release.wait(5)
+        return loader(path)
+
+    residency = ModelResidency(slow_load, checkpoints, max_bytes=1000)
+
+    def request():
+        with residency.use("RetailDB") as model:
+            return model
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(request)]
+        started.wait(5)
+        futures += [pool.submit(request) for _ in range(3)]
+        while residency.stats()["checkpoints"]["RetailDB"]["in_flight"] < 4:
+            pass
+        release.set()
+        models = [future.result(5) for future in futures]
+    assert len(loader.loaded) == 1
+    assert all(model is models[0] for model in models)
+    assert residency.stats()["checkpoints"]["RetailDB"]["in_flight"] == 0
+
+
+def test_least_recently_used_idle_model_is_evicted_and_reloaded(checkpoints):
+    loader = Loader()
+    residency = ModelResidency(loader, checkpoints, max_bytes=200)
+    for family in ("RetailDB", "HospitalDB", "RetailDB", "SchoolDB"):
+        with residency.use(family):
+            pass
+    stats = residency.stats()
+    assert stats["evictions"] == 1
+    assert stats["resident_bytes"] == 200
+    assert not stats["checkpoints"]["HospitalDB"]["resident"]
+    with residency.use("HospitalDB") as model:
+        assert model is not None
+    assert loader.loaded.count(checkpoints["HospitalDB"]) == 2
+
+
+def test_model_in_use_is_unloaded_only_after_its_request(checkpoints):
+    residency = ModelResidency(Loader(), checkpoints, max_bytes=100)
+    with residency.use("RetailDB") as retail:
+        with residency.use("HospitalDB") as hospital:
+            # Over budget: both are in use, so neither can go yet
+            assert retail is not None and hospital is not None
+            assert residency.stats()["resident_bytes"] == 200
+        assert not residency.stats()["checkpoints"]["HospitalDB"]["resident"]
+    stats = residency.stats()
+    assert stats["resident_bytes"] == 100
+    assert stats["checkpoints"]["RetailDB"]["resident"]
+
+
+def test_failed_load_falls_back_until_retry(checkpoints, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(model_residency.time, "monotonic", lambda: now[0])
+    loader = Loader()
+    loader.fail.add(checkpoints["RetailDB"])
+    residency = ModelResidency(loader, checkpoints, max_bytes=1000, retry_s=60)
+
+    with residency.use("RetailDB") as model:
+        assert model is None
+    now[0] += 30
+    with residency.use("RetailDB") as model:
+        assert model is None  # within retry_s: not tried again
+    stats = residency.stats()
+    assert stats["failures"] == 1
+    assert "cannot read" in stats["checkpoints"]["RetailDB"]["error"]
+
+    loader.fail.clear()
+    now[0] += 31
+    with residency.use("RetailDB") as model:
+        assert model is not None
+    stats = residency.stats()
+    assert (stats["loads"], stats["failures"]) == (1, 1)
+    assert stats["checkpoints"]["RetailDB"]["error"] is None
+    assert stats["checkpoints"]["RetailDB"]["in_flight"] == 0
+
+
+def test_interrupted_load_releases_waiters(checkpoints):
+    started, release = threading.Event(), threading.Event()
+    loader = Loader()
+    interrupt = [True]
+
+    def load(path):
+        if interrupt[0]:
+            interrupt[0] = False
+            started.set()
+            release.wait(5)
+            raise KeyboardInterrupt
+        return loader(path)
+
+    residency = ModelResidency(load, checkpoints, max_bytes=1000)
+
+    def request():
+        with residency.use("RetailDB") as model:
+            return model
+
+    with ThreadPoolExecutor(2) as pool:
+        interrupted = pool.submit(request)
+        started.wait(5)
+        waiter = pool.submit(request)
+        while residency.stats()["checkpoints"]["RetailDB"]["in_flight"] < 2:
+            pass
+        release.set()
+        with pytest.raises(KeyboardInterrupt):
+            interrupted.result(5)
+        # The waiter loads it itself rather than hanging or seeing a failure
+        assert waiter.result(5) is not None
+    stats = residency.stats()
+    assert (stats["loads"], stats["failures"]) == (1, 0)
+    assert stats["checkpoints"]["RetailDB"]["in_flight"] == 0
+    assert not stats["checkpoints"]["RetailDB"]["loading"]
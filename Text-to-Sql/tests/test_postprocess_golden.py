@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+from benchmark import GOLDEN_CORPUS, load_golden_corpus, normalize_sql
+from schema_cache import parse_schema
+from sql_postprocess import fix_sql_query
+
+CASES = load_golden_corpus(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), GOLDEN_CORPUS))
+
+
+@pytest.mark.parametrize("question, schema, sql, expected", CASES,
+                         ids=[f"{i}-{case[0]}" for i, case in enumerate(CASES)])
+def test_golden_case(question, schema, sql, expected):
+    assert normalize_sql(fix_sql_query(sql, question, parse_schema(schema))) == normalize_sql(expected)
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def read(service):
+    with open(os.path.join(REPO, service, "prefork.py"), "rb") as f:
+        return f.read()
+
+
+def test_service_copies_are_identical():
+    # Each service runs from its own directory and environment, so prefork.py is copied rather than imported
+    assert read("text-to-title") == read("Text-to-Sql")
+    assert read("whisper-api") == read("Text-to-Sql")
+
+
+def test_refuses_to_fork_a_model_on_a_gpu(monkeypatch):
+    torch = pytest.importorskip("torch")
+    import prefork
+
+    monkeypatch.setattr(torch.cuda, "is_initialized", lambda: True)
+    monkeypatch.setattr(prefork.os, "fork", lambda: pytest.fail("forked a worker"))
+    with pytest.raises(SystemExit, match="GPU"):
+        prefork.serve(object(), lambda: None, "127.0.0.1", 0, workers=1, threads=1)
@@ -0,0 +1,61 @@
+import pytest
+
+from question_templates import extract_template
+from schema_cache import parse_schema
+
+SCHEMA = parse_schema("Customers(id, name, city, gender) Orders(id, customer_id, order_date, total) "
+                      "Invoices(id, payment_status)")
+
+
+@pytest.mark.parametrize("question, text, slots", [
+    ("Show customers from Karachi", "Show customers from <NAME0>", [("NAME0", "Karachi")]),
+    ("Show customers from New York named 'Ali'", "Show customers from <NAME0> named <STR0>",
+     [("STR0", "Ali"), ("NAME0", "New York")]),
+    ("Orders placed on 2024-01-05 over 300", "Orders placed on <DATE0> over <NUM0>",
+     [("DATE0", "2024-01-05"), ("NUM0", "300")]),
+    ("Top five customers", "Top <NUM0> customers", [("NUM0", "5")]),
+    ("Orders from January", "Orders from <DATE0>", [("DATE0", "January")]),
+    # Table names and the first word are never literals
+    ("List Customers in Lahore", "List Customers in <NAME0>", [("NAME0", "Lahore")]),
+    ("Show paid invoices", "Show paid invoices", []),
+])
+def test_literals_become_typed_slots(question, text, slots):
+    template = extract_template(question, SCHEMA)
+    assert template.text == text
+    assert template.slots == slots
+
+
+def test_questions_differing_in_literals_share_a_template():
+    first = extract_template("Show customers from Karachi", SCHEMA)
+    second = extract_template("Show customers from Lahore", SCHEMA)
+    assert first.text == second.text
+
+    slotted = first.slot_sql("SELECT name FROM Customers WHERE city = 'Karachi'")
+    assert slotted == "SELECT name FROM Customers WHERE city = '__SLOT_NAME0__'"
+    assert second.fill_sql(slotted) == "SELECT name FROM Customers WHERE city = 'Lahore'"
+
+
+def test_numbers_fill_limits():
+    slotted = extract_template("Top 5 orders", SCHEMA).slot_sql("SELECT * FROM Orders LIMIT 5")
+    assert slotted == "SELECT * FROM Orders LIMIT __SLOT_NUM0__"
+    assert extract_template("Top 3 orders", SCHEMA).fill_sql(slotted) == "SELECT * FROM Orders LIMIT 3"
+
+
+@pytest.mark.parametrize("question, sql", [
+    # The literal is not compared with a column
+    ("Show customers from Karachi", "SELECT 'Karachi' FROM Customers"),
+    # A date may only stand for a date column
+    ("Orders placed on 2024-01-05", "SELECT * FROM Orders WHERE total = '2024-01-05'"),
+    # Twice in the SQL: which one to re-fill is ambiguous
+    ("Show customers from Karachi", "SELECT * FROM Customers WHERE city = 'Karachi' OR name = 'Karachi'"),
+])
+def test_sql_that_cannot_be_refilled_safely_is_not_slotted(question, sql):
+    assert extract_template(question, SCHEMA).slot_sql(sql) is None
+
+
+def test_fill_respects_known_column_values():
+    slotted = extract_template("Customers with gender 'female'", SCHEMA).slot_sql(
+        "SELECT * FROM Customers WHERE gender = 'female'")
+    assert extract_template("Customers with gender 'male'", SCHEMA).fill_sql(slotted) == \
+        "SELECT * FROM Customers WHERE gender = 'Male'"
+    assert extract_template("Customers with gender 'robot'", SCHEMA).fill_sql(slotted) is None
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import result_cache
+from result_cache import InvalidationLog, ResultCache, normalize_question
+
+SCHEMA_A = "a" * 64
+SCHEMA_B = "b" * 64
+
+
+def key(schema_hash, question="How many users?"):
+    return ResultCache.make_key(question, schema_hash)
+
+
+def test_normalize_question_keeps_quoted_literals_and_numbers():
+    assert normalize_question("  Users named 'Alice'?") == "users named 'Alice'"
+    assert normalize_question("Orders over 1,000.50!") == "orders over 1,000.50"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_size=2, ttl=60)
+    cache.put(key(SCHEMA_A, "one"), "SELECT 1")
+    cache.put(key(SCHEMA_A, "two"), "SELECT 2")
+    assert cache.get(key(SCHEMA_A, "one")) == "SELECT 1"
+    cache.put(key(SCHEMA_A, "three"), "SELECT 3")
+    assert cache.get(key(SCHEMA_A, "two")) is None
+    assert cache.get(key(SCHEMA_A, "one")) == "SELECT 1"
+    assert cache.stats()["evictions"] == 1
+    # An evicted key no longer counts towards its schema
+    assert cache.invalidate_schema(SCHEMA_A) == 2
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    cache = ResultCache(ttl=10)
+    cache.put(key(SCHEMA_A), "SELECT 1")
+    now[0] += 11
+    assert cache.get(key(SCHEMA_A)) is None
+    stats = cache.stats()
+    assert (stats["size"], stats["expirations"], stats["misses"]) == (0, 1, 1)
+    # Storing it again after expiry works
+    cache.put(key(SCHEMA_A), "SELECT 2")
+    assert cache.get(key(SCHEMA_A)) == "SELECT 2"
+
+
+@pytest.mark.parametrize("log", [None, InvalidationLog(size=4)], ids=["local", "shared"])
+def test_invalidate_schema_and_clear(log):
+    cache = ResultCache(ttl=60, invalidation_log=log)
+    cache.put(key(SCHEMA_A, "one"), "SELECT 1")
+    cache.put(key(SCHEMA_A, "two"), "SELECT 2")
+    cache.put(key(SCHEMA_B), "SELECT 3")
+    assert cache.invalidate_schema(SCHEMA_A) == 2
+    assert cache.invalidate_schema(SCHEMA_A) == 0
+    assert cache.get(key(SCHEMA_B)) == "SELECT 3"
+    assert cache.clear() == 1
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["invalidations"] == 3
+
+
+def test_invalidations_reach_a_cache_sharing_the_log():
+    log = InvalidationLog(size=4)
+    worker1, worker2 = ResultCache(ttl=60, invalidation_log=log), ResultCache(ttl=60, invalidation_log=log)
+    for cache in (worker1, worker2):
+        cache.put(key(SCHEMA_A), "SELECT 1")
+        cache.put(key(SCHEMA_B), "SELECT 2")
+    worker1.invalidate_schema(SCHEMA_A)
+    assert worker2.get(key(SCHEMA_A)) is None
+    assert worker2.get(key(SCHEMA_B)) == "SELECT 2"
+    worker1.clear()
+    assert worker2.get(key(SCHEMA_B)) is None
+
+
+def test_cache_too_far_behind_the_log_clears_everything():
+    log = InvalidationLog(size=2)
+    cache = ResultCache(ttl=60, invalidation_log=log)
+    cache.put(key(SCHEMA_A), "SELECT 1")
+    for n in range(3):
+        log.append(f"{n}" * 64)  # none of them is SCHEMA_A, but the ring no longer says so
+    assert cache.get(key(SCHEMA_A)) is None
+    assert log.since(log.sequence) == (log.sequence, [])
+
+
+def test_invalidation_log_rejects_an_oversized_hash():
+    with pytest.raises(ValueError):
+        InvalidationLog(size=1).append("x" * 65)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_invalidation_in_a_forked_worker_reaches_the_parent():
+    cache = ResultCache(ttl=60, invalidation_log=InvalidationLog(size=4))
+    cache.put(key(SCHEMA_A), "SELECT 1")
+    cache.put(key(SCHEMA_B), "SELECT 2")
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if cache.invalidate_schema(SCHEMA_A) == 1 else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert cache.get(key(SCHEMA_A)) is None
+    assert cache.get(key(SCHEMA_B)) == "SELECT 2"
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from schema_cache import parse_schema
+from schema_families import SchemaFamily, SchemaFamilyRegistry, load_families, schema_families, table_fingerprint
+from sql_postprocess import detect_database_type
+
+RETAIL = ["Customers", "Orders", "OrderItems", "Products", "Payments"]
+
+
+def family(name, tables, **options):
+    return SchemaFamily(name, tables, **options)
+
+
+def test_fingerprint_ignores_order_and_duplicates_but_not_case():
+    assert table_fingerprint(["b", "a", "a"]) == table_fingerprint(["a", "b"])
+    assert table_fingerprint(["Orders"]) != table_fingerprint(["orders"])
+
+
+def test_exact_and_near_matches():
+    registry = SchemaFamilyRegistry([family("Retail", RETAIL, min_overlap=2)])
+    assert registry.match(reversed(RETAIL)).name == "Retail"
+    assert registry.match(["Customers", "Orders", "Reviews"]).name == "Retail"
+    assert registry.match(["Customers", "Reviews"]) is None
+    assert registry.stats() == {"families": 1, "exact_matches": 1, "near_matches": 1, "unmatched": 1}
+
+
+def test_near_match_by_jaccard_prefers_the_closest_then_the_earliest():
+    registry = SchemaFamilyRegistry([
+        family("Wide", ["a", "b", "c", "d", "e"], min_jaccard=0.5),
+        family("Narrow", ["a", "b", "c", "x"], min_jaccard=0.5),
+        family("Twin", ["a", "b", "c", "y"], min_jaccard=0.5),
+    ])
+    # 3 of 4 tables shared with Narrow and Twin (0.6), 3 of 5 with Wide (0.5): Narrow was registered first
+    assert registry.match(["a", "b", "c", "z"]).name == "Narrow"
+    assert registry.match(["a", "b", "q", "r"]) is None
+
+
+def test_table_sets_match_exactly():
+    registry = SchemaFamilyRegistry([family("Retail", RETAIL, min_jaccard=1.0, table_sets=[["Customer", "Sale"]])])
+    assert registry.match(["Sale", "Customer"]).name == "Retail"
+
+
+def test_unregister_and_replace_bump_the_generation():
+    registry = SchemaFamilyRegistry([family("Retail", RETAIL, min_overlap=2)])
+    generation = registry.generation
+    registry.register(family("Retail", ["Shops", "Sales"], min_overlap=2))
+    assert registry.match(RETAIL) is None
+    assert registry.match(["Shops", "Sales"]).name == "Retail"
+    registry.unregister("Retail")
+    assert registry.generation == generation + 2
+    assert len(registry) == 0 and "Retail" not in registry
+    assert registry.match(["Shops", "Sales"]) is None
+    with pytest.raises(KeyError):
+        registry.unregister("Retail")
+
+
+def test_family_needs_indicator_tables():
+    with pytest.raises(ValueError):
+        SchemaFamily("Empty", [])
+
+
+def test_load_families_reports_the_bad_file(tmp_path):
+    (tmp_path / "01-good.json").write_text(json.dumps({"name": "Good", "indicator_tables": ["a"]}))
+    assert [f.name for f in load_families(str(tmp_path))] == ["Good"]
+    (tmp_path / "02-bad.json").write_text(json.dumps({"indicator_tables": ["a"]}))
+    with pytest.raises(ValueError, match="02-bad.json"):
+        load_families(str(tmp_path))
+    assert load_families(str(tmp_path / "missing")) == []
+
+
+def test_cached_match_is_replaced_when_the_registry_changes():
+    schema = parse_schema("CREATE TABLE Ledgers (ledger_id INT);\nCREATE TABLE Entries (entry_id INT, ledger_id INT);")
+    assert detect_database_type(schema) is None
+    schema_families.register(family("LedgerDB", ["Ledgers", "Entries"], min_overlap=2))
+    try:
+        assert detect_database_type(schema) == "LedgerDB"
+    finally:
+        schema_families.unregister("LedgerDB")
+    assert detect_database_type(schema) is None
+
+
+@pytest.mark.skipif(not hasattr(os, "register_at_fork"), reason="needs fork")
+def test_forked_child_does_not_inherit_a_held_lock():
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with schema_families._lock:
+            held.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(5)
+    try:
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if schema_families.match(RETAIL).name == "RetailDB" else 1)
+        deadline = time.monotonic() + 5
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            if time.monotonic() > deadline:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                pytest.fail("the forked child blocked on the schema family registry lock")
+            time.sleep(0.01)
+        assert status == 0
+    finally:
+        release.set()
+        holder.join()
@@ -0,0 +1,46 @@
+import pytest
+
+from schema_cache import parse_schema
+from schema_pruning import lexical_index, name_terms, pruned_schema, pruned_tables, question_terms, relevant_tables
+
+SCHEMA = parse_schema(
+    "Customers(customer_id, name, city) Orders(order_id, customer_id, order_date, total) "
+    "OrderItems(item_id, order_id, product_id, quantity) Products(product_id, name, price) "
+    "Suppliers(supplier_id, name) Employees(employee_id, name, department) Departments(department_id, title) "
+    "Warehouses(warehouse_id, city)")
+
+
+def test_terms_split_identifiers_and_expand_synonyms():
+    assert name_terms("order_date") == {"order_date", "order", "date"}
+    assert name_terms("CustomerID") == {"customerid", "customer"}
+    assert {"client", "customer", "buyer"} <= question_terms("Which clients bought the most?")
+    assert "which" not in question_terms("Which clients bought the most?")
+
+
+def test_terms_in_more_than_half_the_tables_are_not_indexed():
+    postings = lexical_index(SCHEMA).postings
+    assert "id" not in postings
+    assert set(postings["city"]) == {"Customers", "Warehouses"}
+
+
+@pytest.mark.parametrize("question, top_k, max_neighbours, expected", [
+    # The best match plus the tables its foreign keys join
+    ("Which clients live in Lahore?", 1, 8, ["Customers", "Orders"]),
+    ("How many staff in each department?", 1, 8, ["Employees"]),
+    ("Total price of products per supplier", 2, 1, ["OrderItems", "Products", "Suppliers"]),
+    # Nothing matches: the start of the schema rather than an empty prompt
+    ("Hello there", 1, 0, ["Customers"]),
+])
+def test_top_k_tables_and_their_neighbours(question, top_k, max_neighbours, expected):
+    assert relevant_tables(question, SCHEMA, top_k=top_k, max_neighbours=max_neighbours) == expected
+
+
+def test_whole_schema_when_pruning_is_off_or_cannot_help():
+    assert relevant_tables("Which clients live in Lahore?", SCHEMA, top_k=0) == list(SCHEMA)
+    assert pruned_tables("Which clients live in Lahore?", SCHEMA, top_k=len(SCHEMA)) is None
+    assert pruned_schema("Which clients live in Lahore?", SCHEMA, top_k=0) is None
+
+
+def test_pruned_schema_uses_the_prompt_format():
+    assert pruned_schema("Which clients live in Lahore?", SCHEMA, top_k=1) == \
+        "Customers(customer_id, name, city), Orders(order_id, customer_id, order_date, total)"
@@ -0,0 +1,59 @@
+from array import array
+
+from fk_index import foreign_key_index
+from join_graph import JoinGraph
+from schema_cache import deep_size
+from schema_registry import SchemaRegistry
+
+SCHEMA = "Customers(id, name, city) Orders(id, customer_id, total) Items(id, order_id, product_id, price)"
+
+
+def test_deep_size_counts_shared_objects_once():
+    shared = ["x" * 1000]
+    assert deep_size((shared, shared)) + 1000 < deep_size((shared, ["y" * 1000]))
+
+
+def test_deep_size_charges_indexes_by_their_own_hook():
+    graph = JoinGraph([("Customers", "Orders", "Customers.id = Orders.customer_id")])
+    before = deep_size(graph)
+    graph._trees[0] = (array("l", range(1000)), array("l", range(1000)))
+    assert deep_size(graph) > before + 8000
+
+
+def test_derived_index_is_counted_on_next_lookup():
+    registry = SchemaRegistry()
+    entry = registry.register(SCHEMA + " Refunds(id, order_id)")
+    base = registry.stats()["bytes"]
+    assert entry.nbytes == base
+
+    foreign_key_index(entry.parsed)
+    assert registry.get(entry.schema_id) is entry
+    assert entry.nbytes > base
+    assert registry.stats()["bytes"] == entry.nbytes
+
+    # Nothing new was derived: the size stays put
+    assert registry.get(entry.schema_id).nbytes == entry.nbytes
+
+
+def test_growth_from_derived_indexes_evicts_older_schemas():
+    registry = SchemaRegistry()
+    older = registry.register(SCHEMA + " Returns(id, order_id)")
+    newer = registry.register(SCHEMA + " Coupons(id, order_id)")
+    registry.max_bytes = registry.stats()["bytes"] + 16
+
+    foreign_key_index(newer.parsed)
+    registry.get(newer.schema_id)
+    assert registry.get(older.schema_id) is None
+    assert registry.get(newer.schema_id) is newer
+    assert registry.stats()["evictions"] == 1
+    assert registry.stats()["bytes"] == newer.nbytes
+
+
+def test_registering_a_schema_with_built_indexes_counts_them():
+    schema = SCHEMA + " Vouchers(id, order_id)"
+    first = SchemaRegistry().register(schema)
+    foreign_key_index(first.parsed)
+    # The parsed schema comes from the shared parse cache, indexes included
+    second = SchemaRegistry().register(schema)
+    assert second.parsed is first.parsed
+    assert second.nbytes > second.base_bytes
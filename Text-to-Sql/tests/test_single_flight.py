@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, callers):
+    """Start a leader blocked in fn, let `callers` more join it, then release it; returns their outcomes."""
+    started, release = threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def call(f):
+        try:
+            return flight.do(key, f)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(callers + 1) as pool:
+        leader = pool.submit(call, leader_fn)
+        started.wait(5)
+        waiters = [pool.submit(call, fn) for _ in range(callers)]
+        while flight.stats()["coalesced"] < callers:
+            pass
+        release.set()
+        return [leader.result(5)] + [waiter.result(5) for waiter in waiters]
+
+
+def test_waiters_share_the_leaders_result():
+    calls = []
+    flight = SingleFlight(enabled=True)
+    results = run_concurrently(flight, "q", lambda: calls.append(1) or "SELECT 1", callers=3)
+    assert results == ["SELECT 1"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"enabled": True, "in_flight": 0, "leaders": 1, "coalesced": 3, "coalesce_rate": 0.75}
+
+
+def test_leader_failure_reaches_waiters_and_frees_the_key():
+    flight = SingleFlight(enabled=True)
+
+    def fail():
+        raise RuntimeError("generation failed")
+
+    results = run_concurrently(flight, "q", fail, callers=2)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()["in_flight"] == 0
+    # The failure is not remembered: the next caller runs again
+    assert flight.do("q", lambda: "SELECT 2") == "SELECT 2"
+
+
+def test_base_exception_in_the_leader_frees_the_key():
+    flight = SingleFlight(enabled=True)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        flight.do("q", interrupted)
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("q", lambda: 3) == 3
+
+
+def test_disabled_runs_every_call():
+    calls = []
+    flight = SingleFlight(enabled=False)
+    for _ in range(3):
+        flight.do("q", lambda: calls.append(1))
+    assert len(calls) == 3
+    assert flight.stats()["leaders"] == 0
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+from sqlparse import keywords
+from sqlparse.lexer import tokenize
+
+import sql_rewrite
+from sql_rewrite import ASCII_CHARACTERS, _rule_prefix, _single_character, lex
+
+FRAGMENTS = ["SELECT", "select", " ", "\n", "\t", "FROM", "t.a", "LEFT OUTER JOIN", "JOIN", "ON", "=", "<>", "'x''y'",
+             '"q"', "--c\n", "/* c */", "$1", "$$x$$", ":p", "?", "%s", "-1.5e3", "0x1F", "(", ")", ",", ";", "`b`",
+             "[n]", "NOT LIKE", "GROUP BY", "ORDER  BY", "é", "ſ", "K", "@v", "#t", "::", ":=", "*", "END IF",
+             "NULLS FIRST", "AT TIME ZONE 'UTC'", "\\cmd", "f(", "1.", ".5", "-x", "||", "{", "~"]
+
+
+def test_fast_lexer_is_in_use():
+    assert sql_rewrite._match_by_first_character is not None
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_lex_matches_sqlparse(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        sql = "".join(rng.choice(FRAGMENTS) + rng.choice(["", " "]) for _ in range(rng.randint(1, 25)))
+        assert lex(sql) == list(tokenize(sql)), sql
+    for _ in range(200):
+        sql = "".join(chr(rng.randint(0, 300)) for _ in range(rng.randint(1, 30)))
+        assert lex(sql) == list(tokenize(sql)), sql
+
+
+@pytest.mark.parametrize("rx, first", [
+    (r":=", ":"),
+    (r"(CASE|AS)\b", "ACac"),
+    (r"-?\d+", "-0123456789"),
+    (r"(?<!\w)[$:?]\w+", "$:?"),
+    (r"(?![_A-Z])-?(\d+(\.\d*)|\.\d+)", "-.0123456789"),
+    (r"((LEFT\s+)?(INNER\s+)?)?JOIN\b", "IJLijl"),
+])
+def test_rule_prefix(rx, first):
+    assert _rule_prefix(rx) == set(first)
+
+
+@pytest.mark.parametrize("rx", [r"a?", r"(a|)", r"(?i)a", r"\x41", r"(a)?\1b"])
+def test_rule_prefix_is_conservative(rx):
+    # Empty matches and syntax the reader does not parse let the rule start anywhere
+    assert _rule_prefix(rx) == set(ASCII_CHARACTERS)
+
+
+def test_single_character_rules():
+    single = {rx for rx, _ in keywords.SQL_REGEX if _single_character(rx)}
+    assert single == {r"\s+?", r"\*", r"\?", r"[;:()\[\],\.]"}
@@ -0,0 +1,186 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Record per-stage timings for every request (otherwise only for requests that ask for debug_timings)
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "0").lower() in ("1", "true", "yes")
+
+# Histogram bucket upper bounds in milliseconds; the last bucket catches everything slower
+HISTOGRAM_BUCKETS_MS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+class Histogram:
+    """Bucketed wall-time distribution of one stage, plus how often a fixer changed the query."""
+
+    __slots__ = ("counts", "count", "total_ms", "max_ms", "changed")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.changed = None  # only counted for stages that report whether they changed the query
+
+    def observe(self, elapsed_ms, changed=None):
+        self.counts[bisect_left(HISTOGRAM_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if changed is not None:
+            self.changed = (self.changed or 0) + bool(changed)
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_ms
+
+    def to_dict(self):
+        summary = {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 4) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": {f"le_{bound}": count for bound, count in zip(HISTOGRAM_BUCKETS_MS, self.counts)},
+        }
+        summary["buckets"]["le_inf"] = self.counts[-1]
+        if self.changed is not None:
+            summary["changed"] = self.changed
+            summary["change_rate"] = round(self.changed / self.count, 4)
+        return summary
+
+
+class StageMetrics:
+    """Aggregated histograms for every traced stage, shared by all requests."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, elapsed_ms, changed=None):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(elapsed_ms, changed)
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: histogram.to_dict() for stage, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+class RequestTrace:
+    """Stage timings of one request, in the order the stages ran."""
+
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages = []
+
+    def record(self, stage, elapsed_ms, changed=None):
+        entry = {"stage": stage, "ms": round(elapsed_ms, 4)}
+        if changed is not None:
+            entry["changed"] = bool(changed)
+        self.stages.append(entry)
+        stage_metrics.record(stage, elapsed_ms, changed)
+
+
+stage_metrics = StageMetrics()
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_trace():
+    """The trace of the request being handled, or None when it is not traced."""
+    return _current_trace.get()
+
+
+class _Stage:
+    __slots__ = ("name", "trace", "start")
+
+    def __init__(self, name, trace):
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.record(self.name, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class _NoStage:
+    """Shared do-nothing context manager, so untraced requests pay one ContextVar lookup per stage."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Time the enclosed block as one stage of the current request's trace."""
+    trace = _current_trace.get()
+    return _NO_STAGE if trace is None else _Stage(name, trace)
+
+
+def run_fixer(name, fixer, query, *args):
+    """Run one SqlQuery pass, recording its wall time and whether it changed the serialized query."""
+    trace = _current_trace.get()
+    if trace is None:
+        return fixer(query, *args)
+    before = query.to_sql()
+    start = time.perf_counter()
+    result = fixer(query, *args)
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    # Some passes return a rebuilt query instead of editing in place
+    after = result if hasattr(result, "to_sql") else query
+    trace.record(name, elapsed_ms, changed=after.to_sql() != before)
+    return result
+
+
+def record_stage(name, elapsed_ms):
+    """Record a stage that ran outside any request (e.g. a shared generate call) into the histograms only."""
+    if TRACING_ENABLED:
+        stage_metrics.record(name, elapsed_ms)
+
+
+class trace_request:
+    """Trace the enclosed request when tracing is enabled or the caller asked for debug timings.
+
+    Yields the RequestTrace, or None when the request is not traced.
+    """
+
+    __slots__ = ("debug", "trace", "token")
+
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    def __enter__(self):
+        self.trace = RequestTrace() if TRACING_ENABLED or self.debug else None
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        _current_trace.reset(self.token)
+        return False
@@ -1,6 +1,6 @@
 const Chat = require('../models/chat');
 const User = require('../models/user');
-const { generateTitle } = require('../utils/aiService');
+const { generateTitle, generateSQL } = require('../utils/aiService');
 const axios = require('axios');
 const TextToSQL = require('../models/TextToSQL');
 const Database = require('../models/database');
@@ -101,12 +101,7 @@ const addMessage = async (req, res) => {
             console.log("📚 Using schema:", activeDatabase.schema);
 
             
-            const flaskResponse = await axios.post('http://127.0.0.1:5003/nl-to-sql', {
-                question: naturalQuery,
-                schema: activeDatabase.schema
-            });
-
-            const sqlQuery = flaskResponse.data.sql_query;
+            const sqlQuery = await generateSQL(naturalQuery, activeDatabase.schema);
 
           
             const newTextToSQL = new TextToSQL({
@@ -1,3 +1,4 @@
+const crypto = require("crypto");
 const { default: axios } = require("axios");
 
 const generateTitle = async (text) => {
@@ -14,4 +15,60 @@ const generateTitle = async (text) => {
     }
 };
 
-module.exports = { generateTitle };
+// sha256 of the schema text -> schema_id returned by the text-to-SQL service's POST /schemas,
+// least recently used first; bounded so a backend serving many databases does not grow without limit
+const MAX_REGISTERED_SCHEMAS = parseInt(process.env.MAX_REGISTERED_SCHEMAS || '1000', 10);
+const registeredSchemas = new Map();
+
+const schemaKey = (schema) => crypto.createHash('sha256').update(schema).digest('hex');
+
+const rememberSchema = (key, schemaId) => {
+    registeredSchemas.delete(key);
+    registeredSchemas.set(key, schemaId);
+    while (registeredSchemas.size > MAX_REGISTERED_SCHEMAS) {
+        registeredSchemas.delete(registeredSchemas.keys().next().value);
+    }
+};
+
+const registerSchema = async (schema, key) => {
+    const response = await axios.post('http://127.0.0.1:5003/schemas', { schema });
+    rememberSchema(key, response.data.schema_id);
+    return response.data.schema_id;
+};
+
+const isUnknownSchema = (error) => error.response && error.response.status === 404;
+
+const generateSQL = async (question, schema) => {
+    const key = schemaKey(schema);
+    let schemaId = registeredSchemas.get(key);
+    if (schemaId) {
+        rememberSchema(key, schemaId);
+    } else {
+        schemaId = await registerSchema(schema, key);
+    }
+    try {
+        const response = await axios.post('http://127.0.0.1:5003/nl-to-sql', { question, schema_id: schemaId });
+        return response.data.sql_query;
+    } catch (error) {
+        if (!isUnknownSchema(error)) {
+            throw error;
+        }
+    }
+    // The service evicts schemas under memory pressure, loses them on restart, and with several
+    // worker processes each worker has its own registry; register again and retry once
+    try {
+        schemaId = await registerSchema(schema, key);
+        const response = await axios.post('http://127.0.0.1:5003/nl-to-sql', { question, schema_id: schemaId });
+        return response.data.sql_query;
+    } catch (error) {
+        if (!isUnknownSchema(error)) {
+            throw error;
+        }
+    }
+    // The retry reached yet another worker: send the schema with its id, which any worker answers
+    // and registers, so later requests carrying just the id find it there too
+    const response = await axios.post('http://127.0.0.1:5003/nl-to-sql', { question, schema_id: schemaId, schema });
+    return response.data.sql_query;
+};
+
+module.exports = { generateTitle, generateSQL };
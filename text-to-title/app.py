@@ -1,7 +1,14 @@
+import time
+
+# Startup timings count from the first line of the module
+STARTUP_STARTED = time.perf_counter()
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from inference_backend import CONVERT_CHECKPOINT, convert_checkpoint, load_seq2seq_model
 import logging
+import os
+import threading
 
 # Initialize Flask App
 app = Flask(__name__)
@@ -9,13 +16,100 @@ CORS(app)
 
 # Load the Model and Tokenizer
 MODEL_PATH = "./models"
+PORT = int(os.environ.get("PORT", 5002))
 model_name = "google/roberta2roberta_L-24_gigaword"
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
 logging.basicConfig(level=logging.INFO)
+# python app.py starts serving at once and loads the model (torch / transformers imports included) on a
+# background thread; importing the module (prefork.py) loads it right away
+BACKGROUND_MODEL_LOAD = os.environ.get("BACKGROUND_MODEL_LOAD", "1").lower() in ("1", "true", "yes")
+# Seconds a request waits for a background load before answering 503
+MODEL_LOAD_WAIT_S = float(os.environ.get("MODEL_LOAD_WAIT_S", 300))
+# Titles generated before reporting ready; 0 reports ready right after loading
+WARM_UP_GENERATIONS = int(os.environ.get("WARM_UP_GENERATIONS", 1))
+
+# Set by load_model(); model_loaded is set once it has finished, loaded or not
+tokenizer, model, inference_backend = None, None, None
+model_loaded = threading.Event()
+# Set once a warm-up inference has run in this process, or in the prefork parent it was forked from
+model_ready = threading.Event()
+
+# Milliseconds spent in each startup step, in order
+startup_timings = {"imports_ms": round((time.perf_counter() - STARTUP_STARTED) * 1000.0, 1)}
+
+
+def record_startup(step, start):
+    """Record the time since start for a startup step; returns the current time for the next step."""
+    now = time.perf_counter()
+    startup_timings[f"{step}_ms"] = round((now - start) * 1000.0, 1)
+    return now
+
+
+def load_model():
+    """Import transformers (and torch with it) and load the tokenizer and model."""
+    global tokenizer, model, inference_backend
+    try:
+        start = time.perf_counter()
+        from transformers import AutoTokenizer
+        start = record_startup("transformers_import", start)
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+        start = record_startup("tokenizer", start)
+        # INFERENCE_BACKEND=onnx runs the exported graphs on ONNX Runtime (python inference_backend.py export)
+        model, inference_backend = load_seq2seq_model(MODEL_PATH)
+        start = record_startup("model", start)
+        if CONVERT_CHECKPOINT:
+            # Once per checkpoint: later starts memory-map safetensors and read the fast tokenizer directly
+            convert_checkpoint(MODEL_PATH, model if inference_backend == "pytorch" else None, tokenizer)
+            record_startup("convert", start)
+        logging.info(f"Loaded {MODEL_PATH} with the {inference_backend} backend")
+    except Exception as e:
+        logging.error(f"Error loading model/tokenizer: {str(e)}")
+        tokenizer, model, inference_backend = None, None, None
+    model_loaded.set()
+
+
+if __name__ != '__main__' or not BACKGROUND_MODEL_LOAD:
+    load_model()
+
+
+def warm_up():
+    """Generate WARM_UP_GENERATIONS titles so the first request does not pay for lazy initialization;
+    then log the startup breakdown and report ready."""
+    start = time.perf_counter()
+    inputs = tokenizer.encode("summarize: warm-up request", return_tensors="pt", max_length=512, truncation=True)
+    for _ in range(WARM_UP_GENERATIONS):
+        model.generate(inputs, max_length=10, min_length=5, num_beams=6, early_stopping=True)
+    record_startup("warm_up", start)
+    startup_timings["ready_ms"] = round((time.perf_counter() - STARTUP_STARTED) * 1000.0, 1)
+    logging.info(f"Ready after {startup_timings['ready_ms']:.0f} ms: " + ", ".join(
+        f"{step[:-3]} {ms:.0f} ms" for step, ms in startup_timings.items() if step != "ready_ms"))
+    model_ready.set()
+
+
+def load_and_warm_up():
+    if not model_loaded.is_set():
+        load_model()
+    if model is not None:
+        warm_up()
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 only once a warm-up inference has completed."""
+    if not model_ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True})
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Startup breakdown of this process (milliseconds per step)."""
+    return jsonify({"backend": inference_backend, "startup": startup_timings})
 
 @app.route('/generate-title', methods=['POST'])
 def generate_title():
+    if not model_loaded.wait(MODEL_LOAD_WAIT_S):
+        return jsonify({"error": "Model is still loading, please retry."}), 503
+    if model is None:
+        return jsonify({"error": "Model and tokenizer failed to load. Check logs."}), 500
     try:
         logging.info("Received request")
         input_data = request.json
@@ -45,6 +139,7 @@ def generate_title():
         logging.error(f"Error occurred: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-# Run the Flask App
+# Run the Flask App (single process; python prefork.py forks workers sharing the model)
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002)
+    threading.Thread(target=load_and_warm_up, name="model-load", daemon=True).start()
+    app.run(host='0.0.0.0', port=PORT)
@@ -2,19 +2,37 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import subprocess
 import os
+import threading
 import uuid
+import numpy as np
 import whisper
 import torch
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 UPLOAD_FOLDER = './uploads'
+PORT = int(os.environ.get("PORT", 5001))
 
 # Remove incorrect binary paths and use whisper Python library directly
 model = whisper.load_model("medium")
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Set once a warm-up inference has run in this process, or in the prefork parent it was forked from
+model_ready = threading.Event()
+
+def warm_up():
+    """Transcribe one second of silence so the first request does not pay for lazy initialization."""
+    model.transcribe(np.zeros(16000, dtype=np.float32), fp16=torch.cuda.is_available())
+    model_ready.set()
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 only once a warm-up inference has completed."""
+    if not model_ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True})
+
 def convert_to_wav(audio_path):
     """Convert any audio to 16-bit PCM WAV format."""
     converted_path = audio_path.replace(".wav", "_converted.wav")
@@ -59,4 +77,7 @@ def transcribe_audio():
             os.remove(audio_path)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # Single-process server; on CPU-only hosts python prefork.py forks workers sharing the model
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    # The reloader would import this module, and load the model, a second time
+    app.run(host='0.0.0.0', port=PORT, debug=True, use_reloader=False)
@@ -0,0 +1,135 @@
+"""
+Pre-forked production server. The parent imports app.py (loading the model once), freezes the model,
+runs one warm-up inference and then forks worker processes that share the weight pages copy-on-write
+and accept connections on one listening socket:
+    python prefork.py --workers 4
+
+python app.py stays the single-process development server. Each worker keeps the in-process state
+app.py creates (caches, batchers, /stats) to itself; see the service's app.py for what is shared.
+
+Text-to-Sql, text-to-title and whisper-api run from their own directories and environments, so
+each has a copy of this file; the copies are kept identical (Text-to-Sql/tests/test_prefork.py).
+Service-specific settings come from app.py: PORT, app, model, warm_up().
+
+For CPU inference only: a model on a GPU (whisper-api picks CUDA when there is one) cannot be used
+from forked workers, so serve() refuses to fork once CUDA is initialized.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+
+from werkzeug.serving import make_server
+
+# Worker processes forked from the parent
+PREFORK_WORKERS = int(os.environ.get("PREFORK_WORKERS", 2))
+# Torch intra-op threads per worker; 0 splits the cores evenly so workers do not oversubscribe them
+TORCH_THREADS_PER_WORKER = int(os.environ.get("TORCH_THREADS_PER_WORKER", 0))
+
+
+def freeze_model(model):
+    """Inference only: eval mode and no parameter gradients (ONNX Runtime models are left as they are)."""
+    import torch
+
+    if isinstance(model, torch.nn.Module):
+        model.eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+    return model
+
+
+def threads_per_worker(workers, threads=TORCH_THREADS_PER_WORKER):
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+def run_worker(app, listener, threads):
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_grad_enabled(False)
+    host, port = listener.getsockname()[:2]
+    make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+def serve(app, warm_up, host, port, workers, threads=None):
+    """Bind, warm up, fork the workers and replace any that die, until SIGTERM / SIGINT."""
+    # Imported here, not at the top: a multiprocessing worker started by the service re-runs this
+    # file as __mp_main__ and does not need torch
+    import torch
+
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+    # Warm up single-threaded: an intra-op thread pool started here would not survive the fork
+    torch.set_num_threads(1)
+    warm_up()
+    if torch.cuda.is_initialized():
+        # A forked child cannot use its parent's CUDA context: every worker would fail on its first request
+        raise SystemExit("The model is on a GPU, which forked workers cannot share; run python app.py instead.")
+    # Objects that exist now are never scanned by the collector, which would otherwise copy their pages per worker
+    gc.freeze()
+    threads = threads or threads_per_worker(workers)
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(app, listener, threads)
+            finally:
+                os._exit(1)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port}: {workers} workers x {threads} torch threads (parent pid {os.getpid()}).")
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited; starting a replacement.")
+            time.sleep(1)  # a worker that crashes on start must not turn this into a busy loop
+            spawn()
+
+
+def main():
+    # Workers run side by side, so the tokenizer's own thread pool would only oversubscribe the cores
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import app as service
+
+    parser = argparse.ArgumentParser(description="Pre-forked production server for app.py")
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--threads", type=int, default=TORCH_THREADS_PER_WORKER,
+                        help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=service.PORT)
+    args = parser.parse_args()
+
+    if service.model is None:
+        raise SystemExit("Model failed to load; not starting workers.")
+    freeze_model(service.model)
+    serve(service.app, service.warm_up, args.host, args.port, args.workers, args.threads)
+
+
+if __name__ == "__main__":
+    main()